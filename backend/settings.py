@@ -160,14 +160,45 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Where uploads are stored: 'local', 's3' or 'cloudinary' (see core.media);
+# empty follows USE_CLOUDINARY / USE_S3
+MEDIA_BACKEND = os.environ.get('MEDIA_BACKEND', '')
+# Serve media files through the front-end server instead of streaming them
+# from a worker: 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd)
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '')
+# nginx internal location aliasing MEDIA_ROOT, used with x-accel-redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+# Threads per process copying uploads to the remote backend and encoding variants
+MEDIA_JOB_WORKERS = int(os.environ.get('MEDIA_JOB_WORKERS', '2'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Channels configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+# Set REDIS_URL to share the layer between processes (required for more than
+# one daphne worker); without it the in-memory layer only reaches the local process.
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                # Messages a channel or group member may queue before sends are dropped
+                'capacity': int(os.environ.get('CHANNEL_LAYER_CAPACITY', '1500')),
+                # Seconds an undelivered message is kept
+                'expiry': int(os.environ.get('CHANNEL_LAYER_EXPIRY', '60')),
+                # Seconds a group membership lives without being renewed
+                'group_expiry': int(os.environ.get('CHANNEL_LAYER_GROUP_EXPIRY', '86400')),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
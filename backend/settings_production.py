@@ -271,13 +271,37 @@ elif os.environ.get('USE_S3', 'False').lower() == 'true':
     MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/media/'
     STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/static/'
 
+# Where uploads are stored: 'local', 's3' or 'cloudinary' (see core.media);
+# empty follows USE_CLOUDINARY / USE_S3
+MEDIA_BACKEND = os.environ.get('MEDIA_BACKEND', '')
+# Serve media files through the front-end server instead of streaming them
+# from a worker: 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd)
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '')
+# nginx internal location aliasing MEDIA_ROOT, used with x-accel-redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+# Threads per process copying uploads to the remote backend and encoding variants
+MEDIA_JOB_WORKERS = int(os.environ.get('MEDIA_JOB_WORKERS', '2'))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Channels configuration for production
+# Redis carries group messages between daphne workers so a booking event sent
+# by one process reaches dashboards connected to any other.
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            'hosts': [REDIS_URL],
+            # Messages a channel or group member may queue before sends are dropped
+            'capacity': int(os.environ.get('CHANNEL_LAYER_CAPACITY', '1500')),
+            # Seconds an undelivered message is kept
+            'expiry': int(os.environ.get('CHANNEL_LAYER_EXPIRY', '60')),
+            # Seconds a group membership lives without being renewed
+            'group_expiry': int(os.environ.get('CHANNEL_LAYER_GROUP_EXPIRY', '86400')),
+        },
     },
 }
 
@@ -49,16 +49,17 @@ urlpatterns = [
     path('test-image-upload/', TemplateView.as_view(template_name='test_image_upload.html'), name='test_image_upload'),
 ]
 
-# Serve static and media files
+# Serve static and media files, with ETag / Last-Modified revalidation and ranges
+from core.file_serving import serve
+
 if settings.DEBUG:
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.STATIC_URL, view=serve, document_root=settings.STATIC_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=serve, document_root=settings.MEDIA_ROOT, image_variants=True)
 else:
     # Serve media files in production
-    from django.views.static import serve
     from django.urls import re_path
     urlpatterns += [
-        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT, 'image_variants': True}),
     ]
     # Also serve static files in production
     urlpatterns += [
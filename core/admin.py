@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PhoneOTP, ReservedSlot, Profile, Service, SubService, BookingSettings
+from .models import PhoneOTP, ReservedSlot, BookingDailyStat, MediaBlob, MediaReference, MediaUploadJob, Profile, Service, SubService, BookingSettings
 
 
 @admin.register(PhoneOTP)
@@ -16,6 +16,36 @@ class ReservedSlotAdmin(admin.ModelAdmin):
     search_fields = ['user__first_name', 'user__last_name', 'service_name']
 
 
+@admin.register(BookingDailyStat)
+class BookingDailyStatAdmin(admin.ModelAdmin):
+    list_display = ['date', 'service_name', 'status', 'count']
+    list_filter = ['status', 'date']
+    search_fields = ['service_name']
+    ordering = ['-date', 'service_name', 'status']
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'backend', 'size', 'created_at']
+    list_filter = ['backend', 'created_at']
+    search_fields = ['digest', 'name']
+
+
+@admin.register(MediaReference)
+class MediaReferenceAdmin(admin.ModelAdmin):
+    list_display = ['model', 'object_id', 'field', 'digest']
+    list_filter = ['model', 'field']
+    search_fields = ['digest', 'object_id']
+
+
+@admin.register(MediaUploadJob)
+class MediaUploadJobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'source_name', 'backend', 'status', 'attempts', 'updated_at']
+    list_filter = ['kind', 'status', 'backend']
+    search_fields = ['source_name', 'target_id', 'error']
+    ordering = ['-created_at']
+
+
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'gender', 'country']
@@ -0,0 +1,234 @@
+"""
+Slot availability engine shared by the booking endpoints
+"""
+from datetime import date, time, timedelta
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from .cache_versions import bump_version, get_version
+from .models import ReservedSlot, BookingDailyStat
+
+
+def time_to_minutes(value):
+    """Convert a time to minutes since midnight"""
+    return value.hour * 60 + value.minute
+
+
+def minutes_to_time(minutes):
+    """Convert minutes since midnight back to a time"""
+    return time((minutes // 60) % 24, minutes % 60)
+
+
+class SlotAlreadyReserved(Exception):
+    """Raised when an upcoming reservation already holds the requested slot"""
+
+
+def reserve_slot(**fields):
+    """
+    Create a ReservedSlot, relying on the unique_upcoming_reserved_slot
+    constraint instead of a check-then-insert.
+
+    The insert runs in its own savepoint so a conflict leaves any surrounding
+    transaction usable. Only a conflict on the slot itself is reported as
+    SlotAlreadyReserved; other integrity errors are re-raised.
+    """
+    try:
+        with transaction.atomic():
+            return ReservedSlot.objects.create(**fields)
+    except IntegrityError:
+        if fields.get('status', 'upcoming') == 'upcoming' and ReservedSlot.objects.filter(
+            booking_date=fields.get('booking_date'),
+            booking_time=fields.get('booking_time'),
+            status='upcoming'
+        ).exists():
+            raise SlotAlreadyReserved()
+        raise
+
+
+def save_reserved_slot(slot, **kwargs):
+    """Save an existing ReservedSlot, reporting slot conflicts as SlotAlreadyReserved"""
+    try:
+        with transaction.atomic():
+            slot.save(**kwargs)
+    except IntegrityError:
+        if slot.status == 'upcoming' and ReservedSlot.objects.filter(
+            booking_date=slot.booking_date,
+            booking_time=slot.booking_time,
+            status='upcoming'
+        ).exclude(pk=slot.pk).exists():
+            raise SlotAlreadyReserved()
+        raise
+
+
+class DayAvailability:
+    """
+    Occupancy bitmap for one day's slot grid.
+
+    The grid runs from start_hour to end_hour in steps of duration_minutes,
+    and a slot is only offered if it ends within working hours. The day's
+    upcoming reservations are loaded with a single query and mapped onto the
+    grid, so answering the whole day costs O(slots) with no further queries.
+    """
+
+    def __init__(self, booking_date, start_hour, end_hour, duration_minutes):
+        self.booking_date = booking_date
+        self.start_minute = start_hour * 60
+        self.end_minute = end_hour * 60
+        self.duration_minutes = duration_minutes
+
+        if duration_minutes > 0:
+            last_start = self.end_minute - duration_minutes
+            self.slot_starts = list(range(self.start_minute, last_start + 1, duration_minutes))
+        else:
+            self.slot_starts = []
+
+        self.bitmap = bytearray(len(self.slot_starts))
+        self.loaded = False
+
+    @classmethod
+    def from_settings(cls, booking_date, settings):
+        """Build the grid from a BookingSettings row"""
+        return cls(
+            booking_date,
+            settings.WORKING_HOURS_START,
+            settings.WORKING_HOURS_END,
+            settings.DEFAULT_RESERVATION_DURATION_MINUTES,
+        )
+
+    def slot_index(self, booking_time):
+        """Return the grid index for a slot start time, or None if off-grid"""
+        if booking_time.second or booking_time.microsecond:
+            return None
+        offset = time_to_minutes(booking_time) - self.start_minute
+        if offset < 0 or offset % self.duration_minutes:
+            return None
+        index = offset // self.duration_minutes
+        if index >= len(self.slot_starts):
+            return None
+        return index
+
+    def mark_reserved(self, reserved_times):
+        """Mark the slots starting at the given times as occupied"""
+        for booking_time in reserved_times:
+            index = self.slot_index(booking_time)
+            if index is not None:
+                self.bitmap[index] = 1
+
+    def load(self):
+        """Load the day's upcoming reservations with exactly one query"""
+        if not self.loaded:
+            if self.slot_starts:
+                reserved_times = ReservedSlot.objects.filter(
+                    booking_date=self.booking_date,
+                    status='upcoming'
+                ).values_list('booking_time', flat=True)
+                self.mark_reserved(reserved_times)
+            self.loaded = True
+        return self
+
+    def is_reserved(self, booking_time):
+        """Check whether the slot starting at booking_time is taken"""
+        self.load()
+        index = self.slot_index(booking_time)
+        return index is not None and bool(self.bitmap[index])
+
+    def iter_slots(self):
+        """Yield (start_time, end_time, is_reserved) for every slot in the grid"""
+        self.load()
+        for index, start in enumerate(self.slot_starts):
+            yield (
+                minutes_to_time(start),
+                minutes_to_time(start + self.duration_minutes),
+                bool(self.bitmap[index]),
+            )
+
+    def available_count(self):
+        """Number of free slots in the grid"""
+        self.load()
+        return len(self.bitmap) - sum(self.bitmap)
+
+
+CALENDAR_CACHE_TIMEOUT = 60 * 60
+
+
+def settings_version(settings):
+    """Version tag for a BookingSettings row, changes whenever the row is saved"""
+    return f"{settings.pk}:{settings.updated_at.timestamp() if settings.updated_at else 0}"
+
+
+def month_bounds(year, month):
+    """Return the first day of the month and the first day of the next month"""
+    start_date = date(year, month, 1)
+    if month == 12:
+        end_date = date(year + 1, 1, 1)
+    else:
+        end_date = date(year, month + 1, 1)
+    return start_date, end_date
+
+
+def month_calendar_version_key(year, month):
+    return f"booking_calendar:{year}-{month:02d}:version"
+
+
+def month_calendar_cache_key(year, month, month_version):
+    return f"booking_calendar:{year}-{month:02d}:{month_version}"
+
+
+def get_month_calendar(year, month, settings):
+    """
+    Return the calendar days of a month with their upcoming reservation counts.
+
+    Counts come from a single query over the BookingDailyStat rollup, so the
+    cost is bounded by the days in the month rather than by bookings. The
+    result is cached per (year, month, settings version) under a per-month
+    version token, which is replaced whenever a reservation in that month is
+    written, see invalidate_month_calendar. The token is read before the
+    query, so counts read before a write commits are stored under the old
+    token and never served after it.
+    """
+    version = settings_version(settings)
+    cache_key = month_calendar_cache_key(year, month, get_version(month_calendar_version_key(year, month)))
+    cached = cache.get(cache_key)
+    if cached and cached['settings_version'] == version:
+        return cached['days']
+
+    start_date, end_date = month_bounds(year, month)
+    counts = dict(
+        BookingDailyStat.objects.filter(
+            date__gte=start_date,
+            date__lt=end_date,
+            status='upcoming'
+        ).order_by().values('date').annotate(
+            total=Sum('count')
+        ).values_list('date', 'total')
+    )
+
+    off_days = set(settings.get_off_days_list())
+    days = []
+    current_date = start_date
+    while current_date < end_date:
+        day_of_week = current_date.weekday()
+        days.append({
+            "date": current_date.strftime('%Y-%m-%d'),
+            "day": current_date.day,
+            "day_name": current_date.strftime('%A'),
+            "is_off_day": day_of_week in off_days,
+            "reserved_count": counts.get(current_date, 0),
+            "is_weekend": day_of_week >= 5,
+        })
+        current_date += timedelta(days=1)
+
+    cache.set(cache_key, {'settings_version': version, 'days': days}, CALENDAR_CACHE_TIMEOUT)
+    return days
+
+
+def invalidate_month_calendar(*booking_dates):
+    """Replace the version token of every month touched by the given dates"""
+    date_field = ReservedSlot._meta.get_field('booking_date')
+    months = set()
+    for booking_date in booking_dates:
+        booking_date = date_field.to_python(booking_date)
+        if booking_date:
+            months.add((booking_date.year, booking_date.month))
+    for year, month in months:
+        bump_version(month_calendar_version_key(year, month))
@@ -0,0 +1,52 @@
+"""
+Process-local provider for the active BookingSettings row.
+
+The active row changes rarely, so each worker keeps it in memory together with
+its parsed off-day set. A version token in the shared cache is bumped whenever
+a BookingSettings row is written; workers compare it on every read and reload
+from the database only when it has moved.
+"""
+import threading
+from .cache_versions import bump_version, get_version
+from .models import BookingSettings
+
+
+SETTINGS_VERSION_KEY = 'booking_settings:version'
+
+_lock = threading.Lock()
+# (version, settings, off_days), replaced as a whole so readers never see a mix
+_cached = (None, None, frozenset())
+
+
+def get_settings_version():
+    """Return the shared settings version, creating one if the cache has none"""
+    return get_version(SETTINGS_VERSION_KEY)
+
+
+def bump_settings_version():
+    """Invalidate the cached settings in every worker"""
+    bump_version(SETTINGS_VERSION_KEY)
+
+
+def _load(version):
+    global _cached
+    with _lock:
+        if _cached[0] != version:
+            settings = BookingSettings.objects.filter(is_active=True).first()
+            off_days = frozenset(settings.get_off_days_list()) if settings else frozenset()
+            _cached = (version, settings, off_days)
+        return _cached[1], _cached[2]
+
+
+def get_active_settings():
+    """
+    Return (settings, off_days) for the active BookingSettings row.
+
+    settings is None when no row is active. The returned instance is shared by
+    every request in the worker and must be treated as read-only.
+    """
+    version = get_settings_version()
+    cached_version, settings, off_days = _cached
+    if cached_version == version:
+        return settings, off_days
+    return _load(version)
@@ -0,0 +1,152 @@
+"""
+Booking statistics for the admin dashboard.
+
+Counts are read from the BookingDailyStat rollup, which holds one row per
+(date, service_name, status) and is adjusted by the booking write signals in
+the same transaction as the write. A single conditional aggregate over the
+rollup answers every counter, with popular services as the only second query,
+so the cost grows with the number of days rather than bookings. Results are
+cached per (start_date, end_date) for a short time; booking writes move a
+shared generation token so cached results are dropped on the next poll.
+"""
+from datetime import date, timedelta
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from .cache_versions import bump_version, get_version
+from .models import ReservedSlot, BookingDailyStat
+
+
+STATS_CACHE_TIMEOUT = 30
+STATS_GENERATION_KEY = 'booking_stats:generation'
+
+
+def get_stats_generation():
+    return get_version(STATS_GENERATION_KEY)
+
+
+def bump_stats_generation():
+    """Invalidate every cached stats result"""
+    bump_version(STATS_GENERATION_KEY)
+
+
+def stats_periods(today):
+    """Return the (start, end) bounds of the week and month containing today"""
+    week_start = today - timedelta(days=today.weekday())
+    week_end = week_start + timedelta(days=6)
+    month_start = today.replace(day=1)
+    if today.month == 12:
+        month_end = today.replace(year=today.year + 1, month=1, day=1)
+    else:
+        month_end = today.replace(month=today.month + 1, day=1)
+    return (week_start, week_end), (month_start, month_end)
+
+
+def compute_booking_stats(start_date=None, end_date=None, today=None):
+    """Compute the dashboard statistics from the rollup with two queries"""
+    today = today or date.today()
+    (week_start, week_end), (month_start, month_end) = stats_periods(today)
+
+    rollup = BookingDailyStat.objects.order_by()
+    if start_date:
+        rollup = rollup.filter(date__gte=start_date)
+    if end_date:
+        rollup = rollup.filter(date__lte=end_date)
+
+    counts = rollup.aggregate(
+        total_bookings=Sum('count'),
+        upcoming_bookings=Sum('count', filter=Q(status='upcoming')),
+        cancelled_bookings=Sum('count', filter=Q(status='cancelled')),
+        completed_bookings=Sum('count', filter=Q(status='completed')),
+        today_bookings=Sum('count', filter=Q(date=today)),
+        week_bookings=Sum('count', filter=Q(date__gte=week_start, date__lte=week_end)),
+        month_bookings=Sum('count', filter=Q(date__gte=month_start, date__lt=month_end)),
+    )
+    # SUM over no rows is NULL
+    counts = {key: value or 0 for key, value in counts.items()}
+
+    popular_services = rollup.values('service_name').annotate(
+        count=Sum('count')
+    ).filter(count__gt=0).order_by('-count')[:5]
+
+    counts['popular_services'] = list(popular_services)
+    return counts
+
+
+def get_booking_stats(start_date=None, end_date=None):
+    """Return cached statistics for the date range, computing them on a miss"""
+    today = date.today()
+    cache_key = 'booking_stats:{}:{}:{}:{}'.format(
+        get_stats_generation(),
+        today.isoformat(),
+        start_date.isoformat() if start_date else '',
+        end_date.isoformat() if end_date else '',
+    )
+    stats = cache.get(cache_key)
+    if stats is None:
+        stats = compute_booking_stats(start_date, end_date, today)
+        cache.set(cache_key, stats, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def booking_stat_key(booking):
+    """Rollup key (date, service_name, status) of a booking's current values"""
+    return (booking.booking_date, booking.service_name, booking.status)
+
+
+def apply_booking_delta(key, delta):
+    """Add delta to the rollup row for key, creating it if needed"""
+    if key is None or not delta:
+        return
+    booking_date, service_name, slot_status = key
+    booking_date = ReservedSlot._meta.get_field('booking_date').to_python(booking_date)
+    rows = BookingDailyStat.objects.filter(date=booking_date, service_name=service_name, status=slot_status)
+    if rows.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            BookingDailyStat.objects.create(
+                date=booking_date, service_name=service_name, status=slot_status, count=delta
+            )
+    except IntegrityError:
+        # Another writer created the row first
+        rows.update(count=F('count') + delta)
+
+
+def record_booking_change(old_key, new_key):
+    """Move one booking from old_key to new_key in the rollup; either may be None"""
+    if old_key == new_key:
+        return
+    apply_booking_delta(old_key, -1)
+    apply_booking_delta(new_key, 1)
+
+
+def rebuild_daily_stats(start_date=None, end_date=None):
+    """
+    Recompute the rollup from ReservedSlot rows for an optional date range.
+
+    Returns the number of rollup rows written.
+    """
+    bookings = ReservedSlot.objects.order_by()
+    rollup = BookingDailyStat.objects.all()
+    if start_date:
+        bookings = bookings.filter(booking_date__gte=start_date)
+        rollup = rollup.filter(date__gte=start_date)
+    if end_date:
+        bookings = bookings.filter(booking_date__lte=end_date)
+        rollup = rollup.filter(date__lte=end_date)
+
+    with transaction.atomic():
+        rollup.delete()
+        rows = bookings.values('booking_date', 'service_name', 'status').annotate(count=Count('id'))
+        created = BookingDailyStat.objects.bulk_create([
+            BookingDailyStat(
+                date=row['booking_date'],
+                service_name=row['service_name'],
+                status=row['status'],
+                count=row['count'],
+            )
+            for row in rows.iterator()
+        ], batch_size=1000)
+    transaction.on_commit(bump_stats_generation)
+    return len(created)
@@ -0,0 +1,22 @@
+"""
+Version tokens in the shared cache.
+
+A token names the current generation of some cached data. Readers fold it
+into their cache keys or compare it with what they loaded; writers replace it
+to invalidate every copy at once, in every worker. Tokens never expire.
+"""
+import uuid
+from django.core.cache import cache
+
+
+def get_version(key):
+    """Return the token stored at key, creating one if the cache has none"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    cache.set(key, uuid.uuid4().hex, None)
@@ -1,27 +1,88 @@
+import asyncio
 import json
+import logging
+from collections import deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
-from .models import ReservedSlot
-from .serializer import ReservedSlotSerializer
+from .events import (
+    BOOKINGS_GROUP, InvalidTopic, batch_frame, bind_server_loop, numbered_frames_since, replay_frames,
+    snapshot_frame, topic_group,
+)
+
+
+logger = logging.getLogger(__name__)
 
 
 class BookingConsumer(AsyncWebsocketConsumer):
+    """
+    Admin booking stream. A connection receives every booking event until it
+    subscribes to topics (date:YYYY-MM-DD, service:<name>); from then on it
+    only receives events matching one of them.
+
+    Group events are not sent from the channel layer handler. They go into a
+    bounded per-connection outbox drained by a sender task, so a slow client
+    never stops the consumer from reading its channel. The socket accepts
+    writes without waiting for the client, so a client that wants flow control
+    acknowledges frames with {"type": "ack", "seq": N}; from its first ack on,
+    at most BOOKING_STREAM_SEND_WINDOW frames are sent ahead of its latest ack
+    and the rest wait in the outbox. When the outbox is full it is dropped and
+    the client is sent a resync snapshot in its place.
+
+    A connection subscribed to several topics is in several groups, and an
+    event matching more than one of them arrives once per group. The consumer
+    remembers the sequence numbers it has queued recently and forwards each
+    event once.
+    """
+    send_queue_size = getattr(settings, 'BOOKING_STREAM_SEND_QUEUE_SIZE', 100)
+    send_window = getattr(settings, 'BOOKING_STREAM_SEND_WINDOW', 32)
+    # Recent sequence numbers kept for spotting an event delivered by two groups
+    seen_seqs_size = 1000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # topic -> channel layer group
+        self.topics = {}
+        self.outbox = deque()
+        self.outbox_ready = asyncio.Event()
+        self.resync_pending = False
+        # Sequence numbers of frames sent but not yet acknowledged
+        self.in_flight = deque()
+        self.acks_enabled = False
+        self.sender = None
+        self.seen_seqs = set()
+        self.seen_order = deque()
+        self.metrics = {'sent': 0, 'dropped': 0, 'duplicates': 0, 'resyncs': 0, 'max_queue_depth': 0}
+
+    def subscribed_groups(self):
+        return set(self.topics.values()) or {BOOKINGS_GROUP}
+
     async def connect(self):
+        # The event dispatcher sends on this loop when the channel layer is in-memory
+        bind_server_loop(asyncio.get_running_loop())
         # Join admin booking room
-        self.room_group_name = 'admin_bookings'
         await self.channel_layer.group_add(
-            self.room_group_name,
+            BOOKINGS_GROUP,
             self.channel_name
         )
         await self.accept()
+        self.sender = asyncio.ensure_future(self.send_outbox())
 
     async def disconnect(self, close_code):
-        # Leave admin booking room
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        # Leave admin booking room or topic groups
+        for group in self.subscribed_groups():
+            await self.channel_layer.group_discard(
+                group,
+                self.channel_name
+            )
+        if self.sender:
+            self.sender.cancel()
+        if self.metrics['dropped']:
+            logger.info('Booking stream closed after dropping frames: %s', self.get_metrics())
+
+    def get_metrics(self):
+        return {'queue_depth': len(self.outbox), 'in_flight': len(self.in_flight), **self.metrics}
 
     # Receive message from WebSocket
     async def receive(self, text_data):
@@ -30,77 +91,170 @@ class BookingConsumer(AsyncWebsocketConsumer):
         
         if message_type == 'get_bookings':
             # Send current bookings to client
-            bookings = await self.get_latest_bookings()
+            await self.send_snapshot()
+        elif message_type == 'resume':
+            # Replay the events missed since last_seq, or a snapshot if the gap is too large
+            try:
+                last_seq = int(text_data_json.get('last_seq'))
+            except (TypeError, ValueError):
+                await self.send_snapshot(resync=True)
+                return
+            frames, seq = await sync_to_async(numbered_frames_since)(last_seq, self.subscribed_groups())
+            if frames is None:
+                await self.send_snapshot(resync=True)
+                return
+            # Replayed frames share the outbox and send window with live events
+            for frame_seq, frame in frames:
+                if frame_seq in self.seen_seqs:
+                    self.metrics['duplicates'] += 1
+                    continue
+                self.remember_seqs([frame_seq])
+                self.queue_frame(frame, frame_seq)
+            self.queue_frame(json.dumps({
+                'type': 'resume_complete',
+                'seq': seq
+            }))
+        elif message_type in ('subscribe', 'unsubscribe'):
+            topics = text_data_json.get('topics') or []
+            if isinstance(topics, str):
+                topics = [topics]
+            try:
+                groups = {topic: topic_group(topic) for topic in topics}
+            except InvalidTopic as e:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': str(e)
+                }))
+                return
+            await self.update_subscriptions(groups, message_type == 'subscribe')
+        elif message_type == 'ack':
+            try:
+                self.acknowledge(int(text_data_json.get('seq')))
+            except (TypeError, ValueError):
+                return
+        elif message_type == 'get_metrics':
             await self.send(text_data=json.dumps({
-                'type': 'bookings_data',
-                'data': bookings
+                'type': 'metrics',
+                **self.get_metrics()
             }))
 
-    # Receive message from room group
-    async def booking_update(self, event):
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'booking_update',
-            'data': event['data']
-        }))
+    async def update_subscriptions(self, groups, subscribe):
+        """Join or leave topic groups, falling back to every event when none are left"""
+        before = self.subscribed_groups()
+        if subscribe:
+            self.topics = {**self.topics, **groups}
+        else:
+            self.topics = {topic: group for topic, group in self.topics.items() if topic not in groups}
+        after = self.subscribed_groups()
 
-    async def booking_created(self, event):
-        # Send new booking to WebSocket
+        for group in after - before:
+            await self.channel_layer.group_add(group, self.channel_name)
+        for group in before - after:
+            await self.channel_layer.group_discard(group, self.channel_name)
         await self.send(text_data=json.dumps({
-            'type': 'booking_created',
-            'data': event['data']
+            'type': 'subscriptions',
+            'topics': sorted(self.topics)
         }))
 
-    async def booking_updated(self, event):
-        # Send updated booking to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'booking_updated',
-            'data': event['data']
-        }))
+    async def send_snapshot(self, resync=False):
+        """
+        Send the latest bookings with the sequence they are current to.
+        Clients skip frames at or below that sequence. An event racing the
+        snapshot may be applied twice but is never missed.
 
-    async def booking_deleted(self, event):
-        # Send deleted booking info to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'booking_deleted',
-            'data': event['data']
-        }))
+        Unfiltered connections get the shared pre-encoded snapshot; topic
+        subscribers get a query limited to their topics. Returns the sequence.
+        """
+        seq, frame = await database_sync_to_async(snapshot_frame)(tuple(self.topics), resync)
+        await self.send(text_data=frame)
+        return seq
 
-    @database_sync_to_async
-    def get_latest_bookings(self):
-        """Get latest bookings with user details"""
-        bookings = ReservedSlot.objects.all().order_by('-created_at')[:50]
-        bookings_data = []
-        
-        for booking in bookings:
-            booking_dict = ReservedSlotSerializer(booking).data
-            
-            # Add user details
-            user = booking.user
-            user_data = {
-                "id": user.id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email,
-                "phone": user.username,
-                "is_active": user.is_active,
-                "date_joined": user.date_joined.isoformat() if user.date_joined else None
-            }
-            
-            # Add profile details if exists
-            try:
-                profile = user.profile
-                user_data.update({
-                    "gender": profile.gender,
-                    "country": profile.country
-                })
-            except:
-                user_data.update({
-                    "gender": "",
-                    "country": ""
-                })
-            
-            booking_dict['user_details'] = user_data
-            bookings_data.append(booking_dict)
-        
-        return bookings_data
+    def acknowledge(self, seq):
+        """Release the frames the client has handled up to seq and let the sender continue"""
+        self.acks_enabled = True
+        self.in_flight = deque(sent for sent in self.in_flight if sent > seq)
+        self.outbox_ready.set()
+
+    def window_full(self):
+        return self.acks_enabled and len(self.in_flight) >= self.send_window
+
+    def queue_resync(self):
+        """Replace whatever is queued with a resync snapshot"""
+        self.metrics['dropped'] += len(self.outbox)
+        self.outbox.clear()
+        if not self.resync_pending:
+            self.resync_pending = True
+            self.metrics['resyncs'] += 1
+        self.outbox_ready.set()
+
+    def queue_frame(self, text_data, seq=None):
+        """Add a frame with the highest sequence it carries to the outbox, resyncing when it is full"""
+        if len(self.outbox) >= self.send_queue_size:
+            # The client is too far behind for deltas; replace them with a snapshot
+            self.metrics['dropped'] += 1
+            if not self.resync_pending:
+                logger.warning('Booking stream outbox full, resyncing %s', self.channel_name)
+            self.queue_resync()
+            return
+        self.outbox.append((seq, text_data))
+        self.metrics['max_queue_depth'] = max(self.metrics['max_queue_depth'], len(self.outbox))
+        self.outbox_ready.set()
+
+    async def send_outbox(self):
+        """Sender task: write queued frames whenever the client has room for them"""
+        while True:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            await self.send_ready_frames()
+
+    async def send_ready_frames(self):
+        """Write queued frames until the outbox is empty or the send window is full"""
+        while (self.resync_pending or self.outbox) and not self.window_full():
+            # An overflow while a frame was being written takes priority over what is queued
+            if self.resync_pending:
+                self.resync_pending = False
+                seq = await self.send_snapshot(resync=True)
+            else:
+                seq, text_data = self.outbox.popleft()
+                await self.send(text_data=text_data)
+                self.metrics['sent'] += 1
+            # Only clients that acknowledge frames are tracked
+            if seq is not None and self.acks_enabled:
+                self.in_flight.append(seq)
+
+    # Receive message from room group
+    async def forward_event(self, event):
+        """
+        Queue a group event for the WebSocket. Publishers encode the frame once
+        into event['text'] and it is forwarded unchanged; events without it
+        are encoded here.
+        """
+        text_data = event.get('text')
+        if text_data is None:
+            text_data = json.dumps({'type': event['type'], 'data': event['data']})
+        seqs = event.get('seqs') or ([event['seq']] if 'seq' in event else [])
+        fresh = [seq for seq in seqs if seq not in self.seen_seqs]
+        if len(fresh) < len(seqs):
+            self.metrics['duplicates'] += len(seqs) - len(fresh)
+            if not fresh:
+                return
+            # A batch overlapping events already queued through another group
+            frames = await sync_to_async(replay_frames)(fresh)
+            if frames is None:
+                self.queue_resync()
+                return
+            text_data = frames[0] if len(frames) == 1 else batch_frame(frames)
+        self.remember_seqs(fresh)
+        self.queue_frame(text_data, max(fresh, default=None))
+
+    def remember_seqs(self, seqs):
+        self.seen_seqs.update(seqs)
+        self.seen_order.extend(seqs)
+        while len(self.seen_order) > self.seen_seqs_size:
+            self.seen_seqs.discard(self.seen_order.popleft())
+
+    booking_update = forward_event
+    booking_created = forward_event
+    booking_updated = forward_event
+    booking_deleted = forward_event
+    bookings_batch = forward_event
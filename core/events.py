@@ -0,0 +1,523 @@
+"""
+Booking event publisher for the admin dashboard.
+
+Views call publish_booking_event() after writing a booking. The event is queued
+with transaction.on_commit, so nothing is sent for a rolled back write, and the
+channel layer send happens on a background dispatcher thread so request latency
+does not include channel layer I/O. The dispatcher queue is bounded; when it is
+full new events are dropped rather than blocking the request. The in-memory
+channel layer (used without REDIS_URL) keeps its queues on the server's event
+loop, so for it the dispatcher hands each send to the loop consumers run on,
+which BookingConsumer records when it connects.
+
+Each event carries its WebSocket frame already JSON encoded in 'text', so the
+frame is encoded once per event rather than once per connected socket.
+
+Frames are stamped with a sequence number from the shared cache and kept in a
+bounded replay ring there, so a reconnecting dashboard can ask for the frames
+after its last seen sequence instead of reloading everything. Numbers are
+taken from one counter and published on another once their frames are in the
+ring, so a reader never looks for a frame that is still being written.
+
+Besides the admin_bookings group, which receives everything, each booking
+event goes to one group per topic it matches: date:YYYY-MM-DD and
+service:<name>. Consumers subscribed to topics join only those groups.
+
+The dispatcher waits a few milliseconds (BOOKING_EVENT_COALESCE_MS) after an
+event for more to arrive. Events for the same booking in that window are
+merged, keeping the last write, and a group receiving more than one event
+gets a single bookings_batch frame instead of one frame per event.
+
+The latest bookings snapshot sent for get_bookings is kept in the shared cache
+as pre-encoded JSON. It is built with one joined query and then kept current
+by the dispatcher applying each batch of events, so get_bookings is normally
+answered without touching the database. The snapshot carries the version
+token it was built from; invalidating replaces the token, so an update
+racing the invalidation writes a snapshot readers ignore instead of one
+missing the change.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+from .cache_versions import bump_version, get_version
+from .models import ReservedSlot
+from .serializer import BookingWithUserSerializer
+
+
+logger = logging.getLogger(__name__)
+
+BOOKINGS_GROUP = 'admin_bookings'
+
+SEQUENCE_KEY = 'booking_events:seq'
+# Highest sequence whose frame is in the replay ring
+COMMITTED_SEQUENCE_KEY = 'booking_events:seq:committed'
+REPLAY_SIZE = getattr(settings, 'BOOKING_EVENT_REPLAY_SIZE', 500)
+REPLAY_TIMEOUT = 3600
+
+BATCH_EVENT = 'bookings_batch'
+
+SNAPSHOT_KEY = 'booking_events:snapshot'
+SNAPSHOT_LOCK_KEY = 'booking_events:snapshot:lock'
+SNAPSHOT_VERSION_KEY = 'booking_events:snapshot:version'
+SNAPSHOT_SIZE = 50
+# Safety net for changes that publish no event, such as a user's profile edit
+SNAPSHOT_TIMEOUT = 300
+
+# Longest the dispatcher waits for the server loop to accept a send
+SERVER_LOOP_SEND_TIMEOUT = 5
+
+# The event loop consumers run on, see bind_server_loop()
+_server_loop = None
+
+
+def bind_server_loop(loop):
+    """Record the loop consumers run on; in-memory channel layer sends are made on it"""
+    global _server_loop
+    _server_loop = loop
+
+
+def server_loop_for(channel_layer):
+    """
+    The loop a send to channel_layer must run on, or None when any loop will do.
+
+    The in-memory layer's asyncio queues belong to the loop its consumers wait
+    on; a send made on another loop does not wake them. Cross-process layers
+    such as Redis work from any loop.
+    """
+    loop = _server_loop
+    if not isinstance(channel_layer, InMemoryChannelLayer) or loop is None:
+        return None
+    if loop.is_closed() or not loop.is_running():
+        return None
+    return loop
+
+
+class EventDispatcher:
+    """Records and sends queued events to the channel layer from one worker thread"""
+
+    def __init__(self, maxsize=1000, coalesce_window=0.005, max_batch=100):
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.dropped = 0
+
+    def submit(self, groups, event_type, data):
+        """Queue an event for groups without blocking; returns False when it was dropped"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((groups, event_type, data))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning('Booking event queue full, dropped %s event', event_type)
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until every queued event has been handed to the channel layer"""
+        with self._queue.all_tasks_done:
+            if timeout is None:
+                while self._queue.unfinished_tasks:
+                    self._queue.all_tasks_done.wait()
+                return True
+            return self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name='booking-events', daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _next_batch(self):
+        """Block for one event, then collect more until the coalescing window closes"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.coalesce_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # One long-lived loop keeps the channel layer's connections reusable
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        while True:
+            batch = self._next_batch()
+            try:
+                events = coalesce_events(batch)
+                messages = record_events(events)
+                update_bookings_snapshot(events, messages)
+                channel_layer = get_channel_layer()
+                for group, message in group_messages(events, messages):
+                    if channel_layer:
+                        self._send(loop, channel_layer, group, message)
+            except Exception:
+                logger.exception('Error sending %d booking events', len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _send(loop, channel_layer, group, message):
+        server_loop = server_loop_for(channel_layer)
+        if server_loop is None:
+            loop.run_until_complete(channel_layer.group_send(group, message))
+        else:
+            future = asyncio.run_coroutine_threadsafe(channel_layer.group_send(group, message), server_loop)
+            future.result(SERVER_LOOP_SEND_TIMEOUT)
+
+
+dispatcher = EventDispatcher(
+    getattr(settings, 'BOOKING_EVENT_QUEUE_SIZE', 1000),
+    coalesce_window=getattr(settings, 'BOOKING_EVENT_COALESCE_MS', 5) / 1000,
+    max_batch=getattr(settings, 'BOOKING_EVENT_BATCH_SIZE', 100),
+)
+
+
+def coalesce_events(events):
+    """
+    Merge (groups, event_type, data) events about the same booking id, keeping
+    the last write in the position it was made. A booking created in the batch
+    stays a booking_created unless it was also deleted.
+    """
+    merged = {}
+    for groups, event_type, data in events:
+        key = data.get('id') if isinstance(data, dict) else None
+        if key is None:
+            key = object()
+        previous = merged.pop(key, None)
+        if previous:
+            previous_groups, previous_type, _ = previous
+            if previous_type == 'booking_created' and event_type != 'booking_deleted':
+                event_type = 'booking_created'
+            groups = tuple(previous_groups) + tuple(group for group in groups if group not in previous_groups)
+        merged[key] = (groups, event_type, data)
+    return list(merged.values())
+
+
+def group_messages(events, messages):
+    """
+    Yield (group, message) pairs to send for recorded events. A group with one
+    event gets its frame; a group with several gets one bookings_batch frame
+    built from the already encoded event frames, listing their sequence
+    numbers under 'seqs'.
+    """
+    frames = {}
+    for (groups, _, _), message in zip(events, messages):
+        for group in groups:
+            frames.setdefault(group, []).append(message)
+    for group, messages in frames.items():
+        if len(messages) == 1:
+            yield group, messages[0]
+        else:
+            text = batch_frame([m['text'] for m in messages])
+            yield group, {'type': BATCH_EVENT, 'text': text, 'seqs': [m['seq'] for m in messages]}
+
+
+def batch_frame(frames):
+    """A bookings_batch frame holding already encoded event frames"""
+    return '{"type": "%s", "events": [%s]}' % (BATCH_EVENT, ', '.join(frames))
+
+
+class InvalidTopic(ValueError):
+    """Raised for a subscription topic that is not date:YYYY-MM-DD or service:<name>"""
+
+
+def topic_group(topic):
+    """Channel layer group for a date:YYYY-MM-DD or service:<name> topic"""
+    kind, _, value = str(topic).partition(':')
+    if kind == 'date':
+        try:
+            topic_date = parse_date(value)
+        except ValueError:
+            topic_date = None
+        if topic_date is None:
+            raise InvalidTopic(f'Invalid date topic: {topic}')
+        return f'bookings.date.{topic_date.isoformat()}'
+    if kind == 'service' and value:
+        # Group names are limited to ASCII, so service names are hashed
+        return 'bookings.service.' + hashlib.sha1(value.encode()).hexdigest()[:20]
+    raise InvalidTopic(f'Unknown topic: {topic}')
+
+
+def booking_groups(*bookings):
+    """Groups an event about these bookings (e.g. before and after a move) goes to"""
+    groups = [BOOKINGS_GROUP]
+    for booking_date, service_name in bookings:
+        for topic in (f'date:{booking_date}', f'service:{service_name}'):
+            group = topic_group(topic)
+            if group not in groups:
+                groups.append(group)
+    return groups
+
+
+def replay_key(seq):
+    return f'booking_events:frame:{seq}'
+
+
+def current_sequence():
+    """Sequence number of the last recorded event that can be replayed, 0 before the first"""
+    return cache.get(COMMITTED_SEQUENCE_KEY) or 0
+
+
+def encode_event(event_type, data, seq=None):
+    """
+    Channel layer message whose 'text' is the ready-to-send WebSocket frame,
+    with the sequence number, if any, under 'seq'
+    """
+    frame = {'type': event_type, 'data': data}
+    message = {'type': event_type}
+    if seq is not None:
+        frame['seq'] = message['seq'] = seq
+    message['text'] = json.dumps(frame, cls=DjangoJSONEncoder)
+    return message
+
+
+def record_events(events):
+    """
+    Stamp consecutive sequence numbers on (groups, event_type, data) events and
+    keep their frames for replay. Returns one channel layer message per event,
+    with its sequence number under 'seq'.
+    """
+    if not events:
+        return []
+    restarted = cache.add(SEQUENCE_KEY, 0, None)
+    last = cache.incr(SEQUENCE_KEY, len(events))
+    first = last - len(events) + 1
+
+    messages = []
+    entries = {}
+    for seq, (groups, event_type, data) in enumerate(events, first):
+        message = encode_event(event_type, data, seq)
+        messages.append(message)
+        entries[replay_key(seq)] = {'groups': list(groups), 'text': message['text']}
+    cache.set_many(entries, REPLAY_TIMEOUT)
+    cache.delete_many([replay_key(seq - REPLAY_SIZE) for seq in range(first, last + 1)])
+    # Another process may have published a later batch already; never move back
+    # unless the counter was restarted
+    if restarted or last > current_sequence():
+        cache.set(COMMITTED_SEQUENCE_KEY, last, None)
+    return messages
+
+
+def record_event(event_type, data, groups=(BOOKINGS_GROUP,)):
+    """Stamp the next sequence number on an event and keep its frame for replay"""
+    return record_events([(groups, event_type, data)])[0]
+
+
+def encode_snapshot(seq, bookings, version):
+    return {
+        'seq': seq,
+        'version': version,
+        'bookings': bookings,
+        'text': json.dumps(bookings, cls=DjangoJSONEncoder),
+    }
+
+
+def build_bookings_snapshot():
+    """Query the latest bookings with their users in one joined query"""
+    # Read the version and sequence first: changes racing the query are applied again on top
+    version = get_version(SNAPSHOT_VERSION_KEY)
+    seq = current_sequence()
+    bookings = ReservedSlot.objects.select_related('user', 'user__profile').order_by('-created_at')[:SNAPSHOT_SIZE]
+    return encode_snapshot(seq, list(BookingWithUserSerializer(bookings, many=True).data), version)
+
+
+def cached_snapshot():
+    """
+    Return (snapshot, version) with the current version token. snapshot is
+    None when the cache has none built from that version.
+    """
+    entries = cache.get_many([SNAPSHOT_KEY, SNAPSHOT_VERSION_KEY])
+    version = entries.get(SNAPSHOT_VERSION_KEY) or get_version(SNAPSHOT_VERSION_KEY)
+    snapshot = entries.get(SNAPSHOT_KEY)
+    if snapshot is not None and snapshot['version'] != version:
+        snapshot = None
+    return snapshot, version
+
+
+def get_bookings_snapshot():
+    """
+    Return {'seq', 'bookings', 'text'} for the latest bookings, where text is
+    the JSON encoded list. Served from the shared cache; on a miss one caller
+    rebuilds it while concurrent callers wait briefly for the result.
+    """
+    snapshot, _ = cached_snapshot()
+    if snapshot is not None:
+        return snapshot
+    for _ in range(20):
+        if cache.add(SNAPSHOT_LOCK_KEY, 1, 10):
+            try:
+                snapshot = build_bookings_snapshot()
+                cache.set(SNAPSHOT_KEY, snapshot, SNAPSHOT_TIMEOUT)
+                return snapshot
+            finally:
+                cache.delete(SNAPSHOT_LOCK_KEY)
+        time.sleep(0.05)
+        snapshot, _ = cached_snapshot()
+        if snapshot is not None:
+            return snapshot
+    return build_bookings_snapshot()
+
+
+def latest_bookings(topics=()):
+    """Latest bookings with user details matching any of the date:/service: topics"""
+    bookings = ReservedSlot.objects.select_related('user', 'user__profile')
+    if topics:
+        matches = Q()
+        for topic in topics:
+            kind, _, value = topic.partition(':')
+            matches |= Q(booking_date=value) if kind == 'date' else Q(service_name=value)
+        bookings = bookings.filter(matches)
+    bookings = bookings.order_by('-created_at')[:SNAPSHOT_SIZE]
+    return BookingWithUserSerializer(bookings, many=True).data
+
+
+def snapshot_frame(topics=(), resync=False):
+    """
+    Return (seq, frame): an encoded bookings_data frame with the latest
+    bookings and the sequence they are current to. Without topics the shared cached snapshot is spliced in;
+    topic subscribers get a query limited to their topics.
+    """
+    if topics:
+        seq = current_sequence()
+        bookings_json = json.dumps(latest_bookings(topics), cls=DjangoJSONEncoder)
+    else:
+        snapshot = get_bookings_snapshot()
+        seq, bookings_json = snapshot['seq'], snapshot['text']
+    resync_json = ', "resync": true' if resync else ''
+    return seq, '{"type": "bookings_data", "seq": %d%s, "data": %s}' % (seq, resync_json, bookings_json)
+
+
+def invalidate_bookings_snapshot():
+    bump_version(SNAPSHOT_VERSION_KEY)
+    cache.delete(SNAPSHOT_KEY)
+
+
+def update_bookings_snapshot(events, messages):
+    """
+    Apply recorded booking events to the cached snapshot.
+
+    The snapshot is only updated when it is current to the sequence just
+    before these events; otherwise another process has events it lacks and it
+    is dropped to be rebuilt. A delete of a listed booking also drops it, since
+    the row that moves up into the list is unknown.
+
+    The result is written under the version read with the snapshot, so if the
+    snapshot is invalidated meanwhile the write is ignored rather than undoing
+    the invalidation.
+    """
+    if not events:
+        return
+    snapshot, version = cached_snapshot()
+    if snapshot is None:
+        return
+    if snapshot['seq'] >= messages[-1]['seq']:
+        return
+    if snapshot['seq'] < messages[0]['seq'] - 1:
+        invalidate_bookings_snapshot()
+        return
+
+    bookings = list(snapshot['bookings'])
+    for (_, event_type, data), message in zip(events, messages):
+        if message['seq'] <= snapshot['seq']:
+            continue
+        index = next((i for i, booking in enumerate(bookings) if booking['id'] == data.get('id')), None)
+        if event_type == 'booking_deleted':
+            if index is not None:
+                invalidate_bookings_snapshot()
+                return
+        elif index is not None:
+            bookings[index] = data
+        elif event_type == 'booking_created':
+            bookings.insert(0, data)
+    cache.set(SNAPSHOT_KEY, encode_snapshot(messages[-1]['seq'], bookings[:SNAPSHOT_SIZE], version), SNAPSHOT_TIMEOUT)
+
+
+def replay_frames(seqs):
+    """Encoded frames of the events with these sequence numbers, or None if any has left the ring"""
+    keys = [replay_key(seq) for seq in seqs]
+    entries = cache.get_many(keys)
+    if len(entries) != len(keys):
+        return None
+    return [entries[key]['text'] for key in keys]
+
+
+def frames_since(last_seq, groups=None):
+    """
+    Return (frames, seq): the encoded frames recorded after last_seq, in order,
+    and the sequence they bring the client up to. With groups, only frames
+    sent to one of those groups are returned.
+
+    frames is None when the replay ring no longer covers the gap (too many
+    events missed, frames expired, or the sequence was reset), in which case
+    the client needs a full snapshot.
+    """
+    numbered, seq = numbered_frames_since(last_seq, groups)
+    if numbered is None:
+        return None, seq
+    return [frame for _, frame in numbered], seq
+
+
+def numbered_frames_since(last_seq, groups=None):
+    """Like frames_since, with the frames as (seq, frame) pairs"""
+    seq = current_sequence()
+    if last_seq > seq or seq - last_seq > REPLAY_SIZE:
+        return None, seq
+    keys = {number: replay_key(number) for number in range(last_seq + 1, seq + 1)}
+    entries = cache.get_many(list(keys.values()))
+    if len(entries) != len(keys):
+        return None, seq
+    frames = [
+        (number, entries[key]['text']) for number, key in keys.items()
+        if groups is None or not set(groups).isdisjoint(entries[key]['groups'])
+    ]
+    return frames, seq
+
+
+def publish(event_type, data, groups=(BOOKINGS_GROUP,), using=None):
+    """Send the event_type frame for data to groups once the current transaction commits"""
+    def submit():
+        # A dropped event would never reach the cached snapshot
+        if not dispatcher.submit(tuple(groups), event_type, data):
+            invalidate_bookings_snapshot()
+    transaction.on_commit(submit, using=using)
+
+
+def publish_booking_event(event_type, booking):
+    """
+    Publish a booking_created, booking_updated or booking_deleted event.
+
+    The event goes to admin_bookings and to the date and service topics of the
+    booking, including the ones it was saved away from. The booking is
+    serialized immediately, so a deleted booking must be published before it
+    is deleted; the event itself is only sent on commit.
+    """
+    keys = [(booking.booking_date, booking.service_name)]
+    previous_key = getattr(booking, '_previous_stat_key', None)
+    if previous_key:
+        keys.append(previous_key[:2])
+    publish(event_type, BookingWithUserSerializer(booking).data, booking_groups(*keys))
+    booking._event_published = True
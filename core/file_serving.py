@@ -0,0 +1,205 @@
+"""
+Streaming file responses with byte range support and conditional GET.
+
+Files are never read into memory: full responses hand the open file to
+FileResponse, which streams it in blocks (or uses the server's sendfile
+wrapper), and range responses stream only the requested slice.
+
+Every response carries a strong ETag built from the file's size and mtime,
+and Last-Modified, so If-None-Match / If-Modified-Since revalidations get a
+304 without the body and If-Range only resumes an unchanged file.
+
+With MEDIA_SENDFILE set to 'x-accel-redirect' or 'x-sendfile' the response
+carries no body at all; the front-end server reads the file itself, handling
+ranges and keeping worker memory flat. X-Accel-Redirect paths are the file's
+path under MEDIA_ROOT behind MEDIA_ACCEL_REDIRECT_PREFIX, which nginx maps to
+an internal location.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+from .image_variants import negotiate_image
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# ManifestStaticFilesStorage names (name.<12 hex digits of md5>.ext) and
+# content-addressed uploads (<BLAKE2b digest>.ext)
+HASHED_NAME_RE = re.compile(r'(\.[0-9a-f]{12}|(^|/)[0-9a-f]{64})\.[^/.]+$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=86400'
+
+
+class UnsatisfiableRange(ValueError):
+    pass
+
+
+def parse_byte_range(header, size):
+    """
+    Return the (start, end) byte offsets, end inclusive, of a single range
+    Range header, or None to serve the whole file. Multiple ranges and
+    malformed headers are ignored, as RFC 9110 allows; a range that starts
+    past the end raises UnsatisfiableRange.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the final N bytes
+        length = int(last)
+        if not length or not size:
+            raise UnsatisfiableRange(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start > end:
+        if last and int(last) < start:
+            return None
+        raise UnsatisfiableRange(header)
+    return start, end
+
+
+class FileSlice:
+    """Read-only view of length bytes of a file from start, for FileResponse"""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(stat):
+    """Strong validator for a file's current contents, from its size and mtime"""
+    return '"%x-%x"' % (stat.st_size, stat.st_mtime_ns)
+
+
+def if_range_matches(request, etag, last_modified):
+    """False when If-Range names a different version, so Range must be ignored"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def sendfile_response(path, content_type):
+    """
+    Empty response telling the front-end server to send path, or None when
+    offload is off or path is outside MEDIA_ROOT
+    """
+    mode = getattr(settings, 'MEDIA_SENDFILE', '')
+    if not mode:
+        return None
+    media_root = os.path.abspath(settings.MEDIA_ROOT)
+    path = os.path.abspath(path)
+    if os.path.commonpath([media_root, path]) != media_root:
+        return None
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel-redirect':
+        relative = os.path.relpath(path, media_root).replace(os.sep, '/')
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def file_response(request, path, content_type, filename=None):
+    """
+    Stream path, answering conditional requests and honouring a single byte
+    range. Raises Http404 when path is not a file; headers common to every
+    response (caching, CORS) are left to the caller.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise Http404('File not found')
+    if not os.path.isfile(path):
+        raise Http404('File not found')
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = sendfile_response(path, content_type)
+    if response is None:
+        response = stream_file(request, path, content_type, filename, etag, last_modified)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def stream_file(request, path, content_type, filename, etag, last_modified):
+    file = open(path, 'rb')
+    size = os.fstat(file.fileno()).st_size
+    try:
+        byte_range = None
+        if if_range_matches(request, etag, last_modified):
+            byte_range = parse_byte_range(request.headers.get('Range'), size)
+    except UnsatisfiableRange:
+        file.close()
+        response = HttpResponse(status=416, content_type=content_type)
+        response['Content-Range'] = f'bytes */{size}'
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type, filename=filename or '')
+    else:
+        start, end = byte_range
+        response = FileResponse(FileSlice(file, start, end - start + 1), status=206, content_type=content_type)
+        if filename:
+            response['Content-Disposition'] = f'inline; filename="{filename}"'
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve(request, path, document_root=None, image_variants=False):
+    """
+    Replacement for django.views.static.serve with validators, ranges and
+    sendfile offload. Names carrying a manifest hash are cached as immutable;
+    anything else may be replaced in place and is revalidated daily.
+
+    With image_variants, images are negotiated into resized variants as on
+    the image proxy.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    fullpath = safe_join(document_root, path)
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    if image_variants and content_type.startswith('image/'):
+        fullpath, content_type = negotiate_image(request, fullpath, content_type)
+    response = file_response(request, fullpath, content_type)
+    if image_variants:
+        patch_vary_headers(response, ['Accept'])
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if HASHED_NAME_RE.search(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    return response
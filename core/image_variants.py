@@ -0,0 +1,193 @@
+"""
+Resized image variants for phones.
+
+Uploaded images are kept as sent, often at full camera resolution. A variant
+is a copy scaled down to one of IMAGE_VARIANT_WIDTHS and re-encoded as WebP,
+or as JPEG (PNG when the image has transparency) for clients that do not
+accept WebP. Variants are generated lazily on first request into
+IMAGE_VARIANT_ROOT, named after the source file's size and mtime so a
+replaced source never serves a stale variant. Generation is guarded by one
+of a fixed set of locks, picked by a hash of the variant path, so concurrent
+first requests encode it once without a lock per variant ever created.
+"""
+import logging
+import os
+import threading
+import zlib
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+try:
+    import fcntl
+except ImportError:  # Windows: the in-process lock still applies
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = tuple(getattr(settings, 'IMAGE_VARIANT_WIDTHS', (320, 640, 1280)))
+# Formats Pillow can resize without losing anything the original relies on
+# (animated GIFs are served as they are)
+RESIZABLE_FORMATS = {'JPEG', 'PNG', 'WEBP', 'BMP', 'MPO'}
+ENCODE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    'png': {'format': 'PNG', 'optimize': True},
+}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+# Unrelated variants sharing a stripe only wait for each other's encode
+LOCK_STRIPES = 64
+_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def variant_root():
+    return os.path.join(settings.MEDIA_ROOT, getattr(settings, 'IMAGE_VARIANT_ROOT', 'variants'))
+
+
+def choose_width(requested):
+    """The smallest variant width covering requested, or the largest one"""
+    for width in VARIANT_WIDTHS:
+        if width >= requested:
+            return width
+    return VARIANT_WIDTHS[-1]
+
+
+def accepts_webp(request):
+    return 'image/webp' in request.headers.get('Accept', '')
+
+
+def requested_variant(request):
+    """
+    Return the (width, accept_webp) variant a request asks for, or None for
+    the original. ?w= picks the width; a client accepting WebP with no ?w=
+    gets the largest width as WebP.
+    """
+    webp = accepts_webp(request)
+    try:
+        width = int(request.GET['w'])
+    except (KeyError, ValueError):
+        return (VARIANT_WIDTHS[-1], True) if webp else None
+    if width <= 0:
+        return None
+    return choose_width(width), webp
+
+
+def variant_dir(source_path):
+    """Directory holding every variant of source_path"""
+    relative = os.path.relpath(os.path.abspath(source_path), os.path.abspath(settings.MEDIA_ROOT))
+    return os.path.join(variant_root(), relative)
+
+
+def variant_path(source_path, width, fmt):
+    stat = os.stat(source_path)
+    version = '%x-%x' % (stat.st_size, stat.st_mtime_ns)
+    return os.path.join(variant_dir(source_path), f'{version}-{width}.{fmt}')
+
+
+def lock_stripe(path):
+    # crc32 rather than hash(), which differs between processes
+    return zlib.crc32(path.encode()) % LOCK_STRIPES
+
+
+def lock_file_path(stripe):
+    """File flock()ed across processes for one lock stripe"""
+    return os.path.join(variant_root(), '.locks', f'{stripe}.lock')
+
+
+def open_resizable(source_path):
+    """Open source_path with Pillow, or return None when it should be served as is"""
+    try:
+        image = Image.open(source_path)
+    except (OSError, UnidentifiedImageError):
+        return None
+    # MPO (camera JPEGs with a preview frame) resize as their first frame
+    animated = getattr(image, 'n_frames', 1) > 1 and image.format != 'MPO'
+    if image.format not in RESIZABLE_FORMATS or animated:
+        image.close()
+        return None
+    return image
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def variant_format(image, webp):
+    if webp:
+        return 'webp'
+    return 'png' if has_alpha(image) else 'jpeg'
+
+
+def encode_variant(image, width, fmt, path):
+    """Scale image to width (never up) and write it as fmt, atomically, to path"""
+    if image.format == 'JPEG':
+        # Let the decoder skip detail the variant will not use
+        image.draft('RGB', (width, image.height * width // max(image.width, 1)))
+    alpha = has_alpha(image)
+    image = ImageOps.exif_transpose(image)
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    image = image.convert('RGBA' if alpha and fmt != 'jpeg' else 'RGB')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        image.save(temp_path, **ENCODE_OPTIONS[fmt])
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_variant(source_path, width, webp):
+    """
+    Return (path, content_type) of the variant of source_path, generating it
+    on first use, or None when the source is not a resizable image.
+    """
+    # The fallback format depends on the image, so look for every name it may have
+    candidates = ['webp'] if webp else ['jpeg', 'png']
+    paths = {fmt: variant_path(source_path, width, fmt) for fmt in candidates}
+    for fmt, path in paths.items():
+        if os.path.exists(path):
+            return path, CONTENT_TYPES[fmt]
+
+    image = open_resizable(source_path)
+    if image is None:
+        return None
+    with image:
+        fmt = variant_format(image, webp)
+        path = paths[fmt]
+        stripe = lock_stripe(path)
+        lock_path = lock_file_path(stripe)
+        with _locks[stripe]:
+            os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+            with open(lock_path, 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # Another worker may have written it while we waited
+                if not os.path.exists(path):
+                    encode_variant(image, width, fmt, path)
+    return path, CONTENT_TYPES[fmt]
+
+
+def negotiate_image(request, path, content_type):
+    """
+    Return the (path, content_type) to serve for an image request: the
+    variant picked by ?w= and Accept, or the original when none is asked for
+    or the file cannot be resized.
+    """
+    variant = requested_variant(request)
+    if variant is None or not os.path.isfile(path):
+        return path, content_type
+    root = os.path.abspath(variant_root())
+    if os.path.commonpath([root, os.path.abspath(path)]) == root:
+        # Already a variant
+        return path, content_type
+    try:
+        resized = get_variant(path, *variant)
+    except Exception:
+        logger.exception('Could not build a variant of %s', path)
+        resized = None
+    return resized or (path, content_type)
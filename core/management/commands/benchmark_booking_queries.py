@@ -0,0 +1,176 @@
+"""
+Benchmark the ReservedSlot queries behind the booking endpoints.
+
+Seeds synthetic bookings for a dedicated user, then prints the EXPLAIN plan and
+timing of each endpoint's query with the ReservedSlot composite indexes dropped
+("before") and in place ("after").
+
+The calendar and stats endpoints read the BookingDailyStat rollup, so they are
+timed by calling get_month_calendar and compute_booking_stats with their caches
+bypassed. The raw_* cases are the ReservedSlot aggregates those endpoints ran
+before the rollup, kept as a baseline.
+"""
+import random
+import time as timer
+from datetime import date, time, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+
+from core.availability import get_month_calendar, invalidate_month_calendar, month_bounds
+from core.booking_settings import get_active_settings
+from core.booking_stats import compute_booking_stats, rebuild_daily_stats
+from core.models import ReservedSlot
+
+
+SEED_USERNAME = 'benchmark-seed'
+SERVICES = ['Massage', 'Facial', 'Haircut', 'Manicure', 'Pedicure', 'Spa']
+
+
+class Command(BaseCommand):
+    help = 'Seed synthetic bookings and benchmark the ReservedSlot endpoint queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Number of bookings to seed')
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_create batch size')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query')
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse previously seeded rows')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the seeded rows and exit')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username=SEED_USERNAME, defaults={'is_active': False})
+
+        if options['cleanup']:
+            deleted = self.delete_seed(user)
+            user.delete()
+            rebuild_daily_stats()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} seeded bookings'))
+            return
+
+        if not options['skip_seed']:
+            self.seed(user, options['rows'], options['batch_size'])
+
+        queries = self.endpoint_queries()
+        indexes = ReservedSlot._meta.indexes
+
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(ReservedSlot, index)
+        try:
+            self.stdout.write(self.style.MIGRATE_HEADING('Before: without composite indexes'))
+            before = self.run_queries(queries, options['repeat'])
+        finally:
+            with connection.schema_editor() as editor:
+                for index in indexes:
+                    editor.add_index(ReservedSlot, index)
+
+        self.stdout.write(self.style.MIGRATE_HEADING('After: with composite indexes'))
+        after = self.run_queries(queries, options['repeat'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Summary (best of runs, ms)'))
+        for name in queries:
+            self.stdout.write(f'{name:<24} {before[name]:>10.2f} {after[name]:>10.2f}')
+
+    def seed(self, user, rows, batch_size):
+        """
+        Insert bookings one per minute from a year ago. Seeded times sit on
+        second 30 so upcoming rows never collide with real, minute-aligned
+        bookings under the unique slot constraint.
+        """
+        self.delete_seed(user)
+        start_date = date.today() - timedelta(days=365)
+        statuses = ['upcoming'] * 6 + ['completed'] * 3 + ['cancelled']
+        batch = []
+        started = timer.perf_counter()
+        for i in range(rows):
+            minutes = i % 1440
+            batch.append(ReservedSlot(
+                user=user,
+                service_name=random.choice(SERVICES),
+                booking_date=start_date + timedelta(days=i // 1440),
+                booking_time=time(minutes // 60, minutes % 60, 30),
+                status=random.choice(statuses),
+            ))
+            if len(batch) >= batch_size:
+                ReservedSlot.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            ReservedSlot.objects.bulk_create(batch)
+
+        # bulk_create skips signals, so rebuild the rollup and drop the cached
+        # calendar months by hand
+        end_date = start_date + timedelta(days=rows // 1440 + 1)
+        rebuild_daily_stats(start_date, end_date)
+        current = start_date.replace(day=1)
+        while current <= end_date:
+            invalidate_month_calendar(current)
+            current = month_bounds(current.year, current.month)[1]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {rows} bookings in {timer.perf_counter() - started:.1f}s'
+        ))
+
+    def delete_seed(self, user):
+        # Raw delete: the ORM would load every row to send delete signals
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {ReservedSlot._meta.db_table} WHERE user_id = %s', [user.id]
+            )
+            return cursor.rowcount
+
+    def endpoint_queries(self):
+        today = date.today()
+        month_start, month_end = month_bounds(today.year, today.month)
+        week_start = today - timedelta(days=today.weekday())
+        slots = ReservedSlot.objects.order_by()
+        booking_settings, _ = get_active_settings()
+
+        def booking_calendar():
+            # A fresh version token per run, so the month is never served from the cache
+            invalidate_month_calendar(today)
+            return get_month_calendar(today.year, today.month, booking_settings)
+
+        queries = {
+            'available_slots': slots.filter(
+                booking_date=today, status='upcoming'
+            ).values_list('booking_time', flat=True),
+            'booking_stats': lambda: compute_booking_stats(today=today),
+            'raw_calendar_counts': slots.filter(
+                booking_date__gte=month_start, booking_date__lt=month_end, status='upcoming'
+            ).values('booking_date').annotate(count=Count('id')),
+            'raw_stats_status_count': slots.filter(status='upcoming').values('status').annotate(count=Count('id')),
+            'raw_stats_week_count': slots.filter(
+                booking_date__gte=week_start, booking_date__lte=week_start + timedelta(days=6)
+            ).values('status').annotate(count=Count('id')),
+            'admin_bookings_page': ReservedSlot.objects.order_by('-booking_date', '-booking_time')[:50],
+            'admin_bookings_status': ReservedSlot.objects.filter(
+                status='upcoming'
+            ).order_by('-booking_date', '-booking_time')[:50],
+            'latest_bookings': ReservedSlot.objects.order_by('-created_at')[:50],
+        }
+        # The calendar endpoint answers 404 without active booking settings
+        if booking_settings is not None:
+            queries['booking_calendar'] = booking_calendar
+        return queries
+
+    def run_queries(self, queries, repeat):
+        timings = {}
+        for name, query in queries.items():
+            self.stdout.write(self.style.HTTP_INFO(name))
+            if callable(query):
+                # An endpoint code path running several queries; there is no single plan
+                run = query
+            else:
+                self.stdout.write(query.explain())
+                run = lambda queryset=query: list(queryset.all())
+            best = None
+            for _ in range(max(repeat, 1)):
+                started = timer.perf_counter()
+                run()
+                elapsed = (timer.perf_counter() - started) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+            self.stdout.write(f'  best of {repeat}: {best:.2f} ms')
+        return timings
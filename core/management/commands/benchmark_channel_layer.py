@@ -0,0 +1,175 @@
+"""
+Check cross-process delivery and throughput of the Redis channel layer.
+
+Starts subscriber processes that join the admin bookings group and a publisher
+process that sends booking events to it, the same path a booking_created takes
+from one daphne worker to dashboards connected to another. Each process builds
+its own RedisChannelLayer, so nothing is shared but the Redis server.
+"""
+import asyncio
+import multiprocessing
+import queue
+import time as timer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+GROUP_NAME = 'admin_bookings_benchmark'
+
+
+def layer_config(redis_url, capacity=None):
+    """Channel layer CONFIG from settings, pointed at redis_url"""
+    config = dict(settings.CHANNEL_LAYERS['default'].get('CONFIG', {}))
+    config['hosts'] = [redis_url]
+    if capacity:
+        config['capacity'] = capacity
+    return config
+
+
+def make_event(index, payload_bytes):
+    return {
+        'type': 'booking_created',
+        'data': {'id': index, 'service_name': 'Benchmark', 'notes': 'x' * payload_bytes},
+    }
+
+
+def subscriber(config, group, messages, timeout, ready, results):
+    from channels_redis.core import RedisChannelLayer
+
+    async def run():
+        layer = RedisChannelLayer(**config)
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        ready.set()
+        received = []
+        started = None
+        try:
+            while len(received) < messages:
+                message = await asyncio.wait_for(layer.receive(channel), timeout)
+                started = started or timer.perf_counter()
+                received.append(message['data']['id'])
+        except asyncio.TimeoutError:
+            pass
+        elapsed = timer.perf_counter() - started if started else 0.0
+        await layer.group_discard(group, channel)
+        await layer.close_pools()
+        return received, elapsed
+
+    received, elapsed = asyncio.run(run())
+    results.put({
+        'role': 'subscriber',
+        'received': len(received),
+        'in_order': received == sorted(received),
+        'seconds': elapsed,
+    })
+
+
+def publisher(config, group, messages, payload_bytes, start, results):
+    from channels_redis.core import RedisChannelLayer
+
+    async def run():
+        layer = RedisChannelLayer(**config)
+        started = timer.perf_counter()
+        for index in range(messages):
+            await layer.group_send(group, make_event(index, payload_bytes))
+        elapsed = timer.perf_counter() - started
+        await layer.close_pools()
+        return elapsed
+
+    start.wait()
+    results.put({'role': 'publisher', 'sent': messages, 'seconds': asyncio.run(run())})
+
+
+def run_fanout(redis_url, messages=1000, subscribers=1, payload_bytes=512, capacity=None, timeout=10):
+    """
+    Publish messages from one process to subscribers in other processes.
+
+    Returns a dict with the publisher result and one result per subscriber.
+    Processes are spawned, not forked, so each starts with a fresh event loop
+    and its own Redis connections.
+    """
+    config = layer_config(redis_url, capacity)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    ready_events = [context.Event() for _ in range(subscribers)]
+    start = context.Event()
+
+    processes = [
+        context.Process(target=subscriber, args=(config, GROUP_NAME, messages, timeout, ready, results))
+        for ready in ready_events
+    ]
+    processes.append(context.Process(
+        target=publisher, args=(config, GROUP_NAME, messages, payload_bytes, start, results)
+    ))
+    for process in processes:
+        process.start()
+    try:
+        deadline = timer.monotonic() + timeout
+        for ready, process in zip(ready_events, processes):
+            while not ready.wait(0.1):
+                if not process.is_alive() or timer.monotonic() > deadline:
+                    raise RuntimeError('Subscriber did not join the group; is Redis reachable?')
+        start.set()
+
+        collected = []
+        deadline = timer.monotonic() + timeout * 3 + messages / 100
+        while len(collected) < len(processes):
+            try:
+                collected.append(results.get(timeout=0.5))
+            except queue.Empty:
+                if any(process.exitcode for process in processes):
+                    raise RuntimeError('A benchmark process failed; see its traceback above')
+                if timer.monotonic() > deadline:
+                    raise RuntimeError('Timed out waiting for benchmark processes')
+    finally:
+        for process in processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+
+    return {
+        'publisher': next(result for result in collected if result['role'] == 'publisher'),
+        'subscribers': [result for result in collected if result['role'] == 'subscriber'],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Measure booking event delivery between processes over the Redis channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--redis-url', default=getattr(settings, 'REDIS_URL', '') or None,
+                            help='Redis server to test against (defaults to REDIS_URL)')
+        parser.add_argument('--messages', type=int, default=1000, help='Events to publish')
+        parser.add_argument('--subscribers', type=int, default=1, help='Subscriber processes')
+        parser.add_argument('--payload-bytes', type=int, default=512, help='Padding added to each event')
+        parser.add_argument('--capacity', type=int, help='Override the layer capacity')
+
+    def handle(self, *args, **options):
+        if not options['redis_url']:
+            raise CommandError('Set REDIS_URL or pass --redis-url')
+
+        try:
+            result = run_fanout(
+                options['redis_url'],
+                messages=options['messages'],
+                subscribers=options['subscribers'],
+                payload_bytes=options['payload_bytes'],
+                capacity=options['capacity'],
+            )
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        published = result['publisher']
+        self.stdout.write(
+            f"Published {published['sent']} events in {published['seconds']:.2f}s "
+            f"({published['sent'] / max(published['seconds'], 1e-9):.0f}/s)"
+        )
+        for index, subscriber_result in enumerate(result['subscribers'], 1):
+            rate = subscriber_result['received'] / max(subscriber_result['seconds'], 1e-9)
+            style = self.style.SUCCESS if subscriber_result['received'] == published['sent'] else self.style.ERROR
+            self.stdout.write(style(
+                f"Subscriber {index}: received {subscriber_result['received']}/{published['sent']} "
+                f"in {subscriber_result['seconds']:.2f}s ({rate:.0f}/s), "
+                f"in order: {subscriber_result['in_order']}"
+            ))
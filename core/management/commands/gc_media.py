@@ -0,0 +1,50 @@
+"""
+Delete orphaned files from the image proxy directory (MEDIA_ROOT/temp).
+
+A content-addressed file is kept while a MediaReference row records its
+digest, that is while Offer.image, Service.icon or SubService.icon holds its
+URL. Older files without a digest in their name are kept while one of those
+fields holds a URL ending in their name. Files a media job still needs are
+kept, and so are files uploaded within the last --min-age hours (a repeated
+upload of the same bytes counts), since an image uploaded through the image
+proxy is only attached to an offer or service by a later request.
+
+References are kept by the model signals, so run it only after writes that
+bypass them (QuerySet.update on those fields) have been followed by a save.
+"""
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.media import delete_proxy_files, proxy_orphans
+
+
+class Command(BaseCommand):
+    help = 'Delete image proxy files that no offer or service refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=float, default=24, help='Keep files younger than this many hours (default 24)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Files deleted per batch (default 500)')
+        parser.add_argument('--dry-run', action='store_true', help='List orphans without deleting them')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['min_age'] < 0:
+            raise CommandError('--min-age must not be negative')
+
+        orphans = proxy_orphans(min_age=options['min_age'] * 3600)
+        total = 0
+        while True:
+            batch = list(islice(orphans, options['batch_size']))
+            if not batch:
+                break
+            if options['dry_run']:
+                for path in batch:
+                    self.stdout.write(path)
+            else:
+                delete_proxy_files(batch)
+            total += len(batch)
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} orphaned media files'))
@@ -0,0 +1,31 @@
+"""
+Run the pending media upload jobs in the foreground.
+
+Useful after a deploy that stopped workers mid-job, or to retry failed jobs
+with --retry-failed.
+"""
+from django.core.management.base import BaseCommand
+
+from core.media_jobs import resume_unfinished_jobs, run_job
+from core.models import MediaUploadJob
+
+
+class Command(BaseCommand):
+    help = 'Run pending media upload jobs (remote copies and image variants)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Run failed jobs again')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            MediaUploadJob.objects.filter(status='failed').update(status='pending', attempts=0)
+
+        done = failed = 0
+        for job_id in resume_unfinished_jobs():
+            # Retries happen on the next run rather than in a loop here
+            run_job(job_id)
+            if MediaUploadJob.objects.filter(id=job_id, status='done').exists():
+                done += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(f'Ran media jobs: {done} done, {failed} not done'))
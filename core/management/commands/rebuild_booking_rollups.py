@@ -0,0 +1,35 @@
+"""
+Rebuild the BookingDailyStat rollup from ReservedSlot rows.
+
+Used to backfill the rollup and to repair drift after writes that bypass the
+booking signals (bulk_create, QuerySet.update, raw SQL).
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.booking_stats import rebuild_daily_stats
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Invalid date {value!r}. Use YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily booking rollup from the bookings table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First booking date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last booking date to rebuild (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        start_date = parse_date(options['start']) if options['start'] else None
+        end_date = parse_date(options['end']) if options['end'] else None
+        if start_date and end_date and start_date > end_date:
+            raise CommandError('--start must not be after --end')
+
+        written = rebuild_daily_stats(start_date, end_date)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} daily booking rollup rows'))
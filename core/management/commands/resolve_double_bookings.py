@@ -0,0 +1,67 @@
+"""
+Report and resolve slots holding more than one upcoming booking.
+
+Migration 0007 adds a unique constraint on upcoming (booking_date,
+booking_time) and stops when existing data breaks it. This command lists the
+conflicting bookings; with --cancel it keeps the earliest booking of each
+slot and cancels the others, noting the kept booking on each. Review the list
+and contact the affected customers before cancelling.
+
+Cancellation is written with QuerySet.update(), so it works on a database
+that has not reached the later booking migrations yet. No booking events are
+published for it; the cached admin bookings snapshot is dropped instead.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from core.events import invalidate_bookings_snapshot
+from core.models import ReservedSlot
+
+
+def double_bookings():
+    """Yield (booking_date, booking_time, bookings) for every double-booked slot, earliest booking first"""
+    slots = ReservedSlot.objects.filter(status='upcoming').values(
+        'booking_date', 'booking_time'
+    ).annotate(count=Count('id')).filter(count__gt=1).order_by('booking_date', 'booking_time')
+    for slot in slots:
+        bookings = ReservedSlot.objects.filter(
+            status='upcoming',
+            booking_date=slot['booking_date'],
+            booking_time=slot['booking_time'],
+        ).order_by('id').only('id', 'user_id', 'service_name', 'notes')
+        yield slot['booking_date'], slot['booking_time'], list(bookings)
+
+
+class Command(BaseCommand):
+    help = 'List double-booked slots and optionally cancel all but the earliest booking of each'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cancel', action='store_true', help='Cancel every booking but the earliest of each slot')
+
+    def handle(self, *args, **options):
+        cancelled = slots = 0
+        with transaction.atomic():
+            for booking_date, booking_time, bookings in double_bookings():
+                slots += 1
+                kept, *extra = bookings
+                self.stdout.write(
+                    f'{booking_date} {booking_time}: keeping #{kept.id}, '
+                    f'{"cancelling" if options["cancel"] else "conflicting"} '
+                    + ', '.join(f'#{booking.id} (user {booking.user_id}, {booking.service_name})' for booking in extra)
+                )
+                if not options['cancel']:
+                    continue
+                for booking in extra:
+                    note = f"{booking.notes or ''}\nCancelled as a double booking of #{kept.id}".strip()
+                    ReservedSlot.objects.filter(id=booking.id).update(status='cancelled', notes=note)
+                    cancelled += 1
+            if cancelled:
+                transaction.on_commit(invalidate_bookings_snapshot)
+
+        if not slots:
+            self.stdout.write(self.style.SUCCESS('No double-booked slots'))
+        elif options['cancel']:
+            self.stdout.write(self.style.SUCCESS(f'Cancelled {cancelled} bookings in {slots} slots'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{slots} double-booked slots; run with --cancel to resolve them'))
@@ -0,0 +1,23 @@
+"""
+Move image proxy files (MEDIA_ROOT/temp) saved under an older layout into
+the two-level hashed layout, temp/ab/cd/<name>.
+
+Run it once per media volume after deploying the layout change. Files that
+have not been moved are still served, through a slower lookup.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.media import move_proxy_files_into_layout
+
+
+class Command(BaseCommand):
+    help = 'Move image proxy files into the two-level hashed directory layout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Count the files to move without moving them')
+
+    def handle(self, *args, **options):
+        moved = move_proxy_files_into_layout(dry_run=options['dry_run'])
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {moved} files under {settings.MEDIA_ROOT}'))
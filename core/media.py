@@ -0,0 +1,412 @@
+"""
+Media storage for uploaded images.
+
+Views hand an uploaded file to MediaStore.save() with a name prefix and get
+back the stored name and its canonical absolute URL. Where the bytes go is
+decided by the backend:
+
+- LocalBackend writes under MEDIA_ROOT. Files are placed two directories deep,
+  named after a hash prefix of their name (ab/cd/<name>), so no directory
+  grows beyond a few hundred entries however many files there are. A
+  large upload already spooled to a temporary file is moved into place with
+  os.replace instead of being copied; small in-memory uploads are written to
+  a temporary name beside the target and renamed, so a reader never sees a
+  partial file.
+- S3Backend stores through django-storages.
+- CloudinaryBackend uploads to Cloudinary.
+
+Uploads are content addressed: MediaStore hashes each one with BLAKE2b and
+stores it as <digest><extension>. A MediaBlob row records every stored
+digest per backend, so uploading the same bytes again returns the existing
+name and URL without writing anything, and a URL always names the same
+bytes and can be cached forever. MediaReference rows, kept in step with the
+model fields holding media URLs by core.signals, record which digests are
+still in use so unreferenced blobs can be collected: `manage.py gc_media`
+deletes files in the image proxy directory whose digest has no reference.
+
+MEDIA_BACKEND selects the backend ('local', 's3' or 'cloudinary'); without it
+USE_CLOUDINARY and USE_S3 are honoured as before. Images served through the
+image proxy use a local store rooted at MEDIA_ROOT/temp whose URLs point at
+/api/image-proxy/.
+"""
+import errno
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from typing import NamedTuple
+from urllib.parse import urlsplit
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .image_variants import variant_dir
+from .models import MediaBlob, MediaReference, MediaUploadJob
+
+
+PROXY_DIR = 'temp'
+DIGEST_SIZE = 32
+# A content-addressed file name at the end of a URL or path
+DIGEST_RE = r'[0-9a-f]{64}'
+DIGEST_NAME_RE = re.compile(r'(?:^|/)(%s)(?:\.[A-Za-z0-9]+)?/?(?:[?#].*)?$' % DIGEST_RE)
+# Model fields holding media URLs, whose values are tracked as references
+MEDIA_URL_FIELDS = {
+    'core.offer': ('image',),
+    'core.service': ('icon',),
+    'core.subservice': ('icon',),
+}
+
+
+class StoredMedia(NamedTuple):
+    name: str
+    url: str
+
+
+def absolute_url(request, path):
+    """Absolute URL of a server path, preferring the configured server domain"""
+    if hasattr(settings, 'SERVER_DOMAIN') and hasattr(settings, 'SERVER_PROTOCOL'):
+        return f"{settings.SERVER_PROTOCOL}://{settings.SERVER_DOMAIN}{path}"
+    if request is None:
+        return path
+    return request.build_absolute_uri(path)
+
+
+def shard_name(filename):
+    """Name of filename inside its hash-prefix directories, e.g. '3f/a0/banner.png'"""
+    prefix = hashlib.sha1(filename.encode()).hexdigest()
+    return f'{prefix[:2]}/{prefix[2:4]}/{filename}'
+
+
+def legacy_names(filename):
+    """Names filename had in the proxy directory before the current layout"""
+    return (f'{hashlib.sha1(filename.encode()).hexdigest()[:2]}/{filename}', filename)
+
+
+class LocalBackend:
+    """Files under a local directory, sharded by hash prefix"""
+    key = 'local'
+
+    def __init__(self, location=None, base_url=None):
+        self.location = os.fspath(location or settings.MEDIA_ROOT)
+        self.base_url = base_url or settings.MEDIA_URL
+
+    def path(self, name):
+        return os.path.join(self.location, *name.split('/'))
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def save(self, uploaded_file, filename, folder='', request=None):
+        name = shard_name(filename)
+        destination = self.path(name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            self.move_into_place(uploaded_file.temporary_file_path(), destination)
+        else:
+            self.write_into_place(uploaded_file, destination)
+        os.chmod(destination, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        return StoredMedia(name, self.url(name, request))
+
+    @staticmethod
+    def move_into_place(source, destination):
+        try:
+            os.replace(source, destination)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # The upload temp dir is on another filesystem (see FILE_UPLOAD_TEMP_DIR)
+            shutil.copyfile(source, destination)
+
+    @staticmethod
+    def write_into_place(uploaded_file, destination):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination), suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in uploaded_file.chunks():
+                    f.write(chunk)
+            os.replace(temp_path, destination)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def url(self, name, request=None):
+        return absolute_url(request, f'{self.base_url}{name}')
+
+
+class ProxyBackend(LocalBackend):
+    """Local files served by serve_image_proxy, which resolves the shard from the name"""
+    key = 'proxy'
+
+    def __init__(self, location=None):
+        super().__init__(location or os.path.join(settings.MEDIA_ROOT, PROXY_DIR))
+
+    def url(self, name, request=None):
+        filename = name.rsplit('/', 1)[-1]
+        return absolute_url(request, reverse('serve-image-proxy', args=[filename]))
+
+    def find(self, filename):
+        """Path of a proxied file, including ones not yet moved to the current layout"""
+        for name in (shard_name(filename), *legacy_names(filename)):
+            path = self.path(name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+
+class S3Backend:
+    """Files in the S3 bucket configured for django-storages"""
+    key = 's3'
+
+    def __init__(self):
+        from storages.backends.s3boto3 import S3Boto3Storage
+        self.storage = S3Boto3Storage()
+
+    def save(self, uploaded_file, filename, folder='', request=None):
+        name = self.storage.save(f'{folder or "media"}/{shard_name(filename)}', uploaded_file)
+        return StoredMedia(name, self.url(name, request))
+
+    def exists(self, name):
+        return self.storage.exists(name)
+
+    def url(self, name, request=None):
+        return self.storage.url(name)
+
+
+class CloudinaryBackend:
+    """Images uploaded to Cloudinary; the name is the public id"""
+    key = 'cloudinary'
+
+    def exists(self, name):
+        # Checking would cost an Admin API call; the MediaBlob row is trusted
+        return True
+
+    def save(self, uploaded_file, filename, folder='', request=None):
+        import cloudinary.uploader
+        result = cloudinary.uploader.upload(
+            uploaded_file,
+            folder=folder or None,
+            public_id=os.path.splitext(filename)[0],
+            resource_type='image'
+        )
+        return StoredMedia(result['public_id'], result['secure_url'])
+
+    def url(self, name, request=None):
+        import cloudinary
+        return cloudinary.CloudinaryImage(name).build_url(secure=True)
+
+
+def configured_backend_name():
+    name = getattr(settings, 'MEDIA_BACKEND', '')
+    if name:
+        return name
+    if os.environ.get('USE_CLOUDINARY', 'False').lower() == 'true':
+        return 'cloudinary'
+    if os.environ.get('USE_S3', 'False').lower() == 'true':
+        return 's3'
+    return 'local'
+
+
+def content_digest(uploaded_file):
+    """
+    BLAKE2b hex digest of an upload, read chunk by chunk. The file is rewound
+    afterwards for backends that read() it from the current position.
+    """
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return hasher.hexdigest()
+
+
+def digest_from_url(url):
+    """Digest named by a content-addressed media URL, or None"""
+    match = DIGEST_NAME_RE.search(url or '')
+    return match.group(1) if match else None
+
+
+class MediaStore:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def save(self, uploaded_file, request=None, folder=''):
+        """
+        Store uploaded_file under its digest and return StoredMedia(name, url).
+        Content this backend already holds is not stored again. folder groups
+        files on remote backends.
+        """
+        digest = content_digest(uploaded_file)
+        blob = MediaBlob.objects.filter(backend=self.backend.key, digest=digest).first()
+        if blob is not None and self.backend.exists(blob.name):
+            # The caller may attach this URL later, so the existing file counts as new.
+            # The file itself is left alone: its mtime is part of its ETag and variant paths
+            MediaBlob.objects.filter(pk=blob.pk).update(last_uploaded_at=timezone.now())
+            return StoredMedia(blob.name, self.backend.url(blob.name, request))
+
+        extension = os.path.splitext(uploaded_file.name or '')[1].lower()
+        stored = self.backend.save(uploaded_file, digest + extension, folder, request)
+        try:
+            with transaction.atomic():
+                MediaBlob.objects.update_or_create(
+                    backend=self.backend.key, digest=digest,
+                    defaults={'name': stored.name, 'size': uploaded_file.size, 'last_uploaded_at': timezone.now()},
+                )
+        except IntegrityError:
+            # A concurrent upload of the same bytes recorded it first
+            pass
+        return stored
+
+
+def sync_media_references(instance):
+    """Point the MediaReference rows of instance's media URL fields at their current digests"""
+    label = instance._meta.label_lower
+    for field in MEDIA_URL_FIELDS.get(label, ()):
+        digest = digest_from_url(getattr(instance, field))
+        if digest:
+            MediaReference.objects.update_or_create(
+                model=label, object_id=str(instance.pk), field=field,
+                defaults={'digest': digest},
+            )
+        else:
+            MediaReference.objects.filter(model=label, object_id=str(instance.pk), field=field).delete()
+
+
+def clear_media_references(instance):
+    MediaReference.objects.filter(model=instance._meta.label_lower, object_id=str(instance.pk)).delete()
+
+
+def move_proxy_files_into_layout(dry_run=False):
+    """
+    Move files in the image proxy directory saved under an older layout
+    (temp/<name> or temp/ab/<name>) to shard_name(), and rename the MediaBlob
+    and MediaUploadJob rows naming them. Image proxy URLs only carry the file
+    name, so no stored URL changes. Returns the number of files moved.
+    """
+    backend = ProxyBackend()
+    if not os.path.isdir(backend.location):
+        return 0
+    renamed = {}
+    for directory, _, filenames in list(os.walk(backend.location)):
+        for filename in filenames:
+            if filename.endswith(('.upload', '.tmp')):
+                continue
+            source = os.path.join(directory, filename)
+            old_name = os.path.relpath(source, backend.location).replace(os.sep, '/')
+            new_name = shard_name(filename)
+            if old_name == new_name:
+                continue
+            renamed[old_name] = new_name
+            if not dry_run:
+                destination = backend.path(new_name)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(source, destination)
+    if dry_run:
+        return len(renamed)
+
+    # Drop the old shard directories left empty
+    for directory, _, _ in sorted(os.walk(backend.location), key=lambda entry: -len(entry[0])):
+        if directory != backend.location and not os.listdir(directory):
+            os.rmdir(directory)
+    for old_name, new_name in renamed.items():
+        MediaBlob.objects.filter(backend=backend.key, name=old_name).update(name=new_name)
+        MediaUploadJob.objects.filter(source_name=old_name).update(source_name=new_name)
+    return len(renamed)
+
+
+def url_file_name(url):
+    """Last path segment of a media URL, e.g. the file name of an image proxy URL"""
+    return urlsplit(url or '').path.rstrip('/').rsplit('/', 1)[-1]
+
+
+def referenced_media():
+    """
+    Return (digests, names) of the media still in use: the digests recorded
+    by MediaReference rows, and the file names of stored URLs that carry no
+    digest (uploads from before content addressing) and of files queued for
+    a job.
+    """
+    digests = set(MediaReference.objects.values_list('digest', flat=True).distinct())
+    names = set()
+    for label, fields in MEDIA_URL_FIELDS.items():
+        model = apps.get_model(label)
+        for field in fields:
+            urls = model.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''}).exclude(
+                **{f'{field}__regex': DIGEST_RE}
+            ).values_list(field, flat=True)
+            names.update(url_file_name(url) for url in urls.iterator())
+    sources = MediaUploadJob.objects.filter(status__in=('pending', 'running')).values_list('source_name', flat=True)
+    names.update(os.path.basename(name) for name in sources)
+    names.discard('')
+    return digests, names
+
+
+def proxy_orphans(min_age=0):
+    """
+    Yield the paths of files in the image proxy directory that nothing
+    references and that were last uploaded more than min_age seconds ago.
+    The age guards uploads whose URL has not been saved on a model yet. A file
+    counts as uploaded when it was written or, for content-addressed files,
+    when its MediaBlob row last saw the same bytes uploaded again.
+    """
+    digests, names = referenced_media()
+    cutoff = time.time() - min_age
+    backend = ProxyBackend()
+    recent = set(MediaBlob.objects.filter(
+        backend=backend.key,
+        last_uploaded_at__gt=timezone.now() - timedelta(seconds=min_age),
+    ).values_list('name', flat=True))
+    for directory, _, filenames in os.walk(backend.location):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if filename in names or digest_from_url(filename) in digests or filename.endswith(('.upload', '.tmp')):
+                continue
+            if os.path.relpath(path, backend.location).replace(os.sep, '/') in recent:
+                continue
+            try:
+                if os.stat(path).st_mtime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            yield path
+
+
+def delete_proxy_files(paths):
+    """Delete proxied files, their variants and their MediaBlob rows"""
+    backend = ProxyBackend()
+    names = []
+    for path in paths:
+        names.append(os.path.relpath(path, backend.location).replace(os.sep, '/'))
+        shutil.rmtree(variant_dir(path), ignore_errors=True)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    MediaBlob.objects.filter(backend=backend.key, name__in=names).delete()
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'proxy': ProxyBackend,
+    's3': S3Backend,
+    'cloudinary': CloudinaryBackend,
+}
+
+
+def backend_for(key):
+    return BACKENDS[key]()
+
+
+def get_media_store(proxied=False):
+    """
+    The store for the configured backend. With proxied, local files go to the
+    image proxy directory and get image proxy URLs.
+    """
+    name = configured_backend_name()
+    if name == 'local':
+        name = 'proxy' if proxied else 'local'
+    return MediaStore(backend_for(name))
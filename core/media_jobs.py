@@ -0,0 +1,207 @@
+"""
+Background processing of uploaded images.
+
+Slow work on an upload (copying it to Cloudinary or S3, encoding its
+variants) runs on an in-process thread pool instead of inside the request.
+Each piece of work is a MediaUploadJob row, so it survives a restart: a
+process resumes pending jobs the first time it queues one, and
+`manage.py process_media_jobs` runs them without a server. A running job is
+only taken over once it has not been updated for MEDIA_JOB_LEASE seconds, so
+a job another live worker is running is never run twice.
+
+A remote copy starts from a file already saved in the image proxy
+directory. The request returns the proxy URL straight away; when the copy
+is done the worker replaces that provisional URL on the target field with
+the remote one, unless the field was changed in the meantime.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .image_variants import VARIANT_WIDTHS, get_variant
+from .media import MediaStore, ProxyBackend, backend_for, configured_backend_name
+from .models import MediaUploadJob
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'MEDIA_JOB_MAX_ATTEMPTS', 3)
+RETRY_DELAY = getattr(settings, 'MEDIA_JOB_RETRY_DELAY', 2)
+# Longer than any upload takes; a running job older than this was abandoned
+LEASE = getattr(settings, 'MEDIA_JOB_LEASE', 600)
+
+
+class MediaJobPool:
+    """Runs MediaUploadJob rows on a small pool of worker threads"""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._futures = set()
+
+    def submit(self, job_id):
+        self._ensure_started(job_id)
+        future = self._executor.submit(self._run, job_id)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def flush(self, timeout=None):
+        """Wait for every submitted job, including retries; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                futures = list(self._futures)
+            if not futures:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            for future in futures:
+                try:
+                    future.result(remaining)
+                except Exception:
+                    # Failures are recorded on the job; a timeout is checked above
+                    pass
+
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _ensure_started(self, submitting=None):
+        if self._executor is not None:
+            return
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='media-jobs')
+        # Pick up jobs an earlier process queued but did not finish
+        for job_id in resume_unfinished_jobs():
+            if job_id != submitting:
+                self.submit(job_id)
+
+    def _run(self, job_id):
+        close_old_connections()
+        try:
+            retry = run_job(job_id)
+        finally:
+            close_old_connections()
+        if retry:
+            time.sleep(RETRY_DELAY)
+            self.submit(job_id)
+
+
+pool = MediaJobPool(getattr(settings, 'MEDIA_JOB_WORKERS', 2))
+
+
+def resume_unfinished_jobs():
+    """
+    Return jobs to pending whose lease ran out, which a stopped process left
+    running, and list every pending job.
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=LEASE)
+    MediaUploadJob.objects.filter(status='running', updated_at__lt=expired).update(status='pending', updated_at=now)
+    return list(MediaUploadJob.objects.filter(status='pending').order_by('created_at').values_list('id', flat=True))
+
+
+def enqueue(job):
+    """Start job on the pool once the current transaction commits"""
+    transaction.on_commit(lambda: pool.submit(job.id))
+    return job
+
+
+def run_job(job_id):
+    """
+    Run one job and record the outcome. Returns True when it failed and
+    should be retried. A job another worker has claimed is skipped.
+    """
+    claimed = MediaUploadJob.objects.filter(id=job_id, status='pending').update(
+        status='running', attempts=F('attempts') + 1, updated_at=timezone.now()
+    )
+    if not claimed:
+        return False
+    job = MediaUploadJob.objects.get(id=job_id)
+    try:
+        if job.kind == 'remote':
+            copy_to_remote(job)
+        else:
+            generate_variants(job)
+    except Exception as e:
+        logger.exception('Media job %s failed (attempt %d)', job.id, job.attempts)
+        retry = job.attempts < MAX_ATTEMPTS
+        MediaUploadJob.objects.filter(id=job.id).update(
+            status='pending' if retry else 'failed', error=str(e), updated_at=timezone.now()
+        )
+        return retry
+    MediaUploadJob.objects.filter(id=job.id).update(
+        status='done', result_url=job.result_url, error='', updated_at=timezone.now()
+    )
+    return False
+
+
+def copy_to_remote(job):
+    """Store the local file on job.backend and swap it in on the target field"""
+    path = ProxyBackend().path(job.source_name)
+    with open(path, 'rb') as f:
+        upload = File(f, name=os.path.basename(path))
+        stored = MediaStore(backend_for(job.backend)).save(upload, folder=job.folder)
+    job.result_url = stored.url
+
+    model = apps.get_model(job.target_model)
+    with transaction.atomic():
+        instance = model.objects.select_for_update().filter(pk=job.target_id).first()
+        # Leave the field alone if it was deleted or given another image meanwhile
+        if instance is not None and getattr(instance, job.target_field) == job.provisional_url:
+            setattr(instance, job.target_field, stored.url)
+            instance.save(update_fields=[job.target_field])
+
+
+def generate_variants(job):
+    """Encode the variants phones will ask for, so the first request finds them ready"""
+    path = ProxyBackend().path(job.source_name)
+    for width in VARIANT_WIDTHS:
+        get_variant(path, width, True)
+        get_variant(path, width, False)
+
+
+def enqueue_variants(stored):
+    """Queue encoding the variants of a file saved with ProxyBackend"""
+    return enqueue(MediaUploadJob.objects.create(kind='variants', source_name=stored.name))
+
+
+def process_upload(stored, target, field, folder=''):
+    """
+    Queue the background work for a file saved with ProxyBackend whose proxy
+    URL target.field holds for now.
+
+    Variants are always encoded. When the configured backend is remote the
+    file is also copied there, and target.field is switched to the remote URL
+    once the copy is done.
+    """
+    jobs = [enqueue_variants(stored)]
+    backend = configured_backend_name()
+    if backend != 'local':
+        jobs.append(enqueue(MediaUploadJob.objects.create(
+            kind='remote',
+            source_name=stored.name,
+            backend=backend,
+            folder=folder,
+            target_model=target._meta.label_lower,
+            target_id=str(target.pk),
+            target_field=field,
+            provisional_url=stored.url,
+        )))
+    return jobs
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:25
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_double_bookings(apps, schema_editor):
+    """Refuse to add the constraint while a slot has several upcoming bookings"""
+    ReservedSlot = apps.get_model('core', 'ReservedSlot')
+    duplicates = ReservedSlot.objects.filter(status='upcoming').values(
+        'booking_date', 'booking_time'
+    ).annotate(count=Count('id')).filter(count__gt=1).order_by('booking_date', 'booking_time')
+    if not duplicates:
+        return
+    lines = []
+    for slot in duplicates:
+        ids = ReservedSlot.objects.filter(
+            status='upcoming',
+            booking_date=slot['booking_date'],
+            booking_time=slot['booking_time'],
+        ).order_by('id').values_list('id', flat=True)
+        lines.append(f"  {slot['booking_date']} {slot['booking_time']}: bookings {', '.join(map(str, ids))}")
+    raise RuntimeError(
+        'Cannot add unique_upcoming_reserved_slot: these slots have more than one upcoming booking.\n'
+        + '\n'.join(lines)
+        + '\nResolve them (for example with `manage.py resolve_double_bookings`) and migrate again.'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_change_image_field_to_url'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(check_double_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reservedslot',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'upcoming')), fields=('booking_date', 'booking_time'), name='unique_upcoming_reserved_slot'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_reservedslot_unique_upcoming_slot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservedslot',
+            index=models.Index(fields=['booking_date', 'status', 'booking_time'], name='slot_date_status_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservedslot',
+            index=models.Index(fields=['status', 'booking_date'], name='slot_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservedslot',
+            index=models.Index(fields=['-booking_date', '-booking_time'], name='slot_date_time_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservedslot',
+            index=models.Index(fields=['-created_at'], name='slot_created_desc_idx'),
+        ),
+    ]
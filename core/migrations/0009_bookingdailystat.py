@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:33
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_daily_stats(apps, schema_editor):
+    ReservedSlot = apps.get_model('core', 'ReservedSlot')
+    BookingDailyStat = apps.get_model('core', 'BookingDailyStat')
+    rows = ReservedSlot.objects.order_by().values('booking_date', 'service_name', 'status').annotate(count=Count('id'))
+    BookingDailyStat.objects.bulk_create([
+        BookingDailyStat(
+            date=row['booking_date'],
+            service_name=row['service_name'],
+            status=row['status'],
+            count=row['count'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_reservedslot_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('service_name', models.CharField(max_length=100)),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'status', 'service_name'), name='unique_booking_daily_stat')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_mediablob_mediareference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaUploadJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('remote', 'Copy to remote backend'), ('variants', 'Generate image variants')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('source_name', models.CharField(max_length=255)),
+                ('backend', models.CharField(blank=True, max_length=20)),
+                ('folder', models.CharField(blank=True, max_length=100)),
+                ('target_model', models.CharField(blank=True, max_length=100)),
+                ('target_id', models.CharField(blank=True, max_length=64)),
+                ('target_field', models.CharField(blank=True, max_length=50)),
+                ('provisional_url', models.CharField(blank=True, max_length=500)),
+                ('result_url', models.CharField(blank=True, max_length=500)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='media_job_status_idx')],
+            },
+        ),
+    ]
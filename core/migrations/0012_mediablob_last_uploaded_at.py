@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:37
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at(apps, schema_editor):
+    # Existing blobs were last uploaded when they were first stored
+    MediaBlob = apps.get_model('core', 'MediaBlob')
+    MediaBlob.objects.update(last_uploaded_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_mediauploadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='last_uploaded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+    ]
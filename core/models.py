@@ -1,6 +1,6 @@
 
 
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.contrib.auth.models import User
 
@@ -38,10 +38,51 @@ class ReservedSlot(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['booking_date', 'booking_time'],
+                condition=models.Q(status='upcoming'),
+                name='unique_upcoming_reserved_slot',
+            ),
+        ]
+        indexes = [
+            # Availability: one day's upcoming slots
+            models.Index(fields=['booking_date', 'status', 'booking_time'], name='slot_date_status_time_idx'),
+            # Calendar and stats: status filtered over a date range
+            models.Index(fields=['status', 'booking_date'], name='slot_status_date_idx'),
+            # Admin lists ordered newest slot first
+            models.Index(fields=['-booking_date', '-booking_time'], name='slot_date_time_desc_idx'),
+            # Default ordering and the dashboard's latest bookings
+            models.Index(fields=['-created_at'], name='slot_created_desc_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.first_name} - {self.service_name} on {self.booking_date} at {self.booking_time}"
 
+    def save(self, *args, **kwargs):
+        # Keep the row and its BookingDailyStat rollup (updated by signals) in one transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+class BookingDailyStat(models.Model):
+    """Number of bookings per day, service and status, maintained on every booking write"""
+    date = models.DateField()
+    service_name = models.CharField(max_length=100)
+    status = models.CharField(max_length=20)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'status', 'service_name'],
+                name='unique_booking_daily_stat',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.service_name} ({self.status}): {self.count}"
+
 
 
 class Profile(models.Model):
@@ -173,3 +214,83 @@ class Offer(models.Model):
         self.usage_count += 1
         self.save(update_fields=['usage_count'])
 
+
+
+class MediaBlob(models.Model):
+    """An uploaded file, stored once per backend under its BLAKE2b digest"""
+    backend = models.CharField(max_length=20)
+    digest = models.CharField(max_length=64)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped when the same bytes are uploaded again; gc_media keeps recent uploads
+    last_uploaded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['backend', 'digest'],
+                name='unique_media_blob',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.backend}:{self.name}"
+
+
+class MediaReference(models.Model):
+    """A model field whose URL points at content with this digest"""
+    digest = models.CharField(max_length=64, db_index=True)
+    model = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=64)
+    field = models.CharField(max_length=50)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['model', 'object_id', 'field'],
+                name='unique_media_reference',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.model}:{self.object_id}.{self.field} -> {self.digest}"
+
+
+class MediaUploadJob(models.Model):
+    """Background work on a stored upload, run by core.media_jobs"""
+    KIND_CHOICES = [
+        ('remote', 'Copy to remote backend'),
+        ('variants', 'Generate image variants'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Local file the job reads, as a name in the image proxy directory
+    source_name = models.CharField(max_length=255)
+    backend = models.CharField(max_length=20, blank=True)
+    folder = models.CharField(max_length=100, blank=True)
+    # Field whose provisional URL is replaced with the remote one when done
+    target_model = models.CharField(max_length=100, blank=True)
+    target_id = models.CharField(max_length=64, blank=True)
+    target_field = models.CharField(max_length=50, blank=True)
+    provisional_url = models.CharField(max_length=500, blank=True)
+    result_url = models.CharField(max_length=500, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='media_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.source_name} ({self.status})"
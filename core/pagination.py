@@ -0,0 +1,94 @@
+"""
+Keyset (cursor) pagination helpers for the admin list endpoints
+"""
+import base64
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+MAX_LIMIT = getattr(settings, 'ADMIN_MAX_PAGE_SIZE', 500)
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded for the requested ordering"""
+
+
+class InvalidLimit(ValueError):
+    """Raised for a page size that is not a whole number from 1 to MAX_LIMIT"""
+
+
+def parse_limit(value, default=50):
+    """Page size from a query parameter, default when it is absent"""
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise InvalidLimit(f'limit must be a number from 1 to {MAX_LIMIT}')
+    check_limit(limit)
+    return limit
+
+
+def check_limit(limit):
+    if not 1 <= limit <= MAX_LIMIT:
+        raise InvalidLimit(f'limit must be a number from 1 to {MAX_LIMIT}')
+
+
+def encode_cursor(values):
+    """Encode the sort key of the last row into an opaque cursor"""
+    raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, fields):
+    """Decode a cursor back into typed values for the given model fields"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise InvalidCursor('Invalid cursor')
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except (ValueError, TypeError, ValidationError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def keyset_filter(fields, values, descending=True):
+    """
+    Build the seek predicate for rows strictly after the cursor position.
+
+    For fields (a, b, c) in descending order this is
+    a < va OR (a = va AND b < vb) OR (a = va AND b = vb AND c < vc).
+    """
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, field in enumerate(fields):
+        term = Q(**{f'{field}__{lookup}': values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            term &= Q(**{prev_field: prev_value})
+        condition |= term
+    return condition
+
+
+def paginate_keyset(queryset, fields, cursor, limit, descending=True):
+    """
+    Return (rows, next_cursor) for one page ordered by fields.
+
+    fields must end with a unique column so the ordering is total. One extra row
+    is fetched to tell whether another page exists; next_cursor is None on the
+    last page. Raises InvalidLimit unless 1 <= limit <= MAX_LIMIT.
+    """
+    check_limit(limit)
+    prefix = '-' if descending else ''
+    queryset = queryset.order_by(*[f'{prefix}{field}' for field in fields])
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, fields)
+        queryset = queryset.filter(keyset_filter(fields, values, descending))
+
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, field) for field in fields])
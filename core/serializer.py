@@ -67,6 +67,44 @@ class ReservedSlotSerializer(serializers.ModelSerializer):
         fields = ['id', 'service_name', 'booking_date', 'booking_time', 'duration_minutes', 'status', 'notes', 'created_at']
         read_only_fields = ['id', 'created_at']
 
+class BookingUserDetailsSerializer(serializers.ModelSerializer):
+    """User block embedded in booking payloads as user_details"""
+    phone = serializers.CharField(source='username', read_only=True)
+    gender = serializers.SerializerMethodField()
+    country = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name', 'email', 'phone', 'is_active', 'date_joined', 'gender', 'country']
+
+    def _get_profile(self, obj):
+        try:
+            return obj.profile
+        except Profile.DoesNotExist:
+            return None
+
+    def get_gender(self, obj):
+        profile = self._get_profile(obj)
+        return profile.gender if profile else ""
+
+    def get_country(self, obj):
+        profile = self._get_profile(obj)
+        return profile.country if profile else ""
+
+
+class BookingWithUserSerializer(ReservedSlotSerializer):
+    """
+    Booking with its user_details block.
+
+    Querysets should use select_related('user', 'user__profile') so a page of
+    bookings renders in a single query.
+    """
+    user_details = BookingUserDetailsSerializer(source='user', read_only=True)
+
+    class Meta(ReservedSlotSerializer.Meta):
+        fields = ReservedSlotSerializer.Meta.fields + ['user_details']
+
+
 class CreateReservedSlotSerializer(serializers.Serializer):
     service_name = serializers.CharField(max_length=100, required=True)
     booking_date = serializers.CharField(required=True)
@@ -97,9 +135,9 @@ class CreateReservedSlotSerializer(serializers.Serializer):
             raise serializers.ValidationError("Time must be in format '01:00 PM'")
     
     def create(self, validated_data):
-        """Create a new ReservedSlot instance"""
-        from .models import ReservedSlot
-        return ReservedSlot.objects.create(**validated_data)
+        """Create a new ReservedSlot instance, raises SlotAlreadyReserved if the slot is taken"""
+        from .availability import reserve_slot
+        return reserve_slot(**validated_data)
 
 
 class ChangePasswordSerializer(serializers.Serializer):
@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import ReservedSlot, BookingSettings, Offer, Service, SubService
+from .availability import invalidate_month_calendar
+from .booking_settings import bump_settings_version
+from .events import invalidate_bookings_snapshot
+from .booking_stats import bump_stats_generation, booking_stat_key, record_booking_change
+from .media import clear_media_references, sync_media_references
+
+STAT_KEY_FIELDS = ('booking_date', 'service_name', 'status')
+
+
+@receiver(post_init, sender=ReservedSlot)
+def remember_booking_date(sender, instance, **kwargs):
+    """
+    Keep the loaded booking date so a moved booking also refreshes its old month,
+    and the loaded rollup key so a save can move its BookingDailyStat count.
+    """
+    instance._loaded_booking_date = instance.__dict__.get('booking_date')
+    if all(field in instance.__dict__ for field in STAT_KEY_FIELDS):
+        instance._loaded_stat_key = booking_stat_key(instance)
+    else:
+        instance._loaded_stat_key = None
+
+
+@receiver(pre_save, sender=ReservedSlot)
+def load_stat_key(sender, instance, **kwargs):
+    """Read the stored rollup key when it was not loaded with the instance"""
+    if instance.pk is None:
+        return
+    if instance._state.adding or instance._loaded_stat_key is None:
+        instance._loaded_stat_key = sender.objects.filter(pk=instance.pk).values_list(*STAT_KEY_FIELDS).first()
+
+
+@receiver(post_save, sender=ReservedSlot)
+def reserved_slot_saved(sender, instance, created, **kwargs):
+    # Runs inside ReservedSlot.save()'s transaction, so the rollup and the row commit together
+    old_key = None if created else instance._loaded_stat_key
+    new_key = booking_stat_key(instance)
+    record_booking_change(old_key, new_key)
+    # Kept for events about this save, which also go to the topics it moved away from
+    instance._previous_stat_key = old_key
+    instance._loaded_stat_key = new_key
+
+    booking_dates = (instance._loaded_booking_date, instance.booking_date)
+    transaction.on_commit(lambda: invalidate_month_calendar(*booking_dates))
+    transaction.on_commit(bump_stats_generation)
+    instance._loaded_booking_date = instance.booking_date
+
+    # Set by publish_booking_event; the dispatcher then applies the event to the
+    # cached snapshot itself. Saves publishing nothing (the admin site) drop it.
+    instance._event_published = False
+
+    def invalidate_unless_published():
+        if not instance._event_published:
+            invalidate_bookings_snapshot()
+    transaction.on_commit(invalidate_unless_published)
+
+
+@receiver(post_delete, sender=ReservedSlot)
+def reserved_slot_deleted(sender, instance, **kwargs):
+    record_booking_change(instance._loaded_stat_key or booking_stat_key(instance), None)
+
+    booking_date = instance.booking_date
+    transaction.on_commit(lambda: invalidate_month_calendar(booking_date))
+    transaction.on_commit(bump_stats_generation)
+    # Cascaded deletes publish no event, so the cached snapshot is dropped here
+    transaction.on_commit(invalidate_bookings_snapshot)
+
+
+@receiver(post_save, sender=BookingSettings)
+@receiver(post_delete, sender=BookingSettings)
+def booking_settings_changed(sender, instance, **kwargs):
+    transaction.on_commit(bump_settings_version)
+
+
+@receiver(post_save, sender=Offer)
+@receiver(post_save, sender=Service)
+@receiver(post_save, sender=SubService)
+def media_owner_saved(sender, instance, **kwargs):
+    sync_media_references(instance)
+
+
+@receiver(post_delete, sender=Offer)
+@receiver(post_delete, sender=Service)
+@receiver(post_delete, sender=SubService)
+def media_owner_deleted(sender, instance, **kwargs):
+    clear_media_references(instance)
@@ -1,3 +1,1665 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time as timer
+import unittest
+from datetime import date, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.db import OperationalError, connection, transaction
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from asgiref.sync import async_to_sync, sync_to_async
+from PIL import Image
+from channels.layers import get_channel_layer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .availability import DayAvailability, SlotAlreadyReserved, get_month_calendar, reserve_slot
+from .booking_settings import get_active_settings
+from .consumers import BookingConsumer
+from .events import (
+    BOOKINGS_GROUP, EventDispatcher, bind_server_loop, coalesce_events, dispatcher, encode_event, frames_since,
+    get_bookings_snapshot, group_messages, invalidate_bookings_snapshot, publish_booking_event, record_event,
+    record_events, replay_key, topic_group, update_bookings_snapshot,
+)
+from . import events as booking_events
+from .booking_stats import compute_booking_stats, get_booking_stats, rebuild_daily_stats
+from .models import (
+    ReservedSlot, BookingDailyStat, BookingSettings, MediaBlob, MediaReference, MediaUploadJob, Offer, Profile, Service,
+)
+from .serializer import BookingWithUserSerializer
+from .file_serving import file_etag, serve
+from .pagination import InvalidLimit, paginate_keyset
+from . import image_variants
+from .image_variants import variant_dir, variant_path
+from .media import (
+    CloudinaryBackend, LocalBackend, MediaStore, ProxyBackend, StoredMedia, delete_proxy_files, digest_from_url,
+    get_media_store, shard_name,
+)
+from .views_booking_stream import admin_bookings_stream
+from . import media_jobs
+
+
+class DayAvailabilityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='01000000000', password='password')
+        self.day = date(2030, 1, 7)
+        self.settings = BookingSettings.objects.create(
+            WORKING_HOURS_START=9,
+            WORKING_HOURS_END=17,
+            DEFAULT_RESERVATION_DURATION_MINUTES=1,
+        )
+        for booking_time in (time(9, 0), time(9, 5), time(16, 59)):
+            ReservedSlot.objects.create(
+                user=self.user,
+                service_name='Massage',
+                booking_date=self.day,
+                booking_time=booking_time,
+            )
+        ReservedSlot.objects.create(
+            user=self.user,
+            service_name='Massage',
+            booking_date=self.day,
+            booking_time=time(10, 0),
+            status='cancelled',
+        )
+
+    def test_whole_day_uses_one_query(self):
+        availability = DayAvailability.from_settings(self.day, self.settings)
+        with self.assertNumQueries(1):
+            slots = list(availability.iter_slots())
+            self.assertTrue(availability.is_reserved(time(9, 5)))
+
+        self.assertEqual(len(slots), 8 * 60)
+        reserved = [slot_time for slot_time, _, is_reserved in slots if is_reserved]
+        self.assertEqual(reserved, [time(9, 0), time(9, 5), time(16, 59)])
+        self.assertEqual(availability.available_count(), 8 * 60 - 3)
+
+    def test_slots_must_end_within_working_hours(self):
+        availability = DayAvailability(self.day, start_hour=9, end_hour=17, duration_minutes=45)
+        slots = list(availability.iter_slots())
+        self.assertEqual(slots[-1][1], time(16, 30))
+        self.assertIsNone(availability.slot_index(time(9, 10)))
+
+    def test_available_time_slots_view_uses_one_query(self):
+        client = APIClient()
+        with self.assertNumQueries(1):
+            response = client.get('/api/reservations/available_slots/', {'date': '2030-01-07'})
+        self.assertEqual(response.status_code, 200)
+        slots = response.data['available_slots']
+        self.assertEqual(len(slots), 8)
+        self.assertFalse(slots[0]['available'])
+        self.assertTrue(slots[1]['available'])
+
+
+class MonthCalendarTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='01000000001', password='password')
+        self.settings = BookingSettings.objects.create(OFF_DAYS='4')
+        for day, hour in ((3, 9), (3, 10), (17, 9)):
+            ReservedSlot.objects.create(
+                user=self.user,
+                service_name='Massage',
+                booking_date=date(2030, 1, day),
+                booking_time=time(hour, 0),
+            )
+
+    def test_counts_come_from_one_query_and_are_cached(self):
+        with self.assertNumQueries(1):
+            days = get_month_calendar(2030, 1, self.settings)
+        self.assertEqual(len(days), 31)
+        self.assertEqual(days[2]['reserved_count'], 2)
+        self.assertEqual(days[16]['reserved_count'], 1)
+        self.assertEqual(days[0]['reserved_count'], 0)
+        self.assertTrue(days[3]['is_off_day'])
+
+        with self.assertNumQueries(0):
+            get_month_calendar(2030, 1, self.settings)
+
+    def test_booking_writes_invalidate_their_month(self):
+        get_month_calendar(2030, 1, self.settings)
+        get_month_calendar(2030, 2, self.settings)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            slot = ReservedSlot.objects.create(
+                user=self.user,
+                service_name='Massage',
+                booking_date=date(2030, 1, 17),
+                booking_time=time(15, 0),
+            )
+        self.assertEqual(get_month_calendar(2030, 1, self.settings)[16]['reserved_count'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            slot.booking_date = date(2030, 2, 1)
+            slot.save()
+        self.assertEqual(get_month_calendar(2030, 1, self.settings)[16]['reserved_count'], 1)
+        self.assertEqual(get_month_calendar(2030, 2, self.settings)[0]['reserved_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            slot.delete()
+        self.assertEqual(get_month_calendar(2030, 2, self.settings)[0]['reserved_count'], 0)
+
+    def test_settings_change_refreshes_cached_month(self):
+        get_month_calendar(2030, 1, self.settings)
+        self.settings.OFF_DAYS = ''
+        self.settings.save()
+        self.assertFalse(get_month_calendar(2030, 1, self.settings)[3]['is_off_day'])
+
+    def test_counts_read_before_a_write_commits_are_not_served_after_it(self):
+        get_off_days_list = self.settings.get_off_days_list
+
+        def commit_after_query():
+            # Another request's booking commits after this one counted the month
+            with self.captureOnCommitCallbacks(execute=True):
+                ReservedSlot.objects.create(
+                    user=self.user,
+                    service_name='Massage',
+                    booking_date=date(2030, 1, 17),
+                    booking_time=time(15, 0),
+                )
+            return get_off_days_list()
+
+        with mock.patch.object(self.settings, 'get_off_days_list', side_effect=commit_after_query):
+            self.assertEqual(get_month_calendar(2030, 1, self.settings)[16]['reserved_count'], 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_month_calendar(2030, 1, self.settings)[16]['reserved_count'], 2)
+
+
+class BookingSettingsProviderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.settings = BookingSettings.objects.create(OFF_DAYS='4,5')
+
+    def test_hot_reads_make_no_settings_query(self):
+        settings, off_days = get_active_settings()
+        self.assertEqual(settings.pk, self.settings.pk)
+        self.assertEqual(off_days, frozenset({4, 5}))
+
+        with self.assertNumQueries(0):
+            get_active_settings()
+
+    def test_saving_settings_bumps_version(self):
+        get_active_settings()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.settings.OFF_DAYS = '6'
+            self.settings.save()
+        with self.assertNumQueries(1):
+            settings, off_days = get_active_settings()
+        self.assertEqual(off_days, frozenset({6}))
+
+    def test_smart_available_slots_uses_one_query(self):
+        get_active_settings()
+        client = APIClient()
+        with self.assertNumQueries(1):
+            response = client.get('/api/booking/smart-available-slots/', {'date': '2030-01-07'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_available_slots'], 8)
+
+    def test_put_settings_is_visible_on_next_request(self):
+        client = APIClient()
+        get_active_settings()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.put('/api/booking/settings/', {'OFF_DAYS': '0'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = client.get('/api/booking/smart-available-slots/', {'date': '2030-01-07'})
+        self.assertTrue(response.data['is_off_day'])
+
+
+class SlotReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='01000000002', password='password')
+        self.fields = {
+            'user': self.user,
+            'service_name': 'Massage',
+            'booking_date': date(2030, 1, 7),
+            'booking_time': time(10, 0),
+        }
+
+    def test_second_upcoming_booking_is_rejected(self):
+        reserve_slot(**self.fields)
+        with self.assertRaises(SlotAlreadyReserved):
+            reserve_slot(**self.fields)
+
+    def test_cancelled_booking_frees_the_slot(self):
+        slot = reserve_slot(**self.fields)
+        slot.status = 'cancelled'
+        slot.save()
+        reserve_slot(**self.fields)
+        reserve_slot(status='cancelled', **self.fields)
+        self.assertEqual(ReservedSlot.objects.filter(status='upcoming').count(), 1)
+
+
+class ConcurrentSlotReservationTests(TransactionTestCase):
+    workers = 8
+    max_attempts = 200
+
+    def test_parallel_bookings_for_one_slot(self):
+        user = User.objects.create_user(username='01000000003', password='password')
+        barrier = threading.Barrier(self.workers)
+        results = []
+
+        def book():
+            barrier.wait()
+            try:
+                for _ in range(self.max_attempts):
+                    try:
+                        reserve_slot(
+                            user_id=user.id,
+                            service_name='Massage',
+                            booking_date=date(2030, 1, 7),
+                            booking_time=time(11, 0),
+                        )
+                        results.append('reserved')
+                    except SlotAlreadyReserved:
+                        results.append('conflict')
+                    except OperationalError:
+                        # SQLite's shared-cache test database reports concurrent
+                        # writers as a table lock; retry until the insert decides
+                        timer.sleep(0.01)
+                        continue
+                    break
+                else:
+                    results.append('locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+
+        self.assertEqual(results.count('locked'), 0)
+        self.assertEqual(results.count('reserved'), 1)
+        self.assertEqual(results.count('conflict'), self.workers - 1)
+        self.assertEqual(ReservedSlot.objects.filter(status='upcoming').count(), 1)
+
+
+class BookingWithUserSerializerTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='password', is_staff=True)
+        for i in range(50):
+            user = User.objects.create_user(username=f'0110000{i:04d}', first_name=f'User {i}')
+            if i % 2:
+                Profile.objects.create(user=user, gender='female', country='Egypt')
+            ReservedSlot.objects.create(
+                user=user,
+                service_name='Massage',
+                booking_date=date(2030, 1, 1 + i // 8),
+                booking_time=time(9 + i % 8, 0),
+            )
+
+    def test_page_renders_in_one_query(self):
+        bookings = ReservedSlot.objects.select_related('user', 'user__profile')[:50]
+        with self.assertNumQueries(1):
+            data = BookingWithUserSerializer(bookings, many=True).data
+        self.assertEqual(len(data), 50)
+        details = {item['user_details']['phone']: item['user_details'] for item in data}
+        self.assertEqual(details['01100000001']['country'], 'Egypt')
+        self.assertEqual(details['01100000000']['gender'], '')
+
+    def test_admin_bookings_page_query_count(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with self.assertNumQueries(2):
+            response = client.get('/api/admin/bookings/', {'limit': 50})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']), 50)
+        self.assertIn('user_details', response.data['data'][0])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='password', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        user = User.objects.create_user(username='01200000000')
+        # Several bookings share a date so the id tiebreaker matters
+        for i in range(23):
+            ReservedSlot.objects.create(
+                user=user,
+                service_name='Massage',
+                booking_date=date(2030, 1, 1 + i // 5),
+                booking_time=time(9 + i % 5, 0),
+                status='upcoming' if i % 3 else 'completed',
+            )
+
+    def walk(self, url, params):
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            response = self.client.get(url, dict(params, cursor=cursor))
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['id'] for item in response.data['data'])
+            cursor = response.data['pagination']['next_cursor']
+        return seen
+
+    def test_booking_cursor_walks_every_row_once_in_order(self):
+        seen = self.walk('/api/admin/bookings/', {'limit': 5, 'include_total': 'false'})
+        expected = list(ReservedSlot.objects.order_by('-booking_date', '-booking_time', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_cursor_page_skips_count_when_total_not_requested(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/admin/bookings/', {'limit': 5, 'cursor': '', 'include_total': 'false'})
+        self.assertNotIn('total_count', response.data['pagination'])
+        response = self.client.get('/api/admin/bookings/', {'limit': 5, 'cursor': ''})
+        self.assertEqual(response.data['pagination']['total_count'], 23)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/admin/bookings/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_out_of_range_limit_is_rejected(self):
+        for url in ('/api/admin/bookings/', '/api/admin/users/'):
+            for limit in (0, -5, 100000, 'ten'):
+                with self.subTest(url=url, limit=limit):
+                    response = self.client.get(url, {'limit': limit, 'cursor': ''})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertFalse(response.data['success'])
+        with self.assertRaises(InvalidLimit):
+            paginate_keyset(ReservedSlot.objects.all(), ['id'], '', 0)
+
+    def test_user_cursor_walks_every_user_once(self):
+        for i in range(7):
+            User.objects.create_user(username=f'0130000000{i}')
+        seen = self.walk('/api/admin/users/', {'limit': 3})
+        expected = list(User.objects.order_by('-date_joined', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+
+class BookingStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='01400000000')
+        self.today = date.today()
+        rows = [
+            ('Massage', self.today, time(9, 0), 'upcoming'),
+            ('Massage', self.today, time(10, 0), 'completed'),
+            ('Facial', self.today, time(11, 0), 'cancelled'),
+            ('Massage', date(2020, 1, 1), time(9, 0), 'completed'),
+        ]
+        for service_name, booking_date, booking_time, slot_status in rows:
+            ReservedSlot.objects.create(
+                user=self.user,
+                service_name=service_name,
+                booking_date=booking_date,
+                booking_time=booking_time,
+                status=slot_status,
+            )
+
+    def test_counts_in_two_queries(self):
+        with self.assertNumQueries(2):
+            stats = compute_booking_stats()
+        self.assertEqual(stats['total_bookings'], 4)
+        self.assertEqual(stats['upcoming_bookings'], 1)
+        self.assertEqual(stats['completed_bookings'], 2)
+        self.assertEqual(stats['cancelled_bookings'], 1)
+        self.assertEqual(stats['today_bookings'], 3)
+        self.assertEqual(stats['popular_services'][0], {'service_name': 'Massage', 'count': 3})
+
+        stats = compute_booking_stats(start_date=date(2021, 1, 1))
+        self.assertEqual(stats['total_bookings'], 3)
+
+    def test_cached_until_a_booking_is_written(self):
+        get_booking_stats()
+        with self.assertNumQueries(0):
+            get_booking_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            ReservedSlot.objects.create(
+                user=self.user,
+                service_name='Facial',
+                booking_date=self.today,
+                booking_time=time(12, 0),
+            )
+        self.assertEqual(get_booking_stats()['total_bookings'], 5)
+
+    def rollup(self):
+        return {
+            (row.date, row.service_name, row.status): row.count
+            for row in BookingDailyStat.objects.exclude(count=0)
+        }
+
+    def expected_rollup(self):
+        expected = {}
+        for slot in ReservedSlot.objects.all():
+            key = (slot.booking_date, slot.service_name, slot.status)
+            expected[key] = expected.get(key, 0) + 1
+        return expected
+
+    def test_rollup_follows_booking_writes(self):
+        self.assertEqual(self.rollup(), self.expected_rollup())
+
+        slot = ReservedSlot.objects.get(status='upcoming')
+        slot.status = 'cancelled'
+        slot.service_name = 'Facial'
+        slot.save()
+        self.assertEqual(self.rollup()[(self.today, 'Facial', 'cancelled')], 2)
+        self.assertEqual(self.rollup(), self.expected_rollup())
+
+        # Deferred fields are read back before the count is moved
+        slot = ReservedSlot.objects.only('id').get(pk=slot.pk)
+        slot.status = 'completed'
+        slot.save()
+        self.assertEqual(self.rollup(), self.expected_rollup())
+
+        slot.delete()
+        self.assertEqual(self.rollup(), self.expected_rollup())
+
+        self.user.delete()
+        self.assertEqual(self.rollup(), {})
+
+    def test_failed_reservation_leaves_rollup_unchanged(self):
+        before = self.rollup()
+        with self.assertRaises(SlotAlreadyReserved):
+            reserve_slot(
+                user=self.user,
+                service_name='Spa',
+                booking_date=self.today,
+                booking_time=time(9, 0),
+            )
+        self.assertEqual(self.rollup(), before)
+
+    def test_rebuild_repairs_drift(self):
+        BookingDailyStat.objects.update(count=99)
+        ReservedSlot.objects.filter(status='completed').update(status='cancelled')
+
+        rebuild_daily_stats(start_date=self.today)
+        self.assertEqual(self.rollup()[(date(2020, 1, 1), 'Massage', 'completed')], 99)
+        self.assertEqual(self.rollup()[(self.today, 'Massage', 'cancelled')], 1)
+
+        rebuild_daily_stats()
+        self.assertEqual(self.rollup(), self.expected_rollup())
+
+
+async def outbox_drained(consumer):
+    """Let a consumer's sender task write out everything it has queued"""
+    for _ in range(100):
+        if not consumer.outbox and not consumer.resync_pending:
+            break
+        await asyncio.sleep(0)
+    # A resync snapshot may still be loading; sync calls run one at a time
+    await sync_to_async(lambda: None)()
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+class BookingEventPublisherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='01500000000', first_name='Sara')
+        BookingSettings.objects.create(OFF_DAYS='')
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(BOOKINGS_GROUP, self.channel)
+
+    def tearDown(self):
+        async_to_sync(self.layer.flush)()
+
+    def received(self, channel=None):
+        channel = channel or self.channel
+        self.assertTrue(dispatcher.flush(timeout=5))
+        messages = []
+        # The in-memory layer creates a channel's queue on its first message
+        while channel in self.layer.channels and not self.layer.channels[channel].empty():
+            messages.append(async_to_sync(self.layer.receive)(channel))
+        return messages
+
+    def topic_channel(self, topic):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(topic_group(topic), channel)
+        return channel
+
+    def create_slot(self):
+        return ReservedSlot.objects.create(
+            user=self.user,
+            service_name='Massage',
+            booking_date=date(2030, 1, 7),
+            booking_time=time(10, 0),
+        )
+
+    def test_event_is_sent_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            slot = self.create_slot()
+            publish_booking_event('booking_created', slot)
+            self.assertEqual(self.received(), [])
+
+        for callback in callbacks:
+            callback()
+        messages = self.received()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['type'], 'booking_created')
+        frame = json.loads(messages[0]['text'])
+        self.assertEqual(frame['type'], 'booking_created')
+        self.assertIsInstance(frame['seq'], int)
+        self.assertEqual(frame['data']['id'], slot.id)
+        self.assertEqual(frame['data']['user_details']['first_name'], 'Sara')
+
+    def test_events_go_to_matching_topics(self):
+        jan_7 = self.topic_channel('date:2030-01-07')
+        jan_8 = self.topic_channel('date:2030-01-08')
+        massage = self.topic_channel('service:Massage')
+        facial = self.topic_channel('service:Facial')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            slot = self.create_slot()
+            publish_booking_event('booking_created', slot)
+        self.assertEqual(len(self.received()), 1)
+        self.assertEqual(len(self.received(jan_7)), 1)
+        self.assertEqual(len(self.received(massage)), 1)
+        self.assertEqual(self.received(jan_8), [])
+        self.assertEqual(self.received(facial), [])
+
+        # A moved booking also reaches the topics it left
+        with self.captureOnCommitCallbacks(execute=True):
+            slot.booking_date = date(2030, 1, 8)
+            slot.save()
+            publish_booking_event('booking_updated', slot)
+        self.assertEqual(len(self.received(jan_7)), 1)
+        self.assertEqual(len(self.received(jan_8)), 1)
+        self.assertEqual(self.received(facial), [])
+
+    def test_consumer_subscriptions(self):
+        consumer = BookingConsumer()
+        consumer.channel_layer = self.layer
+        consumer.channel_name = async_to_sync(self.layer.new_channel)()
+        sent = []
+
+        async def base_send(message):
+            if 'text' in message:
+                sent.append(json.loads(message['text']))
+        consumer.base_send = base_send
+
+        def groups():
+            return {group for group, members in self.layer.groups.items() if consumer.channel_name in members}
+
+        async def scenario():
+            await consumer.connect()
+            self.assertEqual(groups(), {BOOKINGS_GROUP})
+
+            await consumer.receive(json.dumps({'type': 'subscribe', 'topics': ['date:2030-01-07', 'service:Spa']}))
+            self.assertEqual(groups(), {topic_group('date:2030-01-07'), topic_group('service:Spa')})
+            self.assertEqual(sent[-1], {'type': 'subscriptions', 'topics': ['date:2030-01-07', 'service:Spa']})
+
+            await consumer.receive(json.dumps({'type': 'get_bookings'}))
+            self.assertEqual(len(sent[-1]['data']), 1)
+
+            await consumer.receive(json.dumps({'type': 'subscribe', 'topics': ['date:tomorrow']}))
+            self.assertEqual(sent[-1]['type'], 'error')
+
+            await consumer.receive(json.dumps({'type': 'unsubscribe', 'topics': ['date:2030-01-07', 'service:Spa']}))
+            self.assertEqual(groups(), {BOOKINGS_GROUP})
+            await consumer.disconnect(1000)
+
+        self.create_slot()
+        # Only the topic-filtered bookings query touches the database
+        with self.assertNumQueries(1):
+            async_to_sync(scenario)()
+
+    def test_coalesce_keeps_the_last_write(self):
+        spa, facial = topic_group('service:Spa'), topic_group('service:Facial')
+        events = coalesce_events([
+            ((BOOKINGS_GROUP, spa), 'booking_created', {'id': 1, 'status': 'upcoming'}),
+            ((BOOKINGS_GROUP,), 'booking_updated', {'id': 2}),
+            ((BOOKINGS_GROUP, facial), 'booking_updated', {'id': 1, 'status': 'cancelled'}),
+            ((BOOKINGS_GROUP,), 'booking_updated', {'id': 3}),
+            ((BOOKINGS_GROUP,), 'booking_deleted', {'id': 3}),
+        ])
+        self.assertEqual(events, [
+            ((BOOKINGS_GROUP,), 'booking_updated', {'id': 2}),
+            ((BOOKINGS_GROUP, spa, facial), 'booking_created', {'id': 1, 'status': 'cancelled'}),
+            ((BOOKINGS_GROUP,), 'booking_deleted', {'id': 3}),
+        ])
+
+    def test_burst_is_sent_as_one_batch_frame(self):
+        massage = self.topic_channel('service:Massage')
+        burst_dispatcher = EventDispatcher(coalesce_window=0.5)
+        with mock.patch('core.events.dispatcher', burst_dispatcher):
+            with self.captureOnCommitCallbacks(execute=True):
+                slot = self.create_slot()
+                publish_booking_event('booking_created', slot)
+                slot.status = 'cancelled'
+                slot.save()
+                publish_booking_event('booking_updated', slot)
+                other = ReservedSlot.objects.create(
+                    user=self.user,
+                    service_name='Facial',
+                    booking_date=date(2030, 1, 7),
+                    booking_time=time(11, 0),
+                )
+                publish_booking_event('booking_created', other)
+            self.assertTrue(burst_dispatcher.flush(timeout=5))
+
+        messages = self.received()
+        self.assertEqual(len(messages), 1)
+        frame = json.loads(messages[0]['text'])
+        self.assertEqual(frame['type'], 'bookings_batch')
+        self.assertEqual(
+            [(event['type'], event['data']['id'], event['data']['status']) for event in frame['events']],
+            [('booking_created', slot.id, 'cancelled'), ('booking_created', other.id, 'upcoming')],
+        )
+        self.assertEqual(frame['events'][1]['seq'], frame['events'][0]['seq'] + 1)
+
+        # The Massage topic only had one event, sent as a plain frame
+        massage_frames = [json.loads(message['text']) for message in self.received(massage)]
+        self.assertEqual([frame['type'] for frame in massage_frames], ['booking_created'])
+
+    def test_consumer_forwards_the_encoded_frame(self):
+        consumer = BookingConsumer()
+        consumer.channel_layer = self.layer
+        consumer.channel_name = self.channel
+        sent = []
+
+        async def base_send(message):
+            if 'text' in message:
+                sent.append(message)
+        consumer.base_send = base_send
+
+        event = encode_event('booking_updated', {'id': 1, 'booking_date': date(2030, 1, 7)})
+
+        async def scenario():
+            await consumer.connect()
+            await consumer.booking_updated(event)
+            await consumer.booking_update({'type': 'booking_update', 'data': {'id': 2}})
+            await outbox_drained(consumer)
+            await consumer.disconnect(1000)
+
+        async_to_sync(scenario)()
+        self.assertIs(sent[0]['text'], event['text'])
+        self.assertEqual(json.loads(sent[0]['text'])['data']['booking_date'], '2030-01-07')
+        self.assertEqual(json.loads(sent[1]['text']), {'type': 'booking_update', 'data': {'id': 2}})
+
+    def test_event_reaching_two_subscribed_groups_is_sent_once(self):
+        jan_7, massage = topic_group('date:2030-01-07'), topic_group('service:Massage')
+        events = [
+            ((BOOKINGS_GROUP, jan_7), 'booking_created', {'id': 1}),
+            ((BOOKINGS_GROUP, jan_7, massage), 'booking_created', {'id': 2}),
+            ((BOOKINGS_GROUP, massage), 'booking_created', {'id': 3}),
+        ]
+        messages = record_events(events)
+        by_group = dict(group_messages(events, messages))
+        consumer = BookingConsumer()
+        consumer.channel_name = self.channel
+
+        async def scenario():
+            await consumer.bookings_batch(by_group[jan_7])
+            await consumer.bookings_batch(by_group[massage])
+            await consumer.booking_created(messages[2])
+
+        async_to_sync(scenario)()
+        frames = [json.loads(text) for _, text in consumer.outbox]
+        self.assertEqual(frames[0]['type'], 'bookings_batch')
+        self.assertEqual([event['data']['id'] for event in frames[0]['events']], [1, 2])
+        self.assertEqual((frames[1]['type'], frames[1]['data']['id']), ('booking_created', 3))
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(consumer.get_metrics()['duplicates'], 2)
+
+    def test_in_memory_layer_wakes_waiting_consumers(self):
+        async def scenario():
+            # What BookingConsumer.connect records for the dispatcher
+            bind_server_loop(asyncio.get_running_loop())
+            waiting = asyncio.ensure_future(self.layer.receive(self.channel))
+            await asyncio.sleep(0)
+            await sync_to_async(dispatcher.submit)((BOOKINGS_GROUP,), 'booking_created', {'id': 1})
+            started = timer.monotonic()
+            message = await asyncio.wait_for(waiting, 5)
+            return message, timer.monotonic() - started
+
+        message, waited = async_to_sync(scenario)()
+        self.assertEqual(json.loads(message['text'])['data'], {'id': 1})
+        # A send made on another loop is only noticed when something else wakes this one
+        self.assertLess(waited, 1)
+
+    def test_rolled_back_write_sends_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                publish_booking_event('booking_created', self.create_slot())
+                transaction.set_rollback(True)
+        self.assertEqual(self.received(), [])
+
+    def test_agent_booking_conflict_sends_nothing(self):
+        self.create_slot()
+        payload = {
+            'phone': '01500000001',
+            'service_name': 'Facial',
+            'booking_date': '2030-01-07',
+            'booking_time': '10:00',
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post('/api/agent/booking/create/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username='01500000001').exists())
+        self.assertEqual(self.received(), [])
+
+        payload['booking_time'] = '11:00'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post('/api/agent/booking/create/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([message['type'] for message in self.received()], ['booking_created'])
+
+
+class BookingEventReplayTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.frames = [record_event('booking_updated', {'id': i})['text'] for i in range(1, 5)]
+
+    def test_frames_after_last_seq(self):
+        self.assertEqual([json.loads(frame)['seq'] for frame in self.frames], [1, 2, 3, 4])
+        self.assertEqual(frames_since(2), (self.frames[2:], 4))
+        self.assertEqual(frames_since(4), ([], 4))
+        # A sequence ahead of the server means the ring was reset
+        self.assertEqual(frames_since(9), (None, 4))
+
+    def test_frames_still_being_written_are_not_replayed(self):
+        set_many = cache.set_many
+        seen = []
+
+        def read_then_write(entries, *args):
+            # A client resumes between taking the sequence number and storing the frame
+            seen.append(frames_since(4))
+            set_many(entries, *args)
+
+        with mock.patch.object(booking_events.cache, 'set_many', side_effect=read_then_write):
+            frame = record_event('booking_updated', {'id': 5})['text']
+        self.assertEqual(seen, [([], 4)])
+        self.assertEqual(frames_since(4), ([frame], 5))
+
+    def test_replay_is_limited_to_subscribed_groups(self):
+        spa = topic_group('service:Spa')
+        record_event('booking_created', {'id': 5}, [BOOKINGS_GROUP, spa])
+        frames, seq = frames_since(2, {spa})
+        self.assertEqual(seq, 5)
+        self.assertEqual([json.loads(frame)['data']['id'] for frame in frames], [5])
+
+    def test_gap_outside_the_ring_needs_a_snapshot(self):
+        with mock.patch('core.events.REPLAY_SIZE', 2):
+            self.assertEqual(frames_since(1), (None, 4))
+            self.assertEqual(frames_since(2), (self.frames[2:], 4))
+            cache.delete(replay_key(4))
+            self.assertEqual(frames_since(2), (None, 4))
+
+    def test_consumer_resume(self):
+        consumer = BookingConsumer()
+        sent = []
+
+        async def base_send(message):
+            sent.append(json.loads(message['text']))
+        consumer.base_send = base_send
+
+        async def resume(last_seq):
+            await consumer.receive(json.dumps({'type': 'resume', 'last_seq': last_seq}))
+            await consumer.send_ready_frames()
+
+        async_to_sync(consumer.receive)(json.dumps({'type': 'ack', 'seq': 0}))
+        async_to_sync(resume)(2)
+        self.assertEqual([frame.get('seq') for frame in sent], [3, 4, 4])
+        self.assertEqual(sent[-1]['type'], 'resume_complete')
+        self.assertEqual(list(consumer.in_flight), [3, 4])
+
+        # Frames already replayed are not sent again when they also arrive live
+        sent.clear()
+        async_to_sync(consumer.booking_updated)({'type': 'booking_updated', 'text': self.frames[3], 'seq': 4})
+        async_to_sync(resume)(3)
+        self.assertEqual([frame['type'] for frame in sent], ['resume_complete'])
+
+        sent.clear()
+        cache.delete(replay_key(3))
+        with self.assertNumQueries(1):
+            async_to_sync(resume)(2)
+        self.assertEqual(sent, [{'type': 'bookings_data', 'seq': 4, 'data': [], 'resync': True}])
+
+
+class BookingSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='01600000000', first_name='Mona')
+        self.slots = [
+            ReservedSlot.objects.create(
+                user=self.user,
+                service_name='Massage',
+                booking_date=date(2030, 1, 7),
+                booking_time=time(hour, 0),
+            )
+            for hour in (9, 10)
+        ]
+
+    def snapshot_ids(self):
+        return [booking['id'] for booking in get_bookings_snapshot()['bookings']]
+
+    def publish(self, event_type, slot):
+        with self.captureOnCommitCallbacks(execute=True):
+            publish_booking_event(event_type, slot)
+        self.assertTrue(dispatcher.flush(timeout=5))
+
+    def test_built_with_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            snapshot = get_bookings_snapshot()
+        self.assertEqual(json.loads(snapshot['text']), snapshot['bookings'])
+        self.assertEqual(snapshot['bookings'][0]['user_details']['first_name'], 'Mona')
+
+        consumer = BookingConsumer()
+        sent = []
+
+        async def base_send(message):
+            sent.append(json.loads(message['text']))
+        consumer.base_send = base_send
+        with self.assertNumQueries(0):
+            async_to_sync(consumer.receive)(json.dumps({'type': 'get_bookings'}))
+        self.assertEqual([booking['id'] for booking in sent[0]['data']], [self.slots[1].id, self.slots[0].id])
+
+    def test_events_update_the_cached_snapshot(self):
+        get_bookings_snapshot()
+        new_slot = ReservedSlot.objects.create(
+            user=self.user,
+            service_name='Facial',
+            booking_date=date(2030, 1, 7),
+            booking_time=time(11, 0),
+        )
+        self.publish('booking_created', new_slot)
+        new_slot.status = 'completed'
+        new_slot.save()
+        self.publish('booking_updated', new_slot)
+
+        with self.assertNumQueries(0):
+            snapshot = get_bookings_snapshot()
+        self.assertEqual(snapshot['seq'], 2)
+        self.assertEqual([booking['id'] for booking in snapshot['bookings']], [new_slot.id, self.slots[1].id, self.slots[0].id])
+        self.assertEqual(snapshot['bookings'][0]['status'], 'completed')
+        self.assertEqual(json.loads(snapshot['text']), snapshot['bookings'])
+
+        # Deleting a listed booking drops the snapshot so the next one is rebuilt
+        self.publish('booking_deleted', self.slots[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slots[0].delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.snapshot_ids(), [new_slot.id, self.slots[1].id])
+
+    def test_snapshot_missing_events_is_dropped(self):
+        get_bookings_snapshot()
+        record_event('booking_updated', {'id': self.slots[0].id})
+        events = [((BOOKINGS_GROUP,), 'booking_updated', {'id': self.slots[1].id})]
+        update_bookings_snapshot(events, record_events(events))
+        with self.assertNumQueries(1):
+            get_bookings_snapshot()
+
+    def test_saves_without_an_event_drop_the_snapshot(self):
+        get_bookings_snapshot()
+        # A save that publishes its event leaves the snapshot to the dispatcher
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slots[1].status = 'completed'
+            self.slots[1].save()
+            publish_booking_event('booking_updated', self.slots[1])
+        self.assertTrue(dispatcher.flush(timeout=5))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_bookings_snapshot()['bookings'][0]['status'], 'completed')
+
+        # An admin site edit publishes nothing
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slots[1].notes = 'Edited in the admin'
+            self.slots[1].save()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_bookings_snapshot()['bookings'][0]['notes'], 'Edited in the admin')
+
+    def test_invalidation_during_an_update_is_kept(self):
+        get_bookings_snapshot()
+        events = [((BOOKINGS_GROUP,), 'booking_updated', {'id': self.slots[1].id})]
+        messages = record_events(events)
+        encode_snapshot = booking_events.encode_snapshot
+
+        def encode_after_invalidation(*args):
+            # A profile edit invalidates the snapshot after the update has read it
+            invalidate_bookings_snapshot()
+            return encode_snapshot(*args)
+
+        with mock.patch('core.events.encode_snapshot', side_effect=encode_after_invalidation):
+            update_bookings_snapshot(events, messages)
+        with self.assertNumQueries(1):
+            get_bookings_snapshot()
+
+
+class BookingStreamBackpressureTests(TestCase):
+    """A client that stops acknowledging fills only its own bounded outbox"""
+
+    def setUp(self):
+        cache.clear()
+        self.layer = get_channel_layer()
+
+    def acking_consumer(self, window):
+        consumer = BookingConsumer()
+        consumer.channel_layer = self.layer
+        consumer.channel_name = async_to_sync(self.layer.new_channel)()
+        consumer.send_queue_size = 3
+        consumer.send_window = window
+        consumer.sent = []
+
+        async def base_send(message):
+            # Like daphne, writing to the socket never waits for the client
+            if 'text' in message:
+                consumer.sent.append(json.loads(message['text']))
+        consumer.base_send = base_send
+        return consumer
+
+    async def ack(self, consumer, seq):
+        await consumer.receive(json.dumps({'type': 'ack', 'seq': seq}))
+        await outbox_drained(consumer)
+
+    def test_frames_past_the_window_wait_for_an_ack(self):
+        consumer = self.acking_consumer(window=2)
+
+        async def scenario():
+            await consumer.connect()
+            await self.ack(consumer, 0)
+            for seq in range(1, 4):
+                await consumer.booking_created(encode_event('booking_created', {'id': seq}, seq))
+            await outbox_drained(consumer)
+            stalled = [frame['seq'] for frame in consumer.sent]
+            await self.ack(consumer, 1)
+            await consumer.disconnect(1000)
+            return stalled
+
+        self.assertEqual(async_to_sync(scenario)(), [1, 2])
+        self.assertEqual([frame['seq'] for frame in consumer.sent], [1, 2, 3])
+        self.assertEqual(consumer.get_metrics()['in_flight'], 2)
+
+    def test_overflow_resyncs_with_a_snapshot(self):
+        consumer = self.acking_consumer(window=1)
+
+        async def scenario():
+            await consumer.connect()
+            await self.ack(consumer, 0)
+            for seq in range(1, 11):
+                await consumer.booking_created(encode_event('booking_created', {'id': seq}, seq))
+                await asyncio.sleep(0)
+            metrics = consumer.get_metrics()
+            # The client catches up, acknowledging each frame it handles
+            while consumer.in_flight:
+                await self.ack(consumer, consumer.in_flight[-1])
+            await consumer.disconnect(1000)
+            return metrics
+
+        metrics = async_to_sync(scenario)()
+        self.assertEqual(metrics['resyncs'], 1)
+        self.assertEqual(metrics['in_flight'], 1)
+        self.assertLessEqual(metrics['max_queue_depth'], 3)
+        # Frame 1 was sent before the client fell behind; the rest overflowed or followed the resync
+        self.assertEqual(consumer.sent[0]['seq'], 1)
+        self.assertEqual(consumer.sent[1]['type'], 'bookings_data')
+        self.assertTrue(consumer.sent[1]['resync'])
+        self.assertEqual(metrics['dropped'] + len(consumer.sent) - 1, 10)
+
+    def test_clients_that_never_ack_are_not_throttled(self):
+        consumer = self.acking_consumer(window=1)
+
+        async def scenario():
+            await consumer.connect()
+            for seq in range(1, 11):
+                await consumer.booking_created(encode_event('booking_created', {'id': seq}, seq))
+                await outbox_drained(consumer)
+            await consumer.disconnect(1000)
+
+        async_to_sync(scenario)()
+        self.assertEqual([frame['seq'] for frame in consumer.sent], list(range(1, 11)))
+        self.assertEqual(consumer.get_metrics()['dropped'], 0)
+
+
+@mock.patch('core.views_booking_stream.KEEPALIVE_INTERVAL', 0.05)
+@mock.patch('core.views_booking_stream.POLL_INTERVAL', 0.01)
+class BookingEventStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='01700000000', is_staff=True)
+        self.slot = ReservedSlot.objects.create(
+            user=self.admin,
+            service_name='Spa',
+            booking_date=date(2030, 1, 7),
+            booking_time=time(9, 0),
+        )
+
+    def open_stream(self, user=None, path='/api/admin/bookings/stream/', **headers):
+        token = AccessToken.for_user(user or self.admin)
+        request = RequestFactory().get(path, HTTP_AUTHORIZATION=f'Bearer {token}', **headers)
+        return async_to_sync(admin_bookings_stream)(request)
+
+    def read(self, response, count, between=None):
+        """Read count messages from the stream, calling between() after the first two"""
+        async def scenario():
+            chunks = []
+            stream = response.streaming_content
+            async for chunk in stream:
+                chunks.append(chunk.decode())
+                if len(chunks) == 2 and between:
+                    await sync_to_async(between)()
+                if len(chunks) == count:
+                    break
+            await stream.aclose()
+            return chunks
+
+        return async_to_sync(scenario)()
+
+    def test_requires_an_admin(self):
+        response = async_to_sync(admin_bookings_stream)(RequestFactory().get('/api/admin/bookings/stream/'))
+        self.assertEqual(response.status_code, 401)
+        customer = User.objects.create_user(username='01700000001')
+        self.assertEqual(self.open_stream(customer).status_code, 403)
+        response = self.open_stream(path='/api/admin/bookings/stream/?topic=date:soon')
+        self.assertEqual(response.status_code, 400)
+
+    def test_snapshot_events_and_keep_alive(self):
+        response = self.open_stream()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        chunks = self.read(response, 4, lambda: record_event('booking_updated', {'id': self.slot.id}))
+        self.assertEqual(chunks[0], 'retry: 3000\n\n')
+        self.assertTrue(chunks[1].startswith('id: 0\ndata: '))
+        snapshot = json.loads(chunks[1].split('data: ', 1)[1])
+        self.assertEqual([booking['id'] for booking in snapshot['data']], [self.slot.id])
+        self.assertTrue(chunks[2].startswith('id: 1\ndata: '))
+        self.assertEqual(json.loads(chunks[2].split('data: ', 1)[1])['seq'], 1)
+        self.assertEqual(chunks[3], ': keep-alive\n\n')
+
+    def test_resume_from_last_event_id(self):
+        record_event('booking_updated', {'id': 1})
+        record_event('booking_updated', {'id': 2}, [BOOKINGS_GROUP, topic_group('service:Spa')])
+        record_event('booking_updated', {'id': 3})
+
+        chunks = self.read(self.open_stream(HTTP_LAST_EVENT_ID='1'), 2)
+        self.assertEqual([json.loads(line[6:])['seq'] for line in chunks[1].split('\n') if line.startswith('data: ')], [2, 3])
+        self.assertIn('id: 3\n', chunks[1])
+
+        # Topic streams only get matching frames but still advance their id
+        chunks = self.read(self.open_stream(path='/api/admin/bookings/stream/?topic=service:Spa&last_event_id=0'), 2)
+        self.assertEqual(chunks[1], 'id: 3\ndata: %s\n\n' % frames_since(1)[0][0])
+
+        # A gap the replay ring no longer covers gets a resync snapshot
+        cache.delete(replay_key(2))
+        chunks = self.read(self.open_stream(HTTP_LAST_EVENT_ID='1'), 2)
+        self.assertTrue(json.loads(chunks[1].split('data: ', 1)[1])['resync'])
+
+
+class ImageProxyServingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, 'temp'))
+        self.data = bytes(range(256)) * 40
+        with open(os.path.join(self.media_root, 'temp', 'banner.png'), 'wb') as f:
+            f.write(self.data)
+        self.url = '/api/image-proxy/banner.png/'
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_streams_the_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(self.client.get('/api/image-proxy/missing.png/').status_code, 404)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-10:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10000-')
+        self.assertEqual(b''.join(response.streaming_content), self.data[10000:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+        # Multiple ranges are not supported; the whole file is sent instead
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url)
+        response.close()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        # A range is only resumed against the same version of the file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response.close()
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_serve_route(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        for name in ('app.css', 'app.0123456789ab.css'):
+            with open(os.path.join(static_root, name), 'w') as f:
+                f.write('body {}')
+
+        factory = RequestFactory()
+        response = serve(factory.get('/static/app.0123456789ab.css'), 'app.0123456789ab.css', static_root)
+        response.close()
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        response = serve(factory.get('/static/app.css'), 'app.css', static_root)
+        response.close()
+        response = serve(factory.get('/static/app.css', HTTP_IF_NONE_MATCH=response['ETag']), 'app.css', static_root)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+
+        # Only files under MEDIA_ROOT are handed to the front-end server
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = serve(factory.get('/static/app.css'), 'app.css', static_root)
+            self.assertNotIn('X-Accel-Redirect', response)
+            response.close()
+            response = serve(factory.get('/media/temp/banner.png'), 'temp/banner.png', self.media_root)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/temp/banner.png')
+        with self.assertRaises(Http404):
+            serve(factory.get('/static/missing.css'), 'missing.css', static_root)
+
+    def test_sendfile_offload(self):
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/temp/banner.png')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, b'')
+
+        with override_settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, 'temp', 'banner.png'))
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, 'temp'))
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.photo = os.path.join(self.media_root, 'temp', 'banner.jpg')
+        Image.frombytes('RGB', (1600, 1200), os.urandom(1600 * 1200 * 3)).save(self.photo, quality=95)
+        Image.new('RGBA', (800, 800), (255, 0, 0, 128)).save(os.path.join(self.media_root, 'temp', 'icon.png'))
+        frames = [Image.new('RGB', (400, 400), color) for color in ('red', 'blue')]
+        frames[0].save(os.path.join(self.media_root, 'temp', 'spinner.gif'), save_all=True, append_images=frames[1:])
+
+    def get(self, name, query='', accept='image/webp'):
+        response = self.client.get(f'/api/image-proxy/{name}/{query}', HTTP_ACCEPT=accept)
+        body = b''.join(response.streaming_content)
+        return response, body
+
+    def test_width_and_format_negotiation(self):
+        response, body = self.get('banner.jpg', '?w=300')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(Image.open(io.BytesIO(body)).size, (320, 240))
+        self.assertLess(len(body) * 10, os.path.getsize(self.photo))
+
+        response, body = self.get('banner.jpg', '?w=600', accept='image/jpeg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(body)).size, (640, 480))
+
+        # WebP clients get the largest variant by default; others the original
+        response, body = self.get('banner.jpg')
+        self.assertEqual(Image.open(io.BytesIO(body)).size, (1280, 960))
+        response, body = self.get('banner.jpg', accept='*/*')
+        self.assertEqual(len(body), os.path.getsize(self.photo))
+
+    def test_variants_are_generated_once(self):
+        self.get('banner.jpg', '?w=320')
+        with mock.patch('core.image_variants.encode_variant') as encode:
+            response, body = self.get('banner.jpg', '?w=320')
+        encode.assert_not_called()
+        self.assertEqual(Image.open(io.BytesIO(body)).width, 320)
+
+        # Replacing the source gives it new variants
+        Image.new('RGB', (1000, 500)).save(self.photo)
+        response, body = self.get('banner.jpg', '?w=320')
+        self.assertEqual(Image.open(io.BytesIO(body)).size, (320, 160))
+
+        # Locking leaves nothing beside the variants and no per-variant state
+        variants = os.listdir(variant_dir(self.photo))
+        self.assertEqual(len(variants), 2)
+        self.assertFalse([name for name in variants if name.endswith('.lock')])
+        self.assertEqual(len(image_variants._locks), image_variants.LOCK_STRIPES)
+
+    def test_images_that_are_not_resized(self):
+        # Transparency survives the non-WebP fallback
+        response, body = self.get('icon.png', '?w=320', accept='image/png')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(Image.open(io.BytesIO(body)).mode, 'RGBA')
+
+        # Animations are served as uploaded
+        response, body = self.get('spinner.gif', '?w=320')
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        self.assertEqual(len(body), os.path.getsize(os.path.join(self.media_root, 'temp', 'spinner.gif')))
+
+    def test_media_route(self):
+        request = RequestFactory().get('/media/temp/banner.jpg?w=640', HTTP_ACCEPT='image/webp')
+        response = serve(request, 'temp/banner.jpg', self.media_root, image_variants=True)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).width, 640)
+
+
+class MediaStoreTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_BACKEND='local')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_small_upload_is_written_into_a_shard(self):
+        request = RequestFactory().post('/')
+        stored = get_media_store().save(SimpleUploadedFile('Icon.PNG', b'icon'), request)
+
+        first, second, filename = stored.name.split('/')
+        prefix = hashlib.sha1(filename.encode()).hexdigest()
+        self.assertEqual((first, second), (prefix[:2], prefix[2:4]))
+        self.assertEqual(filename, hashlib.blake2b(b'icon', digest_size=32).hexdigest() + '.png')
+        self.assertEqual(stored.url, f'http://testserver/media/{stored.name}')
+        path = os.path.join(self.media_root, first, second, filename)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'icon')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, first, second)), [filename])
+
+    def test_spooled_upload_is_moved_not_copied(self):
+        upload = TemporaryUploadedFile('banner.jpg', 'image/jpeg', 4, None)
+        upload.write(b'data')
+        upload.flush()
+        temp_path = upload.temporary_file_path()
+        inode = os.stat(temp_path).st_ino
+
+        with mock.patch('core.media.shutil.copyfile') as copy:
+            stored = get_media_store().save(upload)
+        copy.assert_not_called()
+        upload.close()
+        path = os.path.join(self.media_root, *stored.name.split('/'))
+        self.assertFalse(os.path.exists(temp_path))
+        self.assertEqual(os.stat(path).st_ino, inode)
+
+    def test_proxied_upload_is_served_by_name(self):
+        client = APIClient()
+        response = client.post('/api/image-upload/', {'image': SimpleUploadedFile('a.png', b'png')}, format='multipart')
+        filename = response.data['filename']
+        self.assertEqual(response.data['image_url'], f'http://testserver/api/image-proxy/{filename}/')
+        self.assertTrue(os.path.isfile(os.path.join(self.media_root, 'temp', shard_name(filename))))
+
+        response = client.get(f'/api/image-proxy/{filename}/')
+        self.assertEqual(b''.join(response.streaming_content), b'png')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        # Uploading the same image again returns the same URL
+        response = client.post('/api/image-upload/', {'image': SimpleUploadedFile('b.png', b'png')}, format='multipart')
+        self.assertEqual(response.data['filename'], filename)
+
+    def test_duplicate_uploads_share_one_file(self):
+        store = get_media_store()
+        first = store.save(SimpleUploadedFile('banner.jpg', b'same bytes'))
+        with mock.patch.object(LocalBackend, 'save') as save:
+            second = store.save(SimpleUploadedFile('copy of banner.JPG', b'same bytes'))
+        save.assert_not_called()
+        self.assertEqual(second, first)
+        self.assertEqual(MediaBlob.objects.get().size, 10)
+        self.assertNotEqual(store.save(SimpleUploadedFile('other.jpg', b'other bytes')).name, first.name)
+
+        # A blob whose file went missing is stored again
+        os.remove(os.path.join(self.media_root, *first.name.split('/')))
+        self.assertEqual(store.save(SimpleUploadedFile('banner.jpg', b'same bytes')), first)
+        self.assertTrue(os.path.isfile(os.path.join(self.media_root, *first.name.split('/'))))
+
+    def test_references_follow_url_fields(self):
+        stored = get_media_store().save(SimpleUploadedFile('icon.png', b'icon'))
+        digest = digest_from_url(stored.url)
+        self.assertTrue(stored.name.endswith(f'{digest}.png'))
+
+        service = Service.objects.create(title_ar='x', title_en='Spa', icon=stored.url)
+        self.assertEqual(list(MediaReference.objects.values_list('model', 'field', 'digest')), [('core.service', 'icon', digest)])
+        service.icon = 'https://example.com/legacy_icon.png'
+        service.save()
+        self.assertFalse(MediaReference.objects.exists())
+        service.icon = stored.url
+        service.save()
+        service.delete()
+        self.assertFalse(MediaReference.objects.exists())
+
+    def test_backends_that_read_the_file_get_every_byte(self):
+        class ReadingBackend(CloudinaryBackend):
+            key = 'reading'
+            received = {}
+
+            def save(self, uploaded_file, filename, folder='', request=None):
+                self.received[filename] = uploaded_file.read()
+                return StoredMedia(filename, f'https://cdn.example.com/{filename}')
+
+        store = MediaStore(ReadingBackend())
+        store.save(SimpleUploadedFile('small.png', b'in memory'))
+        upload = TemporaryUploadedFile('large.jpg', 'image/jpeg', 7, None)
+        upload.write(b'spooled')
+        upload.flush()
+        store.save(upload)
+        upload.close()
+        self.assertEqual(sorted(ReadingBackend.received.values()), [b'in memory', b'spooled'])
+
+    def test_backend_selection(self):
+        self.assertIsInstance(get_media_store().backend, LocalBackend)
+        self.assertIsInstance(get_media_store(proxied=True).backend, ProxyBackend)
+        with override_settings(MEDIA_BACKEND='cloudinary'):
+            self.assertIsInstance(get_media_store(proxied=True).backend, CloudinaryBackend)
+
+
+class FakeRemoteBackend(LocalBackend):
+    """A remote backend that keeps its files in a local directory"""
+    key = 'fake'
+
+    def __init__(self):
+        super().__init__(os.path.join(settings.MEDIA_ROOT, 'remote'), 'https://cdn.example.com/')
+
+    def save(self, uploaded_file, filename, folder='', request=None):
+        # Read from the current position, as cloudinary.uploader.upload does
+        return super().save(ContentFile(uploaded_file.read()), filename, folder, request)
+
+
+class MediaUploadJobTests(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_BACKEND='fake')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for patcher in (
+            mock.patch.dict('core.media.BACKENDS', {'fake': FakeRemoteBackend}),
+            mock.patch.object(media_jobs, 'pool', media_jobs.MediaJobPool(1)),
+            mock.patch.object(media_jobs, 'RETRY_DELAY', 0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.admin = User.objects.create_user(username='01000000009', password='password', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def upload_offer_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1600, 900), 'teal').save(buffer, 'JPEG')
+        upload = SimpleUploadedFile('banner.jpg', buffer.getvalue(), content_type='image/jpeg')
+        return self.client.post('/api/admin/offers/create-image/', {'image': upload}, format='multipart')
+
+    def test_offer_gets_proxy_url_then_remote_url(self):
+        response = self.upload_offer_image()
+        self.assertEqual(response.status_code, 201)
+        provisional = response.data['image']
+        self.assertTrue(provisional.startswith('http://testserver/api/image-proxy/'))
+
+        self.assertTrue(media_jobs.pool.flush(timeout=30))
+        offer = Offer.objects.get(id=response.data['offer_id'])
+        digest = digest_from_url(provisional)
+        self.assertEqual(offer.image, f'https://cdn.example.com/{shard_name(digest + ".jpg")}')
+        self.assertEqual(
+            sorted(MediaUploadJob.objects.values_list('kind', 'status', 'result_url')),
+            [('remote', 'done', offer.image), ('variants', 'done', '')],
+        )
+        self.assertEqual(MediaReference.objects.get(model='core.offer').digest, digest)
+
+        # The variants were encoded ahead of the first request for them
+        source = ProxyBackend().path(shard_name(digest + '.jpg'))
+        for width in (320, 640, 1280):
+            self.assertTrue(os.path.exists(variant_path(source, width, 'webp')))
+            self.assertTrue(os.path.exists(variant_path(source, width, 'jpeg')))
+
+    def test_failed_copy_is_retried(self):
+        failures = iter([OSError('remote unavailable')])
+        save = FakeRemoteBackend.save
+
+        def flaky_save(backend, *args):
+            for error in failures:
+                raise error
+            return save(backend, *args)
+
+        with mock.patch.object(FakeRemoteBackend, 'save', autospec=True, side_effect=flaky_save), \
+                self.assertLogs('core.media_jobs', 'ERROR'):
+            response = self.upload_offer_image()
+            self.assertTrue(media_jobs.pool.flush(timeout=30))
+
+        job = MediaUploadJob.objects.get(kind='remote')
+        self.assertEqual((job.status, job.attempts, job.error), ('done', 2, ''))
+        self.assertTrue(Offer.objects.get(id=response.data['offer_id']).image.startswith('https://cdn.example.com/'))
+
+    def test_edited_image_is_not_replaced(self):
+        with mock.patch.object(media_jobs.pool, 'submit'):
+            response = self.upload_offer_image()
+        offer = Offer.objects.get(id=response.data['offer_id'])
+        offer.image = 'https://example.com/chosen.png'
+        offer.save()
+
+        call_command('process_media_jobs', stdout=io.StringIO())
+        offer.refresh_from_db()
+        self.assertEqual(offer.image, 'https://example.com/chosen.png')
+        self.assertEqual(MediaUploadJob.objects.get(kind='remote').status, 'done')
+
+    def test_interrupted_jobs_are_resumed(self):
+        with mock.patch.object(media_jobs.pool, 'submit'):
+            response = self.upload_offer_image()
+        # Another worker is still running the copy
+        MediaUploadJob.objects.filter(kind='remote').update(status='running', attempts=1)
+        call_command('process_media_jobs', stdout=io.StringIO())
+        self.assertEqual(MediaUploadJob.objects.get(kind='remote').attempts, 1)
+        offer = Offer.objects.get(id=response.data['offer_id'])
+        self.assertTrue(offer.image.startswith('http://testserver/api/image-proxy/'))
+
+        # The worker stopped mid-job and its lease ran out
+        MediaUploadJob.objects.filter(kind='remote').update(
+            updated_at=timezone.now() - timezone.timedelta(seconds=media_jobs.LEASE + 1)
+        )
+        media_jobs.pool.submit(MediaUploadJob.objects.get(kind='variants').id)
+        self.assertTrue(media_jobs.pool.flush(timeout=30))
+        self.assertEqual(list(MediaUploadJob.objects.values_list('status', flat=True).distinct()), ['done'])
+        self.assertEqual(MediaUploadJob.objects.get(kind='remote').attempts, 2)
+        offer.refresh_from_db()
+        self.assertTrue(offer.image.startswith('https://cdn.example.com/'))
+
+class MediaGarbageCollectionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_BACKEND='local')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.proxy_root = os.path.join(self.media_root, 'temp')
+
+    def proxy_file(self, name, age_hours=48):
+        path = os.path.join(self.proxy_root, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(name.encode())
+        mtime = timer.time() - age_hours * 3600
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_orphans_are_deleted_in_batches(self):
+        user = User.objects.create_user(username='01000000010', password='password')
+        now = timezone.now()
+        offer_image = get_media_store(proxied=True).save(SimpleUploadedFile('offer.png', b'offer'))
+        Offer.objects.create(
+            title='Spring', description='', image=offer_image.url, discount_value=10,
+            valid_from=now, valid_until=now, created_by=user,
+        )
+        os.utime(ProxyBackend().path(offer_image.name), (0, 0))
+        # Kept through its MediaReference row, whatever host the URL names
+        copied_image = get_media_store(proxied=True).save(SimpleUploadedFile('copied.png', b'copied'))
+        os.utime(ProxyBackend().path(copied_image.name), (0, 0))
+        Service.objects.create(title_ar='y', title_en='Sauna', icon=f'https://cdn.example.com/{copied_image.name}')
+        Service.objects.create(title_ar='x', title_en='Spa', icon='https://example.com/api/image-proxy/icon.png/')
+        kept = [
+            self.proxy_file('icon.png'),
+            self.proxy_file(shard_name('queued.png')),
+            self.proxy_file(shard_name('fresh.png'), age_hours=1),
+        ]
+        MediaUploadJob.objects.create(kind='variants', source_name=shard_name('queued.png'))
+        orphans = [self.proxy_file(shard_name(f'old{i}.png')) for i in range(3)] + [self.proxy_file('legacy.png')]
+        orphan_blob = get_media_store(proxied=True).save(SimpleUploadedFile('gone.png', b'gone'))
+        orphans.append(ProxyBackend().path(orphan_blob.name))
+        os.utime(orphans[-1], (0, 0))
+        MediaBlob.objects.filter(name=orphan_blob.name).update(last_uploaded_at=timezone.now() - timedelta(days=2))
+        variants = os.path.join(self.media_root, 'variants', 'temp', *orphan_blob.name.split('/'))
+        os.makedirs(variants)
+
+        out = io.StringIO()
+        call_command('gc_media', '--dry-run', stdout=out)
+        self.assertIn('Would delete 5 orphaned media files', out.getvalue())
+        self.assertTrue(all(os.path.exists(path) for path in orphans))
+
+        with mock.patch('core.management.commands.gc_media.delete_proxy_files', wraps=delete_proxy_files) as delete:
+            call_command('gc_media', '--batch-size', '2', stdout=out)
+        self.assertEqual([len(call.args[0]) for call in delete.call_args_list], [2, 2, 1])
+        self.assertFalse(any(os.path.exists(path) for path in orphans))
+        kept += [ProxyBackend().path(offer_image.name), ProxyBackend().path(copied_image.name)]
+        self.assertTrue(all(os.path.exists(path) for path in kept))
+        self.assertFalse(os.path.exists(variants))
+        self.assertEqual(set(MediaBlob.objects.values_list('name', flat=True)), {offer_image.name, copied_image.name})
+
+    def test_repeated_upload_counts_as_new(self):
+        store = get_media_store(proxied=True)
+        stored = store.save(SimpleUploadedFile('banner.png', b'banner'))
+        path = ProxyBackend().path(stored.name)
+        os.utime(path, (0, 0))
+        MediaBlob.objects.update(last_uploaded_at=timezone.now() - timedelta(days=2))
+        etag = file_etag(os.stat(path))
+
+        # The same bytes again, e.g. from upload_image_proxy before an offer is saved with the URL
+        self.assertEqual(store.save(SimpleUploadedFile('banner copy.png', b'banner')), stored)
+        call_command('gc_media', stdout=io.StringIO())
+        self.assertTrue(os.path.exists(path))
+        # The file is not rewritten, so its ETag and variants stay valid
+        self.assertEqual(file_etag(os.stat(path)), etag)
+
+    def test_old_layouts_are_moved_by_command(self):
+        flat = self.proxy_file('flat.png')
+        one_level = self.proxy_file(f"{hashlib.sha1(b'sharded.png').hexdigest()[:2]}/sharded.png")
+        MediaBlob.objects.create(backend='proxy', digest='a' * 64, name=os.path.relpath(one_level, self.proxy_root), size=1)
+        # Still served before they are moved
+        self.assertEqual(ProxyBackend().find('flat.png'), flat)
+        self.assertEqual(ProxyBackend().find('sharded.png'), one_level)
+
+        out = io.StringIO()
+        call_command('shard_proxy_media', '--dry-run', stdout=out)
+        self.assertIn('Would move 2', out.getvalue())
+        self.assertTrue(os.path.exists(flat))
+
+        call_command('shard_proxy_media', stdout=out)
+        for filename, old_path in (('flat.png', flat), ('sharded.png', one_level)):
+            self.assertFalse(os.path.exists(old_path))
+            self.assertEqual(ProxyBackend().find(filename), ProxyBackend().path(shard_name(filename)))
+        self.assertEqual(MediaBlob.objects.get().name, shard_name('sharded.png'))
+        self.assertEqual(sorted(os.listdir(self.proxy_root)), sorted({shard_name('flat.png')[:2], shard_name('sharded.png')[:2]}))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_local_redis():
+    """
+    Start a throwaway Redis for cross-process tests and return (url, stop).
+
+    Uses TEST_REDIS_URL when set, then a redis-server binary on PATH, then
+    fakeredis's TCP server. Returns (None, None) when none is available.
+    """
+    if os.environ.get('TEST_REDIS_URL'):
+        return os.environ['TEST_REDIS_URL'], lambda: None
+
+    port = free_port()
+    url = f'redis://127.0.0.1:{port}/0'
+    if shutil.which('redis-server'):
+        workdir = tempfile.TemporaryDirectory()
+        process = subprocess.Popen(
+            ['redis-server', '--port', str(port), '--bind', '127.0.0.1', '--save', '', '--dir', workdir.name],
+            stdout=subprocess.DEVNULL,
+        )
+        for _ in range(50):
+            try:
+                socket.create_connection(('127.0.0.1', port), 0.1).close()
+                break
+            except OSError:
+                timer.sleep(0.1)
+
+        def stop():
+            process.terminate()
+            process.wait()
+            workdir.cleanup()
+        return url, stop
+
+    try:
+        # channels_redis runs Lua scripts, which fakeredis needs lupa for
+        import lupa  # noqa: F401
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        return None, None
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+    return url, stop
+
+
+class RedisChannelLayerFanoutTests(SimpleTestCase):
+    """Booking events published in one process reach subscribers in others"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.redis_url, cls.stop_redis = start_local_redis()
+        if cls.redis_url is None:
+            raise unittest.SkipTest('Needs TEST_REDIS_URL, redis-server or fakeredis')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stop_redis()
+        super().tearDownClass()
+
+    def test_cross_process_delivery(self):
+        from .management.commands.benchmark_channel_layer import run_fanout
+
+        result = run_fanout(self.redis_url, messages=50, subscribers=2)
+        self.assertEqual(result['publisher']['sent'], 50)
+        self.assertEqual(len(result['subscribers']), 2)
+        for subscriber in result['subscribers']:
+            self.assertEqual(subscriber['received'], 50)
+            self.assertTrue(subscriber['in_order'])
@@ -10,6 +10,7 @@ from . import views_admin_offers as admin_offers
 from . import views_agent_booking as agent_booking
 from . import views_user_services as user_services
 from . import views_image_proxy as image_proxy
+from . import views_booking_stream as booking_stream
 
 
 
@@ -55,6 +56,7 @@ urlpatterns = [
     # Admin Booking Management (NEW)
     path('admin/bookings/', admin_booking.admin_get_all_bookings, name="admin-get-all-bookings"),
     path('admin/bookings/stats/', admin_booking.admin_get_booking_stats, name="admin-get-booking-stats"),
+    path('admin/bookings/stream/', booking_stream.admin_bookings_stream, name="admin-bookings-stream"),
     path('admin/bookings/<int:booking_id>/', admin_booking.admin_get_booking_details, name="admin-get-booking-details"),
     path('admin/bookings/<int:booking_id>/update/', admin_booking.admin_update_booking_status, name="admin-update-booking-status"),
     path('admin/bookings/<int:booking_id>/delete/', admin_booking.admin_delete_booking, name="admin-delete-booking"),
@@ -5,6 +5,7 @@ import os
 from django.conf import settings
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
+from .media import LocalBackend, absolute_url
 
 
 def save_media_to_static(file, filename):
@@ -16,17 +17,11 @@ def save_media_to_static(file, filename):
         return default_storage.save(f'media/{filename}', file)
     else:
         # In production, save to static files directory
-        static_media_dir = os.path.join(settings.STATIC_ROOT, 'media')
-        os.makedirs(static_media_dir, exist_ok=True)
-        
-        # Save file to static directory
-        file_path = os.path.join(static_media_dir, filename)
-        with open(file_path, 'wb') as destination:
-            for chunk in file.chunks():
-                destination.write(chunk)
-        
+        backend = LocalBackend(os.path.join(settings.STATIC_ROOT, 'media'), '/static/media/')
+        name = backend.save(file, filename).name
+
         # Return the static URL
-        return f'/static/media/{filename}'
+        return f'/static/media/{name}'
 
 
 def get_media_url(file_path):
@@ -43,9 +38,4 @@ def get_server_media_url(request, file_path):
     """
     Get the full server URL for media files
     """
-    if hasattr(settings, 'SERVER_DOMAIN') and hasattr(settings, 'SERVER_PROTOCOL'):
-        # Use server configuration for production
-        return f"{settings.SERVER_PROTOCOL}://{settings.SERVER_DOMAIN}{settings.MEDIA_URL}{file_path}"
-    else:
-        # Fallback to request.build_absolute_uri
-        return request.build_absolute_uri(f"{settings.MEDIA_URL}{file_path}")
+    return absolute_url(request, f"{settings.MEDIA_URL}{file_path}")
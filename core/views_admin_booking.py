@@ -3,9 +3,13 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from django.db.models import Q
-from datetime import datetime, date, time
+from datetime import datetime, time
 from .models import ReservedSlot, BookingSettings
-from .serializer import ReservedSlotSerializer, CreateReservedSlotSerializer
+from .serializer import ReservedSlotSerializer, CreateReservedSlotSerializer, BookingWithUserSerializer
+from .availability import SlotAlreadyReserved, save_reserved_slot
+from .pagination import InvalidCursor, InvalidLimit, paginate_keyset, parse_limit
+from .events import publish_booking_event
+from .booking_stats import get_booking_stats
 
 
 @api_view(['GET'])
@@ -14,6 +18,10 @@ def admin_get_all_bookings(request):
     """
     Admin endpoint to get all bookings with filtering and pagination.
     Only accessible by staff/superuser.
+
+    Pass cursor= (empty for the first page) to page by keyset on
+    (booking_date, booking_time, id) instead of offset, and
+    include_total=false to skip the total count.
     """
     if not request.user.is_staff and not request.user.is_superuser:
         return Response({
@@ -28,11 +36,19 @@ def admin_get_all_bookings(request):
         status_filter = request.GET.get('status')
         user_filter = request.GET.get('user_id')
         phone_filter = request.GET.get('phone')
-        limit = int(request.GET.get('limit', 50))
+        try:
+            limit = parse_limit(request.GET.get('limit'))
+        except InvalidLimit as e:
+            return Response({
+                "success": False,
+                "message": str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         offset = int(request.GET.get('offset', 0))
+        cursor = request.GET.get('cursor')
+        include_total = request.GET.get('include_total', 'true').lower() != 'false'
         
-        # Start with all bookings
-        bookings = ReservedSlot.objects.all()
+        # Start with all bookings, joined with the user details they render
+        bookings = ReservedSlot.objects.select_related('user', 'user__profile')
         
         # Apply filters
         if date_filter:
@@ -57,57 +73,44 @@ def admin_get_all_bookings(request):
         if phone_filter:
             bookings = bookings.filter(user__username__icontains=phone_filter)
         
-        # Order by date and time (newest first)
-        bookings = bookings.order_by('-booking_date', '-booking_time')
+        pagination = {"total_count": bookings.count()} if include_total else {}
         
-        # Apply pagination
-        total_count = bookings.count()
-        bookings = bookings[offset:offset + limit]
+        if cursor is not None:
+            # Keyset pagination, newest first
+            try:
+                page, next_cursor = paginate_keyset(
+                    bookings, ['booking_date', 'booking_time', 'id'], cursor, limit
+                )
+            except InvalidCursor:
+                return Response({
+                    "success": False,
+                    "message": "Invalid cursor"
+                }, status=status.HTTP_400_BAD_REQUEST)
+            pagination.update({
+                "limit": limit,
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None
+            })
+        else:
+            # Order by date and time (newest first)
+            bookings = bookings.order_by('-booking_date', '-booking_time')
+            page = list(bookings[offset:offset + limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit]
+            pagination.update({
+                "limit": limit,
+                "offset": offset,
+                "has_more": has_more
+            })
         
         # Serialize the data with user details
-        bookings_data = []
-        for booking in bookings:
-            booking_dict = ReservedSlotSerializer(booking).data
-            
-            # Add user details
-            user = booking.user
-            user_data = {
-                "id": user.id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email,
-                "phone": user.username,  # Phone is stored as username
-                "is_active": user.is_active,
-                "date_joined": user.date_joined
-            }
-            
-            # Add profile details if exists
-            try:
-                profile = user.profile
-                user_data.update({
-                    "gender": profile.gender,
-                    "country": profile.country
-                })
-            except:
-                user_data.update({
-                    "gender": "",
-                    "country": ""
-                })
-            
-            booking_dict['user_details'] = user_data
-            bookings_data.append(booking_dict)
+        bookings_data = BookingWithUserSerializer(page, many=True).data
         
         return Response({
             "success": True,
             "message": "Bookings retrieved successfully",
             "data": bookings_data,
-            "pagination": {
-                "total_count": total_count,
-                "limit": limit,
-                "offset": offset,
-                "has_more": offset + limit < total_count
-            }
+            "pagination": pagination
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -134,12 +137,12 @@ def admin_get_booking_stats(request):
         start_date = request.GET.get('start_date')
         end_date = request.GET.get('end_date')
         
-        bookings = ReservedSlot.objects.all()
+        start_date_obj = None
+        end_date_obj = None
         
         if start_date:
             try:
                 start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-                bookings = bookings.filter(booking_date__gte=start_date_obj)
             except ValueError:
                 return Response({
                     "success": False,
@@ -149,63 +152,19 @@ def admin_get_booking_stats(request):
         if end_date:
             try:
                 end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-                bookings = bookings.filter(booking_date__lte=end_date_obj)
             except ValueError:
                 return Response({
                     "success": False,
                     "message": "Invalid end_date format. Use YYYY-MM-DD"
                 }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Calculate statistics
-        total_bookings = bookings.count()
-        upcoming_bookings = bookings.filter(status='upcoming').count()
-        cancelled_bookings = bookings.filter(status='cancelled').count()
-        completed_bookings = bookings.filter(status='completed').count()
-        
-        # Get today's bookings
-        today = date.today()
-        today_bookings = bookings.filter(booking_date=today).count()
-        
-        # Get this week's bookings
-        from datetime import timedelta
-        week_start = today - timedelta(days=today.weekday())
-        week_end = week_start + timedelta(days=6)
-        week_bookings = bookings.filter(
-            booking_date__gte=week_start,
-            booking_date__lte=week_end
-        ).count()
-        
-        # Get this month's bookings
-        month_start = today.replace(day=1)
-        if today.month == 12:
-            month_end = today.replace(year=today.year + 1, month=1, day=1)
-        else:
-            month_end = today.replace(month=today.month + 1, day=1)
-        
-        month_bookings = bookings.filter(
-            booking_date__gte=month_start,
-            booking_date__lt=month_end
-        ).count()
-        
-        # Get popular services
-        from django.db.models import Count
-        popular_services = bookings.values('service_name').annotate(
-            count=Count('service_name')
-        ).order_by('-count')[:5]
+        # Calculate statistics (one aggregate plus popular services, cached briefly)
+        stats = get_booking_stats(start_date_obj, end_date_obj)
         
         return Response({
             "success": True,
             "message": "Booking statistics retrieved successfully",
-            "stats": {
-                "total_bookings": total_bookings,
-                "upcoming_bookings": upcoming_bookings,
-                "cancelled_bookings": cancelled_bookings,
-                "completed_bookings": completed_bookings,
-                "today_bookings": today_bookings,
-                "week_bookings": week_bookings,
-                "month_bookings": month_bookings,
-                "popular_services": list(popular_services)
-            }
+            "stats": stats
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -228,7 +187,7 @@ def admin_update_booking_status(request, booking_id):
         }, status=status.HTTP_403_FORBIDDEN)
     
     try:
-        booking = ReservedSlot.objects.get(id=booking_id)
+        booking = ReservedSlot.objects.select_related('user', 'user__profile').get(id=booking_id)
         
         new_status = request.data.get('status')
         if new_status not in ['upcoming', 'cancelled', 'completed']:
@@ -238,52 +197,16 @@ def admin_update_booking_status(request, booking_id):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         booking.status = new_status
-        booking.save()
-        
-        # Send WebSocket notification to admin dashboard
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        from django.contrib.auth.models import User
-        
-        channel_layer = get_channel_layer()
-        if channel_layer:
-            booking_data = ReservedSlotSerializer(booking).data
-            
-            # Add user details
-            user = booking.user
-            user_data = {
-                "id": user.id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email,
-                "phone": user.username,
-                "is_active": user.is_active,
-                "date_joined": user.date_joined.isoformat() if user.date_joined else None
-            }
-            
-            # Add profile details if exists
-            try:
-                profile = user.profile
-                user_data.update({
-                    "gender": profile.gender,
-                    "country": profile.country
-                })
-            except:
-                user_data.update({
-                    "gender": "",
-                    "country": ""
-                })
-            
-            booking_data['user_details'] = user_data
-            
-            async_to_sync(channel_layer.group_send)(
-                'admin_bookings',
-                {
-                    'type': 'booking_updated',
-                    'data': booking_data
-                }
-            )
+        try:
+            save_reserved_slot(booking)
+        except SlotAlreadyReserved:
+            return Response({
+                "success": False,
+                "message": "This time slot is already reserved"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Notify the admin dashboard once the update is committed
+        publish_booking_event('booking_updated', booking)
         
         return Response({
             "success": True,
@@ -316,57 +239,14 @@ def admin_delete_booking(request, booking_id):
         }, status=status.HTTP_403_FORBIDDEN)
     
     try:
-        booking = ReservedSlot.objects.get(id=booking_id)
-        
-        # Get booking data before deletion for WebSocket notification
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        from django.contrib.auth.models import User
-        
-        booking_data = ReservedSlotSerializer(booking).data
-        
-        # Add user details
-        user = booking.user
-        user_data = {
-            "id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email,
-            "phone": user.username,
-            "is_active": user.is_active,
-            "date_joined": user.date_joined.isoformat() if user.date_joined else None
-        }
-        
-        # Add profile details if exists
-        try:
-            profile = user.profile
-            user_data.update({
-                "gender": profile.gender,
-                "country": profile.country
-            })
-        except:
-            user_data.update({
-                "gender": "",
-                "country": ""
-            })
+        booking = ReservedSlot.objects.select_related('user', 'user__profile').get(id=booking_id)
         
-        booking_data['user_details'] = user_data
+        # Serialize before deletion; the event is sent once the delete commits
+        publish_booking_event('booking_deleted', booking)
         
         # Delete the booking
         booking.delete()
         
-        # Send WebSocket notification to admin dashboard
-        channel_layer = get_channel_layer()
-        if channel_layer:
-            async_to_sync(channel_layer.group_send)(
-                'admin_bookings',
-                {
-                    'type': 'booking_deleted',
-                    'data': booking_data
-                }
-            )
-        
         return Response({
             "success": True,
             "message": "Booking deleted successfully"
@@ -397,32 +277,9 @@ def admin_get_booking_details(request, booking_id):
         }, status=status.HTTP_403_FORBIDDEN)
     
     try:
-        booking = ReservedSlot.objects.get(id=booking_id)
-        
-        # Get user details
-        user = booking.user
-        user_data = {
-            "id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email,
-            "is_active": user.is_active,
-            "date_joined": user.date_joined
-        }
-        
-        # Get profile details if exists
-        try:
-            profile = user.profile
-            user_data.update({
-                "gender": profile.gender,
-                "country": profile.country
-            })
-        except:
-            pass
+        booking = ReservedSlot.objects.select_related('user', 'user__profile').get(id=booking_id)
         
-        booking_data = ReservedSlotSerializer(booking).data
-        booking_data['user_details'] = user_data
+        booking_data = BookingWithUserSerializer(booking).data
         
         return Response({
             "success": True,
@@ -464,52 +321,16 @@ def admin_create_booking(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # Create the booking with user_id
-        booking = serializer.save(user_id=request.data.get('user_id'))
-        
-        # Send WebSocket notification to admin dashboard
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        
-        channel_layer = get_channel_layer()
-        if channel_layer:
-            # Get user details for the notification
-            user = booking.user
-            booking_data = ReservedSlotSerializer(booking).data
-            
-            # Add user details
-            user_data = {
-                "id": user.id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email,
-                "phone": user.username,
-                "is_active": user.is_active,
-                "date_joined": user.date_joined.isoformat() if user.date_joined else None
-            }
-            
-            # Add profile details if exists
-            try:
-                profile = user.profile
-                user_data.update({
-                    "gender": profile.gender,
-                    "country": profile.country
-                })
-            except:
-                user_data.update({
-                    "gender": "",
-                    "country": ""
-                })
-            
-            booking_data['user_details'] = user_data
-            
-            async_to_sync(channel_layer.group_send)(
-                'admin_bookings',
-                {
-                    'type': 'booking_created',
-                    'data': booking_data
-                }
-            )
+        try:
+            booking = serializer.save(user_id=request.data.get('user_id'))
+        except SlotAlreadyReserved:
+            return Response({
+                "success": False,
+                "message": "This time slot is already reserved"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Notify the admin dashboard once the booking is committed
+        publish_booking_event('booking_created', booking)
         
         return Response({
             "success": True,
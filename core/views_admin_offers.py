@@ -4,13 +4,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.db.models import Q
 from django.utils import timezone
-from django.conf import settings
-import os
-import uuid
-import time
 from .models import Offer
 from .serializer import OfferSerializer, OfferCreateSerializer, OfferUpdateSerializer
-from .utils import save_media_to_static, get_media_url
+from .media import MediaStore, ProxyBackend, get_media_store
+from .media_jobs import process_upload
 
 
 @api_view(['GET'])
@@ -291,29 +288,17 @@ def admin_upload_offer_image(request, offer_id):
         # Get the uploaded file
         uploaded_file = request.FILES['image']
         
-        # Generate unique filename
-        file_extension = os.path.splitext(uploaded_file.name)[1]
-        timestamp = int(time.time())
-        unique_filename = f"offer_{offer_id}_{timestamp}_{uuid.uuid4().hex[:8]}{file_extension}"
-        
-        # Save to media directory
-        media_dir = settings.MEDIA_ROOT
-        os.makedirs(media_dir, exist_ok=True)
-        
-        # Save file to media directory
-        file_path = os.path.join(media_dir, unique_filename)
-        with open(file_path, 'wb') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
+        # Save to media storage
+        stored = get_media_store().save(uploaded_file, request, folder="offers")
         
         # Update offer with media URL
-        offer.image_url = f'/media/{unique_filename}'
+        offer.image_url = stored.url
         offer.save()
         
         return Response({
             'success': True,
             'message': 'Image uploaded successfully',
-            'image_url': f'/media/{unique_filename}',
+            'image_url': stored.url,
             'offer_id': offer.id
         }, status=status.HTTP_200_OK)
         
@@ -373,72 +358,27 @@ def admin_create_offer_image(request):
 
         uploaded_file = request.FILES['image']
 
-        # Generate unique filename
-        file_extension = os.path.splitext(uploaded_file.name)[1]
-        timestamp = int(time.time())
-        unique_filename = f"offer_{timestamp}_{uuid.uuid4().hex[:8]}{file_extension}"
-
-        # Check if Cloudinary is enabled
-        if os.environ.get('USE_CLOUDINARY', 'False').lower() == 'true':
-            # Upload to Cloudinary
-            import cloudinary.uploader
-            
-            # Upload to Cloudinary
-            result = cloudinary.uploader.upload(
-                uploaded_file,
-                folder="offers",
-                public_id=unique_filename.replace(file_extension, ''),
-                resource_type="image"
-            )
-            
-            # Get Cloudinary URL
-            image_url = result['secure_url']
-            
-            # Create minimal Offer instance with Cloudinary URL
-            now = timezone.now()
-            offer = Offer.objects.create(
-                title=uploaded_file.name or "New Offer",
-                description="",
-                image=image_url,  # Store the full Cloudinary URL
-                discount_type="percentage",
-                discount_value=0,
-                valid_from=now,
-                valid_until=now + timezone.timedelta(days=365),
-                status="active",
-                is_featured=False,
-                created_by=request.user
-            )
-        else:
-            # Use image proxy for Render compatibility
-            # Save to temp directory
-            temp_dir = os.path.join(settings.MEDIA_ROOT, 'temp')
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            file_path = os.path.join(temp_dir, unique_filename)
-            with open(file_path, 'wb+') as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
+        # Saved locally and served by the image proxy at first; when a remote
+        # backend is configured a background job copies it there and swaps
+        # in the remote URL
+        stored = MediaStore(ProxyBackend()).save(uploaded_file, request)
+        image_url = stored.url
 
-            # Build full image URL using proxy with server configuration
-            if hasattr(settings, 'SERVER_DOMAIN') and hasattr(settings, 'SERVER_PROTOCOL'):
-                image_url = f"{settings.SERVER_PROTOCOL}://{settings.SERVER_DOMAIN}/api/image-proxy/{unique_filename}"
-            else:
-                image_url = request.build_absolute_uri(f"/api/image-proxy/{unique_filename}")
-            
-            # Create minimal Offer instance with full proxy URL
-            now = timezone.now()
-            offer = Offer.objects.create(
-                title=uploaded_file.name or "New Offer",
-                description="",
-                image=image_url,  # Store the full URL directly
-                discount_type="percentage",
-                discount_value=0,
-                valid_from=now,
-                valid_until=now + timezone.timedelta(days=365),
-                status="active",
-                is_featured=False,
-                created_by=request.user
-            )
+        # Create minimal Offer instance with the full image URL
+        now = timezone.now()
+        offer = Offer.objects.create(
+            title=uploaded_file.name or "New Offer",
+            description="",
+            image=image_url,  # Store the full URL directly
+            discount_type="percentage",
+            discount_value=0,
+            valid_from=now,
+            valid_until=now + timezone.timedelta(days=365),
+            status="active",
+            is_featured=False,
+            created_by=request.user
+        )
+        process_upload(stored, offer, 'image', folder="offers")
 
         return Response(
             {
@@ -7,6 +7,7 @@ from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
 from .models import Profile
 from .serializer import UserSerializer
+from .pagination import InvalidCursor, InvalidLimit, paginate_keyset, parse_limit
 from datetime import datetime
 
 
@@ -16,6 +17,10 @@ def admin_get_all_users(request):
     """
     Admin endpoint to get all users with filtering and pagination.
     Only accessible by staff/superuser.
+
+    Pass cursor= (empty for the first page) to page by keyset on
+    (date_joined, id) instead of offset, and include_total=false to skip
+    the total count.
     """
     if not request.user.is_staff and not request.user.is_superuser:
         return Response({
@@ -38,11 +43,25 @@ def admin_get_all_users(request):
         has_profile = request.GET.get('has_profile')
         sort_by = request.GET.get('sort_by', 'date_joined')
         sort_order = request.GET.get('sort_order', 'desc')
-        limit = int(request.GET.get('limit', 50))
+        try:
+            limit = parse_limit(request.GET.get('limit'))
+        except InvalidLimit as e:
+            return Response({
+                "success": False,
+                "message": str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         offset = int(request.GET.get('offset', 0))
+        cursor = request.GET.get('cursor')
+        include_total = request.GET.get('include_total', 'true').lower() != 'false'
+        
+        if cursor is not None and sort_by != 'date_joined':
+            return Response({
+                "success": False,
+                "message": "Cursor pagination only supports sort_by=date_joined"
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         # Start with all users
-        users = User.objects.all()
+        users = User.objects.select_related('profile')
         
         # Apply filters
         if search:
@@ -114,21 +133,46 @@ def admin_get_all_users(request):
             else:
                 users = users.filter(profile__isnull=True)
         
-        # Apply sorting
-        sort_field = sort_by
-        if sort_order == 'desc':
-            sort_field = f'-{sort_by}'
+        pagination = {"total_count": users.count()} if include_total else {}
         
-        # Validate sort field
-        valid_sort_fields = ['id', 'username', 'first_name', 'last_name', 'email', 'date_joined', 'last_login', 'is_active', 'is_staff', 'is_superuser']
-        if sort_by not in valid_sort_fields:
-            sort_field = '-date_joined'
-        
-        users = users.order_by(sort_field)
-        
-        # Apply pagination
-        total_count = users.count()
-        users = users[offset:offset + limit]
+        if cursor is not None:
+            # Keyset pagination on (date_joined, id)
+            try:
+                users, next_cursor = paginate_keyset(
+                    users, ['date_joined', 'id'], cursor, limit, descending=sort_order == 'desc'
+                )
+            except InvalidCursor:
+                return Response({
+                    "success": False,
+                    "message": "Invalid cursor"
+                }, status=status.HTTP_400_BAD_REQUEST)
+            pagination.update({
+                "limit": limit,
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None
+            })
+        else:
+            # Apply sorting
+            sort_field = sort_by
+            if sort_order == 'desc':
+                sort_field = f'-{sort_by}'
+            
+            # Validate sort field
+            valid_sort_fields = ['id', 'username', 'first_name', 'last_name', 'email', 'date_joined', 'last_login', 'is_active', 'is_staff', 'is_superuser']
+            if sort_by not in valid_sort_fields:
+                sort_field = '-date_joined'
+            
+            users = users.order_by(sort_field)
+            
+            # Apply pagination
+            users = list(users[offset:offset + limit + 1])
+            has_more = len(users) > limit
+            users = users[:limit]
+            pagination.update({
+                "limit": limit,
+                "offset": offset,
+                "has_more": has_more
+            })
         
         # Serialize the data with profile details
         users_data = []
@@ -167,12 +211,7 @@ def admin_get_all_users(request):
             "success": True,
             "message": "Users retrieved successfully",
             "data": users_data,
-            "pagination": {
-                "total_count": total_count,
-                "limit": limit,
-                "offset": offset,
-                "has_more": offset + limit < total_count
-            }
+            "pagination": pagination
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
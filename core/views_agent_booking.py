@@ -5,10 +5,10 @@ from rest_framework import status
 from django.contrib.auth.models import User
 from django.db import transaction
 from datetime import datetime
-from .models import ReservedSlot, BookingSettings
 from .serializer import ReservedSlotSerializer
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from .booking_settings import get_active_settings
+from .availability import SlotAlreadyReserved, reserve_slot
+from .events import publish_booking_event
 
 
 @api_view(['POST'])
@@ -74,7 +74,7 @@ def agent_create_booking(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # Get booking settings
-        settings = BookingSettings.objects.filter(is_active=True).first()
+        settings, off_days = get_active_settings()
         if not settings:
             return Response({
                 "success": False,
@@ -83,7 +83,6 @@ def agent_create_booking(request):
         
         # Check if date is an off day
         day_of_week = booking_date.weekday()
-        off_days = settings.get_off_days_list()
         
         if day_of_week in off_days:
             return Response({
@@ -99,19 +98,6 @@ def agent_create_booking(request):
                 "message": "Booking time is outside working hours"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check if time slot is already reserved
-        existing_booking = ReservedSlot.objects.filter(
-            booking_date=booking_date,
-            booking_time=booking_time,
-            status__in=['upcoming', 'completed']
-        ).first()
-        
-        if existing_booking:
-            return Response({
-                "success": False,
-                "message": "This time slot is already reserved"
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
         # Use transaction to ensure data consistency
         with transaction.atomic():
             # Find or create user
@@ -145,61 +131,27 @@ def agent_create_booking(request):
                 except:
                     pass  # Profile creation is optional
             
-            # Create the booking
-            booking = ReservedSlot.objects.create(
-                user=user,
-                service_name=service_name,
-                booking_date=booking_date,
-                booking_time=booking_time,
-                duration_minutes=settings.DEFAULT_RESERVATION_DURATION_MINUTES,
-                status=request.data.get('status', 'upcoming'),
-                notes=request.data.get('notes', '')
-            )
-            
-            # Send WebSocket notification for real-time dashboard updates
+            # Create the booking; the unique constraint rejects a taken slot
             try:
-                channel_layer = get_channel_layer()
-                if channel_layer:
-                    # Create booking data with user details
-                    booking_data = ReservedSlotSerializer(booking).data
-                    
-                    # Add user details
-                    user_data = {
-                        "id": user.id,
-                        "username": user.username,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "email": user.email,
-                        "phone": user.username,
-                        "is_active": user.is_active,
-                        "date_joined": user.date_joined.isoformat() if user.date_joined else None
-                    }
-                    
-                    # Add profile details if exists
-                    try:
-                        profile = user.profile
-                        user_data.update({
-                            "gender": profile.gender,
-                            "country": profile.country
-                        })
-                    except:
-                        user_data.update({
-                            "gender": "",
-                            "country": ""
-                        })
-                    
-                    booking_data['user_details'] = user_data
-                    
-                    # Send WebSocket notification
-                    async_to_sync(channel_layer.group_send)(
-                        'admin_bookings',
-                        {
-                            'type': 'booking_created',
-                            'data': booking_data
-                        }
-                    )
-            except Exception as e:
-                print(f"Error sending WebSocket notification: {e}")
+                booking = reserve_slot(
+                    user=user,
+                    service_name=service_name,
+                    booking_date=booking_date,
+                    booking_time=booking_time,
+                    duration_minutes=settings.DEFAULT_RESERVATION_DURATION_MINUTES,
+                    status=request.data.get('status', 'upcoming'),
+                    notes=request.data.get('notes', '')
+                )
+            except SlotAlreadyReserved:
+                # Also roll back a user created for this booking
+                transaction.set_rollback(True)
+                return Response({
+                    "success": False,
+                    "message": "This time slot is already reserved"
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Notify the admin dashboard once the surrounding transaction commits
+            publish_booking_event('booking_created', booking)
             
             return Response({
                 "success": True,
@@ -4,12 +4,12 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from rest_framework import status
 from django.db.models import Q
-from datetime import datetime, date, time
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from datetime import datetime, date
 
 from .models import ReservedSlot
 from .serializer import ReservedSlotSerializer, CreateReservedSlotSerializer
+from .events import publish_booking_event
+from .availability import DayAvailability, SlotAlreadyReserved, reserve_slot, save_reserved_slot
 
 
 @api_view(['GET', 'POST'])
@@ -23,72 +23,21 @@ def reserved_slots(request):
         serializer = CreateReservedSlotSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        reserved_slot = ReservedSlot.objects.create(
-            user=request.user,
-            service_name=serializer.validated_data['service_name'],
-            booking_date=serializer.validated_data['booking_date'],
-            booking_time=serializer.validated_data['booking_time'],
-            duration_minutes=60,
-            status=serializer.validated_data.get('status', 'upcoming'),
-            notes=serializer.validated_data.get('notes', '')
-        )
-        
-        # Send WebSocket notification for real-time dashboard updates
-        # Use the same approach as the admin endpoint
         try:
-            channel_layer = get_channel_layer()
-            print(f"DEBUG: Channel layer: {channel_layer}")
-            
-            if channel_layer:
-                # Get user details for the notification (same as admin endpoint)
-                from django.contrib.auth.models import User
-                user = reserved_slot.user
-                
-                # Create booking data with user details
-                booking_data = ReservedSlotSerializer(reserved_slot).data
-                
-                # Add user details
-                user_data = {
-                    "id": user.id,
-                    "username": user.username,
-                    "first_name": user.first_name,
-                    "last_name": user.last_name,
-                    "email": user.email,
-                    "phone": user.username,
-                    "is_active": user.is_active,
-                    "date_joined": user.date_joined.isoformat() if user.date_joined else None
-                }
-                
-                # Add profile details if exists
-                try:
-                    profile = user.profile
-                    user_data.update({
-                        "gender": profile.gender,
-                        "country": profile.country
-                    })
-                except:
-                    user_data.update({
-                        "gender": "",
-                        "country": ""
-                    })
-                
-                booking_data['user_details'] = user_data
-                
-                print(f"DEBUG: Sending WebSocket notification for booking {reserved_slot.id}")
-                
-                # Send WebSocket notification (same as admin endpoint)
-                async_to_sync(channel_layer.group_send)(
-                    'admin_bookings',
-                    {
-                        'type': 'booking_created',
-                        'data': booking_data
-                    }
-                )
-                print(f"DEBUG: WebSocket notification sent successfully")
-            else:
-                print("DEBUG: No channel layer available")
-        except Exception as e:
-            print(f"DEBUG: Error sending WebSocket notification: {e}")
+            reserved_slot = reserve_slot(
+                user=request.user,
+                service_name=serializer.validated_data['service_name'],
+                booking_date=serializer.validated_data['booking_date'],
+                booking_time=serializer.validated_data['booking_time'],
+                duration_minutes=60,
+                status=serializer.validated_data.get('status', 'upcoming'),
+                notes=serializer.validated_data.get('notes', '')
+            )
+        except SlotAlreadyReserved:
+            return Response({"error": "This time slot is already reserved"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Notify the admin dashboard once the booking is committed
+        publish_booking_event('booking_created', reserved_slot)
         
         response_serializer = ReservedSlotSerializer(reserved_slot)
         return Response({"success": "Booking created successfully", "data": response_serializer.data}, status=status.HTTP_201_CREATED)
@@ -98,7 +47,7 @@ def reserved_slots(request):
 @permission_classes([IsAuthenticated])
 def reserved_slot_detail(request, slot_id):
     try:
-        slot = ReservedSlot.objects.get(id=slot_id, user=request.user)
+        slot = ReservedSlot.objects.select_related('user', 'user__profile').get(id=slot_id, user=request.user)
     except ReservedSlot.DoesNotExist:
         return Response({"error": "Reserved slot not found"}, status=status.HTTP_404_NOT_FOUND)
     if request.method == 'PUT':
@@ -115,104 +64,22 @@ def reserved_slot_detail(request, slot_id):
             slot.status = serializer.validated_data['status']
         if 'notes' in serializer.validated_data:
             slot.notes = serializer.validated_data['notes']
-        slot.save()
-        
-        # Send WebSocket notification to admin dashboard
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        from django.contrib.auth.models import User
+        try:
+            save_reserved_slot(slot)
+        except SlotAlreadyReserved:
+            return Response({"error": "This time slot is already reserved"}, status=status.HTTP_400_BAD_REQUEST)
         
-        channel_layer = get_channel_layer()
-        if channel_layer:
-            booking_data = ReservedSlotSerializer(slot).data
-            
-            # Add user details
-            user = slot.user
-            user_data = {
-                "id": user.id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email,
-                "phone": user.username,
-                "is_active": user.is_active,
-                "date_joined": user.date_joined.isoformat() if user.date_joined else None
-            }
-            
-            # Add profile details if exists
-            try:
-                profile = user.profile
-                user_data.update({
-                    "gender": profile.gender,
-                    "country": profile.country
-                })
-            except:
-                user_data.update({
-                    "gender": "",
-                    "country": ""
-                })
-            
-            booking_data['user_details'] = user_data
-            
-            async_to_sync(channel_layer.group_send)(
-                'admin_bookings',
-                {
-                    'type': 'booking_updated',
-                    'data': booking_data
-                }
-            )
+        # Notify the admin dashboard once the update is committed
+        publish_booking_event('booking_updated', slot)
         
         response_serializer = ReservedSlotSerializer(slot)
         return Response({"success": "Booking updated successfully", "data": response_serializer.data}, status=status.HTTP_200_OK)
     elif request.method == 'DELETE':
-        # Get booking data before cancellation for WebSocket notification
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        from django.contrib.auth.models import User
-        
-        booking_data = ReservedSlotSerializer(slot).data
-        
-        # Add user details
-        user = slot.user
-        user_data = {
-            "id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email,
-            "phone": user.username,
-            "is_active": user.is_active,
-            "date_joined": user.date_joined.isoformat() if user.date_joined else None
-        }
-        
-        # Add profile details if exists
-        try:
-            profile = user.profile
-            user_data.update({
-                "gender": profile.gender,
-                "country": profile.country
-            })
-        except:
-            user_data.update({
-                "gender": "",
-                "country": ""
-            })
-        
-        booking_data['user_details'] = user_data
-        
         slot.status = 'cancelled'
         slot.save()
         
-        # Send WebSocket notification to admin dashboard
-        channel_layer = get_channel_layer()
-        if channel_layer:
-            async_to_sync(channel_layer.group_send)(
-                'admin_bookings',
-                {
-                    'type': 'booking_updated',
-                    'data': booking_data
-                }
-            )
+        # Notify the admin dashboard once the cancellation is committed
+        publish_booking_event('booking_updated', slot)
         
         return Response({"success": "Booking cancelled successfully"}, status=status.HTTP_200_OK)
 
@@ -290,35 +157,16 @@ def available_time_slots(request):
                 "message": "Invalid date format. Use YYYY-MM-DD"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Get reserved slots for the date
-        reserved_slots = ReservedSlot.objects.filter(
-            booking_date=filter_date,
-            status='upcoming'
-        )
-        
         # Generate available time slots (9 AM to 5 PM, 1-hour slots)
         available_slots = []
-        start_hour = 9
-        end_hour = 17
+        availability = DayAvailability(filter_date, start_hour=9, end_hour=17, duration_minutes=60)
         
-        for hour in range(start_hour, end_hour):
-            slot_time = time(hour, 0)
-            
-            # Check if this time slot is already reserved
-            is_reserved = reserved_slots.filter(booking_time=slot_time).exists()
-            
-            if not is_reserved:
-                available_slots.append({
-                    "time": slot_time.strftime('%H:%M'),
-                    "display_time": slot_time.strftime('%I:%M %p'),
-                    "available": True
-                })
-            else:
-                available_slots.append({
-                    "time": slot_time.strftime('%H:%M'),
-                    "display_time": slot_time.strftime('%I:%M %p'),
-                    "available": False
-                })
+        for slot_time, _, is_reserved in availability.iter_slots():
+            available_slots.append({
+                "time": slot_time.strftime('%H:%M'),
+                "display_time": slot_time.strftime('%I:%M %p'),
+                "available": not is_reserved
+            })
         
         return Response({
             "success": True,
@@ -3,11 +3,12 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework import status
 from django.db.models import Q
-from datetime import datetime, date, time, timedelta
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from datetime import datetime, date
 from .models import ReservedSlot, BookingSettings
 from .serializer import BookingSettingsSerializer
+from .availability import DayAvailability, SlotAlreadyReserved, get_month_calendar, reserve_slot
+from .booking_settings import get_active_settings
+from .events import publish_booking_event
 
 
 @api_view(['GET', 'POST', 'PUT'])
@@ -16,7 +17,7 @@ def booking_settings_management(request):
     """Manage booking settings"""
     if request.method == 'GET':
         # Get current booking settings
-        settings = BookingSettings.objects.filter(is_active=True).first()
+        settings, _ = get_active_settings()
         if not settings:
             # Create default settings if none exist
             settings = BookingSettings.objects.create()
@@ -94,7 +95,7 @@ def smart_available_slots(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # Get booking settings
-        settings = BookingSettings.objects.filter(is_active=True).first()
+        settings, off_days = get_active_settings()
         if not settings:
             return Response({
                 "success": False,
@@ -103,7 +104,6 @@ def smart_available_slots(request):
         
         # Check if the date is an off day
         day_of_week = filter_date.weekday()  # 0=Monday, 6=Sunday
-        off_days = settings.get_off_days_list()
         
         if day_of_week in off_days:
             return Response({
@@ -114,46 +114,22 @@ def smart_available_slots(request):
                 "available_slots": []
             })
         
-        # Get reserved slots for the date
-        reserved_slots = ReservedSlot.objects.filter(
-            booking_date=filter_date,
-            status='upcoming'
-        )
-        
-        # Generate available time slots based on settings
+        # Generate time slots based on settings and mark reserved ones
         available_slots = []
         start_hour = settings.WORKING_HOURS_START
         end_hour = settings.WORKING_HOURS_END
         duration_minutes = settings.DEFAULT_RESERVATION_DURATION_MINUTES
         
-        # Create time slots based on duration
-        current_time = time(start_hour, 0)
-        end_time = time(end_hour, 0)
-        
-        while current_time < end_time:
-            # Check if this time slot is available
-            slot_end_time = (datetime.combine(date.today(), current_time) + 
-                           timedelta(minutes=duration_minutes)).time()
-            
-            # Check if slot would go beyond working hours
-            if slot_end_time > end_time:
-                break
-            
-            # Check if this time slot is already reserved
-            is_reserved = reserved_slots.filter(booking_time=current_time).exists()
-            
+        availability = DayAvailability.from_settings(filter_date, settings)
+        for slot_time, slot_end_time, is_reserved in availability.iter_slots():
             available_slots.append({
-                "time": current_time.strftime('%H:%M'),
-                "display_time": current_time.strftime('%I:%M %p'),
+                "time": slot_time.strftime('%H:%M'),
+                "display_time": slot_time.strftime('%I:%M %p'),
                 "end_time": slot_end_time.strftime('%H:%M'),
                 "duration_minutes": duration_minutes,
                 "available": not is_reserved,
                 "is_reserved": is_reserved
             })
-            
-            # Move to next slot
-            current_time = (datetime.combine(date.today(), current_time) + 
-                          timedelta(minutes=duration_minutes)).time()
         
         # Filter to return only available slots
         available_only_slots = [slot for slot in available_slots if slot['available']]
@@ -199,48 +175,17 @@ def booking_calendar(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # Get booking settings
-        settings = BookingSettings.objects.filter(is_active=True).first()
+        settings, _ = get_active_settings()
         if not settings:
             return Response({
                 "success": False,
                 "message": "No booking settings found"
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Get all reserved slots for the month
-        start_date = date(year, month, 1)
-        if month == 12:
-            end_date = date(year + 1, 1, 1)
-        else:
-            end_date = date(year, month + 1, 1)
-        
-        reserved_slots = ReservedSlot.objects.filter(
-            booking_date__gte=start_date,
-            booking_date__lt=end_date,
-            status='upcoming'
-        )
-        
-        # Create calendar data
-        calendar_data = []
-        current_date = start_date
-        
-        while current_date < end_date:
-            day_of_week = current_date.weekday()
-            off_days = settings.get_off_days_list()
-            
-            # Count reserved slots for this day
-            day_reservations = reserved_slots.filter(booking_date=current_date)
-            
-            calendar_data.append({
-                "date": current_date.strftime('%Y-%m-%d'),
-                "day": current_date.day,
-                "day_name": current_date.strftime('%A'),
-                "is_off_day": day_of_week in off_days,
-                "reserved_count": day_reservations.count(),
-                "is_weekend": day_of_week >= 5,
-                "is_today": current_date == date.today()
-            })
-            
-            current_date += timedelta(days=1)
+        # Day entries and reservation counts come from the month cache
+        days = get_month_calendar(year, month, settings)
+        today = date.today().strftime('%Y-%m-%d')
+        calendar_data = [dict(day, is_today=day['date'] == today) for day in days]
         
         return Response({
             "success": True,
@@ -252,7 +197,7 @@ def booking_calendar(request):
                 "start": f"{settings.WORKING_HOURS_START:02d}:00",
                 "end": f"{settings.WORKING_HOURS_END:02d}:00"
             },
-            "off_days": off_days
+            "off_days": settings.get_off_days_list()
         })
         
     except Exception as e:
@@ -268,7 +213,7 @@ def create_booking(request):
     """Create a new booking with validation"""
     try:
         # Get booking settings
-        settings = BookingSettings.objects.filter(is_active=True).first()
+        settings, off_days = get_active_settings()
         if not settings:
             return Response({
                 "success": False,
@@ -296,7 +241,6 @@ def create_booking(request):
         
         # Check if date is an off day
         day_of_week = booking_date.weekday()
-        off_days = settings.get_off_days_list()
         
         if day_of_week in off_days:
             return Response({
@@ -312,74 +256,26 @@ def create_booking(request):
                 "message": "Booking time is outside working hours"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check if time slot is already reserved
-        existing_booking = ReservedSlot.objects.filter(
-            booking_date=booking_date,
-            booking_time=booking_time,
-            status='upcoming'
-        ).exists()
-        
-        if existing_booking:
+        # Create the booking; the unique constraint rejects a taken slot
+        try:
+            booking = reserve_slot(
+                user_id=request.data['user_id'],
+                service_name=request.data['service_name'],
+                booking_date=booking_date,
+                booking_time=booking_time,
+                duration_minutes=settings.DEFAULT_RESERVATION_DURATION_MINUTES,
+                status='upcoming',
+                notes=request.data.get('notes', '')
+            )
+        except SlotAlreadyReserved:
             return Response({
                 "success": False,
                 "message": "This time slot is already reserved"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create the booking
-        booking = ReservedSlot.objects.create(
-            user_id=request.data['user_id'],
-            service_name=request.data['service_name'],
-            booking_date=booking_date,
-            booking_time=booking_time,
-            duration_minutes=settings.DEFAULT_RESERVATION_DURATION_MINUTES,
-            status='upcoming',
-            notes=request.data.get('notes', '')
-        )
-        
-        # Send WebSocket notification to admin dashboard
-        channel_layer = get_channel_layer()
-        if channel_layer:
-            from .serializer import ReservedSlotSerializer
-            from django.contrib.auth.models import User
-            
-            # Get user details for the notification
-            user = User.objects.get(id=booking.user_id)
-            booking_data = ReservedSlotSerializer(booking).data
-            
-            # Add user details
-            user_data = {
-                "id": user.id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email,
-                "phone": user.username,
-                "is_active": user.is_active,
-                "date_joined": user.date_joined.isoformat() if user.date_joined else None
-            }
-            
-            # Add profile details if exists
-            try:
-                profile = user.profile
-                user_data.update({
-                    "gender": profile.gender,
-                    "country": profile.country
-                })
-            except:
-                user_data.update({
-                    "gender": "",
-                    "country": ""
-                })
-            
-            booking_data['user_details'] = user_data
-            
-            async_to_sync(channel_layer.group_send)(
-                'admin_bookings',
-                {
-                    'type': 'booking_created',
-                    'data': booking_data
-                }
-            )
+        # Notify the admin dashboard once the booking is committed
+        booking = ReservedSlot.objects.select_related('user', 'user__profile').get(id=booking.id)
+        publish_booking_event('booking_created', booking)
         
         return Response({
             "success": True,
@@ -0,0 +1,132 @@
+"""
+Server-Sent Events stream of admin booking events.
+
+A one-way alternative to the booking WebSocket for displays that only listen.
+The stream reads the same sequenced replay ring the booking dispatcher fills
+for BookingConsumer, so a connection needs no channel layer group: it polls
+the shared sequence number and only fetches frames when it has moved.
+
+The first message is a bookings_data snapshot, or the missed frames when the
+client reconnects with Last-Event-ID. Every message id is the event sequence,
+so the browser's automatic reconnect resumes where it left off. Idle streams
+get a keep-alive comment so proxies do not close them.
+
+This view returns an async iterator and must be served by the ASGI app.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .events import BOOKINGS_GROUP, InvalidTopic, frames_since, snapshot_frame, topic_group
+
+
+POLL_INTERVAL = getattr(settings, 'BOOKING_STREAM_POLL_INTERVAL', 0.5)
+KEEPALIVE_INTERVAL = getattr(settings, 'BOOKING_STREAM_KEEPALIVE', 15)
+RETRY_MS = 3000
+
+
+def authenticate_stream(request):
+    """
+    Return the user of a Bearer token, read from the Authorization header or,
+    for EventSource clients that cannot set headers, from ?token=
+    """
+    auth = JWTAuthentication()
+    try:
+        result = auth.authenticate(request)
+        if result is None and request.GET.get('token'):
+            return auth.get_user(auth.get_validated_token(request.GET['token']))
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def sse_frames(frames, seq):
+    """Encode frames as SSE messages, the last carrying seq as its id"""
+    messages = [f'data: {frame}\n\n' for frame in frames[:-1]]
+    last = f'data: {frames[-1]}\n' if frames else ''
+    messages.append(f'id: {seq}\n{last}\n')
+    return ''.join(messages)
+
+
+async def booking_event_stream(topics, groups, last_seq=None):
+    yield f'retry: {RETRY_MS}\n\n'
+
+    frames = None
+    if last_seq is not None:
+        frames, seq = await sync_to_async(frames_since, thread_sensitive=False)(last_seq, groups)
+    if frames is None:
+        seq, frame = await sync_to_async(snapshot_frame)(topics, last_seq is not None)
+        frames = [frame]
+    yield sse_frames(frames, seq)
+
+    last_sent = time.monotonic()
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        frames, latest = await sync_to_async(frames_since, thread_sensitive=False)(seq, groups)
+        if frames is None:
+            # Too far behind for the replay ring, or the sequence was reset
+            latest, frame = await sync_to_async(snapshot_frame)(topics, True)
+            message = sse_frames([frame], latest)
+        elif latest != seq:
+            # Advance the id even when no frame matched the topics
+            message = sse_frames(frames, latest)
+        elif time.monotonic() - last_sent >= KEEPALIVE_INTERVAL:
+            message = ': keep-alive\n\n'
+        else:
+            continue
+        seq = latest
+        last_sent = time.monotonic()
+        yield message
+
+
+@require_GET
+async def admin_bookings_stream(request):
+    """
+    Admin endpoint streaming booking events as text/event-stream.
+    Only accessible by staff/superuser.
+
+    Pass topic= (repeatable, date:YYYY-MM-DD or service:<name>) to receive only
+    matching events. Last-Event-ID, or ?last_event_id=, resumes after that
+    sequence number.
+    """
+    user = await sync_to_async(authenticate_stream)(request)
+    if user is None:
+        return JsonResponse({
+            "success": False,
+            "message": "Authentication credentials were not provided or are invalid."
+        }, status=status.HTTP_401_UNAUTHORIZED)
+    if not user.is_staff and not user.is_superuser:
+        return JsonResponse({
+            "success": False,
+            "message": "Access denied. Admin privileges required."
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    topics = tuple(sorted(set(request.GET.getlist('topic'))))
+    try:
+        groups = {topic_group(topic) for topic in topics} or {BOOKINGS_GROUP}
+    except InvalidTopic as e:
+        return JsonResponse({
+            "success": False,
+            "message": str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID') or request.GET['last_event_id'])
+    except (KeyError, ValueError):
+        last_seq = None
+
+    response = StreamingHttpResponse(
+        booking_event_stream(topics, groups, last_seq),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
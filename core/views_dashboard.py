@@ -2,13 +2,9 @@ from rest_framework.decorators import api_view, permission_classes, authenticati
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework import status
-from django.conf import settings
 from .models import Service, SubService
 from .serializer import ServiceSerializer, ServiceCreateSerializer, SubServiceSerializer, SubServiceCreateSerializer
-from .utils import get_server_media_url
-import os
-import uuid
-import time
+from .media import get_media_store
 
 # ------------------- Service Views -------------------
 
@@ -31,14 +27,7 @@ def create_service(request):
         service_data = request.data.copy()
 
         if uploaded_file:
-            ext = os.path.splitext(uploaded_file.name)[1]
-            filename = f"service_{int(time.time())}_{uuid.uuid4().hex[:8]}{ext}"
-            os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
-            path = os.path.join(settings.MEDIA_ROOT, filename)
-            with open(path, 'wb') as f:
-                for chunk in uploaded_file.chunks():
-                    f.write(chunk)
-            service_data['icon'] = get_server_media_url(request, filename)
+            service_data['icon'] = get_media_store().save(uploaded_file, request).url
 
         serializer = ServiceCreateSerializer(data=service_data)
         if serializer.is_valid():
@@ -73,14 +62,7 @@ def update_service(request, service_id):
         service_data = request.data.copy()
 
         if uploaded_file:
-            ext = os.path.splitext(uploaded_file.name)[1]
-            filename = f"service_{service_id}_{int(time.time())}_{uuid.uuid4().hex[:8]}{ext}"
-            os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
-            path = os.path.join(settings.MEDIA_ROOT, filename)
-            with open(path, 'wb') as f:
-                for chunk in uploaded_file.chunks():
-                    f.write(chunk)
-            service_data['icon'] = get_server_media_url(request, filename)
+            service_data['icon'] = get_media_store().save(uploaded_file, request).url
 
         serializer = ServiceCreateSerializer(service, data=service_data, partial=True)
         if serializer.is_valid():
@@ -128,14 +110,7 @@ def create_sub_service(request):
         sub_service_data['service'] = service_instance.id
 
         if uploaded_file:
-            ext = os.path.splitext(uploaded_file.name)[1]
-            filename = f"subservice_{int(time.time())}_{uuid.uuid4().hex[:8]}{ext}"
-            os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
-            path = os.path.join(settings.MEDIA_ROOT, filename)
-            with open(path, 'wb') as f:
-                for chunk in uploaded_file.chunks():
-                    f.write(chunk)
-            sub_service_data['icon'] = get_server_media_url(request, filename)
+            sub_service_data['icon'] = get_media_store().save(uploaded_file, request).url
 
         serializer = SubServiceCreateSerializer(data=sub_service_data)
         if serializer.is_valid():
@@ -168,14 +143,7 @@ def update_sub_service(request, sub_service_id):
         sub_service_data = request.data.copy()
 
         if uploaded_file:
-            ext = os.path.splitext(uploaded_file.name)[1]
-            filename = f"subservice_{sub_service_id}_{int(time.time())}_{uuid.uuid4().hex[:8]}{ext}"
-            os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
-            path = os.path.join(settings.MEDIA_ROOT, filename)
-            with open(path, 'wb') as f:
-                for chunk in uploaded_file.chunks():
-                    f.write(chunk)
-            sub_service_data['icon'] = get_server_media_url(request, filename)
+            sub_service_data['icon'] = get_media_store().save(uploaded_file, request).url
 
         serializer = SubServiceCreateSerializer(sub_service, data=sub_service_data, partial=True)
         if serializer.is_valid():
@@ -2,16 +2,18 @@
 Image proxy views for handling image uploads and serving
 """
 import os
-import uuid
-import time
 from django.http import HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.conf import settings
+from django.utils.cache import patch_vary_headers
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from .file_serving import IMMUTABLE_CACHE_CONTROL, file_response
+from .image_variants import negotiate_image
+from .media import MediaStore, ProxyBackend
+from .media_jobs import enqueue_variants
 
 
 @api_view(['POST'])
@@ -29,26 +31,11 @@ def upload_image_proxy(request):
 
         uploaded_file = request.FILES['image']
         
-        # Generate unique filename
-        file_extension = os.path.splitext(uploaded_file.name)[1]
-        timestamp = int(time.time())
-        unique_filename = f"image_{timestamp}_{uuid.uuid4().hex[:8]}{file_extension}"
-
-        # Save to a temporary location
-        temp_dir = os.path.join(settings.MEDIA_ROOT, 'temp')
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        file_path = os.path.join(temp_dir, unique_filename)
-        with open(file_path, 'wb+') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
-
-        # Return proxy URL using server configuration
-        if hasattr(settings, 'SERVER_DOMAIN') and hasattr(settings, 'SERVER_PROTOCOL'):
-            full_url = f"{settings.SERVER_PROTOCOL}://{settings.SERVER_DOMAIN}/api/image-proxy/{unique_filename}"
-        else:
-            proxy_url = f"/api/image-proxy/{unique_filename}"
-            full_url = request.build_absolute_uri(proxy_url)
+        # Save to the image proxy directory and return its proxy URL
+        stored = MediaStore(ProxyBackend()).save(uploaded_file, request)
+        enqueue_variants(stored)
+        unique_filename = os.path.basename(stored.name)
+        full_url = stored.url
 
         return Response({
             "success": True,
@@ -63,57 +50,63 @@ def upload_image_proxy(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(['GET', 'OPTIONS'])
-@permission_classes([AllowAny])
+@require_http_methods(['GET', 'HEAD', 'OPTIONS'])
 def serve_image_proxy(request, filename):
     """
-    Serve image through proxy
+    Serve image through proxy.
+
+    A plain Django view rather than a DRF one: DRF's content negotiation would
+    answer a client accepting only image/webp with 406 before the image
+    variant negotiation runs.
     """
     # Handle OPTIONS request for CORS preflight
     if request.method == 'OPTIONS':
         response = HttpResponse()
         response['Access-Control-Allow-Origin'] = '*'
         response['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS, PATCH'
-        response['Access-Control-Allow-Headers'] = 'accept, accept-encoding, authorization, content-type, dnt, origin, user-agent, x-csrftoken, x-requested-with'
+        response['Access-Control-Allow-Headers'] = 'accept, accept-encoding, authorization, content-type, dnt, if-modified-since, if-none-match, if-range, origin, range, user-agent, x-csrftoken, x-requested-with'
         response['Access-Control-Max-Age'] = '86400'  # Cache for 24 hours
         response['Access-Control-Allow-Credentials'] = 'true'
         return response
     
-    try:
-        file_path = os.path.join(settings.MEDIA_ROOT, 'temp', filename)
-        
-        if not os.path.exists(file_path):
-            raise Http404("Image not found")
-        
-        with open(file_path, 'rb') as f:
-            # Determine content type based on file extension
-            file_extension = os.path.splitext(filename)[1].lower()
-            content_type_map = {
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.png': 'image/png',
-                '.gif': 'image/gif',
-                '.webp': 'image/webp',
-                '.bmp': 'image/bmp'
-            }
-            content_type = content_type_map.get(file_extension, 'image/jpeg')
-            
-            response = HttpResponse(f.read(), content_type=content_type)
-            response['Content-Disposition'] = f'inline; filename="{filename}"'
-            response['Cache-Control'] = 'public, max-age=3600'  # Cache for 1 hour
-            
-            # Add CORS headers for maximum compatibility (Firebase, Flutter web, etc.)
-            response['Access-Control-Allow-Origin'] = '*'
-            response['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS, PATCH'
-            response['Access-Control-Allow-Headers'] = 'accept, accept-encoding, authorization, content-type, dnt, origin, user-agent, x-csrftoken, x-requested-with'
-            response['Access-Control-Max-Age'] = '86400'  # Cache for 24 hours
-            response['Access-Control-Allow-Credentials'] = 'true'
-            
-            return response
-            
-    except Exception as e:
+    file_path = ProxyBackend().find(filename)
+    if file_path is None:
         raise Http404("Image not found")
 
+    # Determine content type based on file extension
+    file_extension = os.path.splitext(filename)[1].lower()
+    content_type_map = {
+        '.jpg': 'image/jpeg',
+        '.jpeg': 'image/jpeg',
+        '.png': 'image/png',
+        '.gif': 'image/gif',
+        '.webp': 'image/webp',
+        '.bmp': 'image/bmp'
+    }
+    content_type = content_type_map.get(file_extension, 'image/jpeg')
+
+    # Phones get a resized WebP/JPEG variant picked by ?w= and Accept
+    served_path, content_type = negotiate_image(request, file_path, content_type)
+    served_name = os.path.splitext(filename)[0] + os.path.splitext(served_path)[1]
+
+    # Streamed from disk (or by the front-end server), never read into memory;
+    # revalidations with If-None-Match / If-Modified-Since get a 304
+    response = file_response(request, served_path, content_type, served_name)
+    response['Content-Disposition'] = f'inline; filename="{served_name}"'
+    patch_vary_headers(response, ['Accept'])
+    # Upload names are unique, so a name always refers to the same bytes
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+
+    # Add CORS headers for maximum compatibility (Firebase, Flutter web, etc.)
+    response['Access-Control-Allow-Origin'] = '*'
+    response['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS, PATCH'
+    response['Access-Control-Allow-Headers'] = 'accept, accept-encoding, authorization, content-type, dnt, if-modified-since, if-none-match, if-range, origin, range, user-agent, x-csrftoken, x-requested-with'
+    response['Access-Control-Expose-Headers'] = 'accept-ranges, content-length, content-range, etag, last-modified'
+    response['Access-Control-Max-Age'] = '86400'  # Cache for 24 hours
+    response['Access-Control-Allow-Credentials'] = 'true'
+
+    return response
+
 
 @api_view(['GET', 'OPTIONS'])
 @permission_classes([AllowAny])
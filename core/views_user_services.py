@@ -4,10 +4,7 @@ from rest_framework.permissions import AllowAny
 from rest_framework import status
 from .models import Service, SubService
 from .serializer import ServiceSerializer, ServiceCreateSerializer, SubServiceSerializer, SubServiceCreateSerializer
-from django.conf import settings
-import os
-import uuid
-import time
+from .media import get_media_store
 
 
 @api_view(['POST'])
@@ -24,22 +21,8 @@ def user_create_service(request):
             uploaded_file = request.FILES['image']
             print(f"DEBUG: Image file received: {uploaded_file.name}")
 
-            # Generate unique filename
-            file_extension = os.path.splitext(uploaded_file.name)[1]
-            timestamp = int(time.time())
-            unique_filename = f"user_service_{timestamp}_{uuid.uuid4().hex[:8]}{file_extension}"
-
-            # Save file
-            media_dir = settings.MEDIA_ROOT
-            os.makedirs(media_dir, exist_ok=True)
-            file_path = os.path.join(media_dir, unique_filename)
-
-            with open(file_path, 'wb') as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
-
-            # ✅ Full URL (important!)
-            icon_url = request.build_absolute_uri(f"{settings.MEDIA_URL}{unique_filename}")
+            # Save file and keep its full URL
+            icon_url = get_media_store().save(uploaded_file, request).url
             print(f"DEBUG: Set icon_url to: {icon_url}")
 
         # Copy request data and include icon if uploaded
@@ -84,22 +67,8 @@ def user_create_sub_service(request):
             uploaded_file = request.FILES['image']
             print(f"DEBUG: Image file received: {uploaded_file.name}")
 
-            # Generate unique filename
-            file_extension = os.path.splitext(uploaded_file.name)[1]
-            timestamp = int(time.time())
-            unique_filename = f"user_subservice_{timestamp}_{uuid.uuid4().hex[:8]}{file_extension}"
-
-            # Save file
-            media_dir = settings.MEDIA_ROOT
-            os.makedirs(media_dir, exist_ok=True)
-            file_path = os.path.join(media_dir, unique_filename)
-
-            with open(file_path, 'wb') as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
-
-            # ✅ Full URL (important!)
-            icon_url = request.build_absolute_uri(f"{settings.MEDIA_URL}{unique_filename}")
+            # Save file and keep its full URL
+            icon_url = get_media_store().save(uploaded_file, request).url
             print(f"DEBUG: Set icon_url to: {icon_url}")
 
         # Copy request data and include icon if uploaded
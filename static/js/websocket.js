@@ -4,6 +4,11 @@ class BookingWebSocket {
         this.reconnectAttempts = 0;
         this.maxReconnectAttempts = 5;
         this.reconnectInterval = 3000;
+        // Highest sequence number up to which every event has been applied
+        this.lastSeq = null;
+        this.seenSeqs = new Set();
+        // Topics such as 'date:2025-10-31' or 'service:Massage'; empty receives everything
+        this.topics = new Set();
     }
 
     connect(token) {
@@ -15,12 +20,16 @@ class BookingWebSocket {
         this.socket.onopen = (event) => {
             console.log('WebSocket connected');
             this.reconnectAttempts = 0;
-            this.requestBookings();
+            this.sendSubscriptions();
+            this.resumeOrRequestBookings();
         };
 
         this.socket.onmessage = (event) => {
             const data = JSON.parse(event.data);
-            this.handleMessage(data);
+            if (this.trackSequence(data)) {
+                this.handleMessage(data);
+            }
+            this.acknowledge(data);
         };
 
         this.socket.onclose = (event) => {
@@ -33,6 +42,49 @@ class BookingWebSocket {
         };
     }
 
+    // Tell the server a frame was handled so it sends more; it holds frames
+    // back once too many are unacknowledged
+    acknowledge(data) {
+        const seqs = data.type === 'bookings_batch'
+            ? data.events.map(event => event.seq).filter(seq => typeof seq === 'number')
+            : [data.seq].filter(seq => typeof seq === 'number');
+        if (seqs.length && this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({
+                type: 'ack',
+                seq: Math.max(...seqs)
+            }));
+        }
+    }
+
+    // Returns false for an event frame that was already applied
+    trackSequence(data) {
+        if (typeof data.seq !== 'number') {
+            return true;
+        }
+        if (data.type === 'bookings_data') {
+            this.lastSeq = data.seq;
+            this.seenSeqs.clear();
+            return true;
+        }
+        if (data.type === 'resume_complete') {
+            this.lastSeq = Math.max(this.lastSeq || 0, data.seq);
+        } else {
+            if (this.lastSeq !== null && (data.seq <= this.lastSeq || this.seenSeqs.has(data.seq))) {
+                return false;
+            }
+            this.seenSeqs.add(data.seq);
+        }
+        if (this.lastSeq !== null) {
+            while (this.seenSeqs.has(this.lastSeq + 1)) {
+                this.lastSeq++;
+            }
+            this.seenSeqs.forEach(seq => {
+                if (seq <= this.lastSeq) this.seenSeqs.delete(seq);
+            });
+        }
+        return true;
+    }
+
     handleMessage(data) {
         switch (data.type) {
             case 'booking_created':
@@ -47,6 +99,18 @@ class BookingWebSocket {
             case 'bookings_data':
                 this.onBookingsData(data.data);
                 break;
+            case 'bookings_batch':
+                this.onBookingsBatch(data.events);
+                break;
+            case 'resume_complete':
+                console.log('Caught up to event', data.seq);
+                break;
+            case 'subscriptions':
+                console.log('Subscribed topics:', data.topics);
+                break;
+            case 'error':
+                console.error('Server error:', data.message);
+                break;
             default:
                 console.log('Unknown message type:', data.type);
         }
@@ -102,6 +166,23 @@ class BookingWebSocket {
         }
     }
 
+    onBookingsBatch(events) {
+        // Several coalesced events in one frame; skip any already applied
+        events = events.filter(event => this.trackSequence(event));
+        if (!events.length) {
+            return;
+        }
+        console.log('Booking batch received:', events);
+
+        if (window.applyBookingEvents) {
+            // Let the page apply the whole batch and render once
+            window.applyBookingEvents(events);
+            this.showNotification('Bookings Changed', `${events.length} bookings were created or updated`, 'info');
+        } else {
+            events.forEach(event => this.handleMessage(event));
+        }
+    }
+
     onBookingsData(bookingsData) {
         console.log('Bookings data received:', bookingsData);
         
@@ -119,6 +200,46 @@ class BookingWebSocket {
         }
     }
 
+    // Only receive events for the given topics, e.g. subscribe(['date:2025-10-31'])
+    subscribe(topics) {
+        topics.forEach(topic => this.topics.add(topic));
+        this.sendSubscriptions();
+        this.requestBookings();
+    }
+
+    unsubscribe(topics) {
+        topics.forEach(topic => this.topics.delete(topic));
+        if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({
+                type: 'unsubscribe',
+                topics: topics
+            }));
+        }
+        this.requestBookings();
+    }
+
+    sendSubscriptions() {
+        if (this.topics.size && this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({
+                type: 'subscribe',
+                topics: Array.from(this.topics)
+            }));
+        }
+    }
+
+    // After a reconnect ask only for the events missed since lastSeq; the
+    // server answers with a full bookings_data snapshot if it cannot replay them
+    resumeOrRequestBookings() {
+        if (this.lastSeq === null) {
+            this.requestBookings();
+        } else if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({
+                type: 'resume',
+                last_seq: this.lastSeq
+            }));
+        }
+    }
+
     handleReconnect() {
         if (this.reconnectAttempts < this.maxReconnectAttempts) {
             this.reconnectAttempts++;
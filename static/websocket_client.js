@@ -12,6 +12,11 @@ class BookingWebSocketClient {
         this.maxReconnectAttempts = options.maxReconnectAttempts || 5;
         this.reconnectInterval = options.reconnectInterval || 3000;
         this.autoConnect = options.autoConnect !== false;
+        // Highest sequence number up to which every event has been applied
+        this.lastSeq = null;
+        this.seenSeqs = new Set();
+        // Topics such as 'date:2025-10-31' or 'service:Massage'; empty receives everything
+        this.topics = new Set();
         
         // Event callbacks
         this.onConnect = options.onConnect || (() => {});
@@ -38,15 +43,20 @@ class BookingWebSocketClient {
                 this.reconnectAttempts = 0;
                 this.onConnect(event);
                 
-                // Request current bookings
-                this.requestBookings();
+                // Restore topic subscriptions, then request current bookings
+                // or only the missed events after a reconnect
+                this.sendSubscriptions();
+                this.resumeOrRequestBookings();
             };
 
             this.socket.onmessage = (event) => {
                 try {
                     const data = JSON.parse(event.data);
                     console.log('📨 Received message:', data);
-                    this.handleMessage(data);
+                    if (this.trackSequence(data)) {
+                        this.handleMessage(data);
+                    }
+                    this.acknowledge(data);
                 } catch (error) {
                     console.error('❌ Error parsing message:', error);
                 }
@@ -92,6 +102,49 @@ class BookingWebSocketClient {
         }
     }
 
+    // Tell the server a frame was handled so it sends more; it holds frames
+    // back once too many are unacknowledged
+    acknowledge(data) {
+        const seqs = data.type === 'bookings_batch'
+            ? data.events.map(event => event.seq).filter(seq => typeof seq === 'number')
+            : [data.seq].filter(seq => typeof seq === 'number');
+        if (seqs.length && this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({
+                type: 'ack',
+                seq: Math.max(...seqs)
+            }));
+        }
+    }
+
+    // Returns false for an event frame that was already applied
+    trackSequence(data) {
+        if (typeof data.seq !== 'number') {
+            return true;
+        }
+        if (data.type === 'bookings_data') {
+            this.lastSeq = data.seq;
+            this.seenSeqs.clear();
+            return true;
+        }
+        if (data.type === 'resume_complete') {
+            this.lastSeq = Math.max(this.lastSeq || 0, data.seq);
+        } else {
+            if (this.lastSeq !== null && (data.seq <= this.lastSeq || this.seenSeqs.has(data.seq))) {
+                return false;
+            }
+            this.seenSeqs.add(data.seq);
+        }
+        if (this.lastSeq !== null) {
+            while (this.seenSeqs.has(this.lastSeq + 1)) {
+                this.lastSeq++;
+            }
+            this.seenSeqs.forEach(seq => {
+                if (seq <= this.lastSeq) this.seenSeqs.delete(seq);
+            });
+        }
+        return true;
+    }
+
     handleMessage(data) {
         switch (data.type) {
             case 'booking_created':
@@ -110,6 +163,22 @@ class BookingWebSocketClient {
                 console.log('📋 Received bookings data:', data.data);
                 this.onBookingsData(data.data);
                 break;
+            case 'bookings_batch':
+                // Coalesced events in one frame; apply each one not already seen
+                console.log('📦 Received booking batch:', data.events);
+                data.events
+                    .filter(event => this.trackSequence(event))
+                    .forEach(event => this.handleMessage(event));
+                break;
+            case 'resume_complete':
+                console.log('🔁 Caught up to event', data.seq);
+                break;
+            case 'subscriptions':
+                console.log('🏷️ Subscribed topics:', data.topics);
+                break;
+            case 'error':
+                console.error('❌ Server error:', data.message);
+                break;
             default:
                 console.log('❓ Unknown message type:', data.type);
         }
@@ -126,6 +195,45 @@ class BookingWebSocketClient {
         }
     }
 
+    // Only receive events for the given topics, e.g. subscribe(['date:2025-10-31'])
+    subscribe(topics) {
+        topics.forEach(topic => this.topics.add(topic));
+        this.sendSubscriptions();
+        this.requestBookings();
+    }
+
+    unsubscribe(topics) {
+        topics.forEach(topic => this.topics.delete(topic));
+        if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({
+                type: 'unsubscribe',
+                topics: topics
+            }));
+        }
+        this.requestBookings();
+    }
+
+    sendSubscriptions() {
+        if (this.topics.size && this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({
+                type: 'subscribe',
+                topics: Array.from(this.topics)
+            }));
+        }
+    }
+
+    resumeOrRequestBookings() {
+        if (this.lastSeq === null) {
+            this.requestBookings();
+        } else if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+            console.log(`📤 Resuming after event ${this.lastSeq}...`);
+            this.socket.send(JSON.stringify({
+                type: 'resume',
+                last_seq: this.lastSeq
+            }));
+        }
+    }
+
     // Utility method to send custom messages
     sendMessage(type, data = {}) {
         if (this.socket && this.socket.readyState === WebSocket.OPEN) {
@@ -171,6 +279,7 @@ class FlutterWebSocketHelper {
                 if (options.onError) options.onError(error);
             },
             onBookingCreated: (booking) => {
+                this.bookings = this.bookings.filter(b => b.id !== booking.id);
                 this.bookings.unshift(booking);
                 console.log('🆕 New booking added to list');
                 if (options.onBookingCreated) options.onBookingCreated(booking, this.bookings);